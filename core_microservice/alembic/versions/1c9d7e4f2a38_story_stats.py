@@ -0,0 +1,39 @@
+"""Story stats
+
+Revision ID: 1c9d7e4f2a38
+Revises: 7a5f0e3b1d62
+Create Date: 2026-10-17 19:02:44.731950
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c9d7e4f2a38'
+down_revision: Union[str, None] = '7a5f0e3b1d62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('storystats',
+    sa.Column('story_id', sa.Integer(), nullable=False),
+    sa.Column('chapter_count', sa.Integer(), nullable=False),
+    sa.Column('published_chapter_count', sa.Integer(), nullable=False),
+    sa.Column('word_count', sa.Integer(), nullable=False),
+    sa.Column('last_chapter_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['story_id'], ['story.id'], name=op.f('fk_storystats_story_id_story'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('story_id', name=op.f('pk_storystats'))
+    )
+    op.execute(
+        "INSERT INTO storystats (story_id, chapter_count, published_chapter_count, word_count, last_chapter_at) "
+        "SELECT story_id, count(*), count(*) FILTER (WHERE is_published), "
+        "coalesce(sum(word_count) FILTER (WHERE is_published), 0), max(coalesce(updated_at, created_at)) "
+        "FROM chapter GROUP BY story_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('storystats')
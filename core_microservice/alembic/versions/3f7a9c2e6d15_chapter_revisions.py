@@ -0,0 +1,36 @@
+"""Chapter revisions
+
+Revision ID: 3f7a9c2e6d15
+Revises: 8d3c61f0b2a7
+Create Date: 2026-10-17 11:32:08.904417
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7a9c2e6d15'
+down_revision: Union[str, None] = '8d3c61f0b2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('chapterrevision',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chapter_id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('is_snapshot', sa.Boolean(), nullable=False),
+    sa.Column('chain_length', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['chapter_id'], ['chapter.id'], name=op.f('fk_chapterrevision_chapter_id_chapter'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_chapterrevision')),
+    sa.UniqueConstraint('chapter_id', 'revision', name='unique_revision_per_chapter')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chapterrevision')
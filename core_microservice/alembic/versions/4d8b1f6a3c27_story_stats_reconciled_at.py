@@ -0,0 +1,25 @@
+"""Story stats reconciled at
+
+Revision ID: 4d8b1f6a3c27
+Revises: 9e4a2c7b5f18
+Create Date: 2026-10-17 23:41:19.602815
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8b1f6a3c27'
+down_revision: Union[str, None] = '9e4a2c7b5f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('storystats', sa.Column('reconciled_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('storystats', 'reconciled_at')
@@ -0,0 +1,32 @@
+"""Story keyset pagination indexes
+
+Revision ID: 5b2e8f1c7a94
+Revises: ca544509c853
+Create Date: 2026-10-16 09:12:41.208113
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e8f1c7a94'
+down_revision: Union[str, None] = 'ca544509c853'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_story_created_at_id', 'story', ['created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_story_updated_at_id',
+        'story',
+        [sa.text('coalesce(updated_at, created_at)'), 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_story_updated_at_id', table_name='story')
+    op.drop_index('ix_story_created_at_id', table_name='story')
@@ -0,0 +1,66 @@
+"""Chapter table of contents
+
+Revision ID: 7a5f0e3b1d62
+Revises: e8b2d4a67c19
+Create Date: 2026-10-17 17:45:30.182604
+
+"""
+import math
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from src.compression import decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a5f0e3b1d62'
+down_revision: Union[str, None] = 'e8b2d4a67c19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# rows counted per round trip, keeps memory flat on large tables
+BATCH_SIZE = 500
+WORDS_PER_MINUTE = 238
+
+
+def upgrade() -> None:
+    op.add_column('chapter', sa.Column('word_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chapter', sa.Column('reading_time', sa.Integer(), server_default='0', nullable=False))
+
+    # content is compressed, so the counts are worked out here
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text("SELECT id, content FROM chapter WHERE id > :last_id ORDER BY id LIMIT :batch_size"),
+            {'last_id': last_id, 'batch_size': BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        counts = []
+        for row_id, content in rows:
+            word_count = len(decompress_text(bytes(content)).split())
+            counts.append({
+                'id': row_id,
+                'word_count': word_count,
+                'reading_time': math.ceil(word_count / WORDS_PER_MINUTE)
+            })
+        connection.execute(
+            sa.text("UPDATE chapter SET word_count = :word_count, reading_time = :reading_time WHERE id = :id"),
+            counts
+        )
+        last_id = rows[-1][0]
+
+    op.create_index(
+        'ix_chapter_toc',
+        'chapter',
+        ['story_id', 'is_published', 'id'],
+        unique=False,
+        postgresql_include=['title', 'created_at', 'updated_at', 'word_count', 'reading_time']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chapter_toc', table_name='chapter')
+    op.drop_column('chapter', 'reading_time')
+    op.drop_column('chapter', 'word_count')
@@ -0,0 +1,60 @@
+"""Compress chapter content
+
+Revision ID: 8d3c61f0b2a7
+Revises: 5b2e8f1c7a94
+Create Date: 2026-10-17 10:04:27.519360
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from src.compression import compress_text, decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3c61f0b2a7'
+down_revision: Union[str, None] = '5b2e8f1c7a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# rows converted per round trip, keeps memory flat on large tables
+BATCH_SIZE = 500
+
+
+def _convert(source: str, target: str, convert) -> None:
+    connection = op.get_bind()
+    chapter = sa.table('chapter', sa.column('id', sa.Integer), sa.column(source), sa.column(target))
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(chapter.c.id, chapter.c[source])
+            .where(chapter.c.id > last_id)
+            .order_by(chapter.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            chapter.update()
+            .where(chapter.c.id == sa.bindparam('row_id'))
+            .values({target: sa.bindparam('value')}),
+            [{'row_id': row_id, 'value': convert(value)} for row_id, value in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    op.add_column('chapter', sa.Column('content_compressed', sa.LargeBinary(), nullable=True))
+    _convert('content', 'content_compressed', compress_text)
+    with op.batch_alter_table('chapter') as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_compressed', new_column_name='content', nullable=False)
+
+
+def downgrade() -> None:
+    op.add_column('chapter', sa.Column('content_text', sa.Text(), nullable=True))
+    _convert('content', 'content_text', lambda value: decompress_text(bytes(value)))
+    with op.batch_alter_table('chapter') as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_text', new_column_name='content', nullable=False)
@@ -0,0 +1,25 @@
+"""Story stats updated at
+
+Revision ID: 9e4a2c7b5f18
+Revises: 1c9d7e4f2a38
+Create Date: 2026-10-17 21:14:05.318204
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4a2c7b5f18'
+down_revision: Union[str, None] = '1c9d7e4f2a38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('storystats', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('storystats', 'updated_at')
@@ -0,0 +1,78 @@
+"""Full text search
+
+Revision ID: c41e5b8d9f03
+Revises: 3f7a9c2e6d15
+Create Date: 2026-10-17 14:21:55.610284
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from src.compression import decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e5b8d9f03'
+down_revision: Union[str, None] = '3f7a9c2e6d15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# rows indexed per round trip, keeps memory flat on large tables
+BATCH_SIZE = 500
+
+CHAPTER_DOCUMENT = sa.text(
+    "UPDATE chapter SET search_vector = "
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', :content), 'B') "
+    "WHERE id = :id"
+)
+
+
+def upgrade() -> None:
+    op.add_column('story', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('english', name), 'A') || "
+            "setweight(to_tsvector('english', blurb), 'B')",
+            persisted=True
+        )
+    ))
+    op.add_column('chapter', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # chapter content is compressed, so published chapters are indexed from here
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text(
+                "SELECT id, content FROM chapter WHERE is_published AND id > :last_id "
+                "ORDER BY id LIMIT :batch_size"
+            ),
+            {'last_id': last_id, 'batch_size': BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            CHAPTER_DOCUMENT,
+            [{'id': row_id, 'content': decompress_text(bytes(content))} for row_id, content in rows]
+        )
+        last_id = rows[-1][0]
+
+    op.create_index('ix_story_search_vector', 'story', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index(
+        'ix_chapter_search_vector',
+        'chapter',
+        ['search_vector'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_where=sa.text('is_published')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chapter_search_vector', table_name='chapter')
+    op.drop_index('ix_story_search_vector', table_name='story')
+    op.drop_column('chapter', 'search_vector')
+    op.drop_column('story', 'search_vector')
@@ -0,0 +1,42 @@
+"""Autocomplete trigram indexes
+
+Revision ID: e8b2d4a67c19
+Revises: c41e5b8d9f03
+Create Date: 2026-10-17 16:08:13.447291
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b2d4a67c19'
+down_revision: Union[str, None] = 'c41e5b8d9f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_story_name_trgm',
+        'story',
+        ['name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_user_username_trgm',
+        'user',
+        ['username'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'username': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_username_trgm', table_name='user')
+    op.drop_index('ix_story_name_trgm', table_name='story')
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import AsyncIterator, List, Tuple
+from src.compression import (
+    CODEC_RAW,
+    HEADER_SIZE,
+    _load_dictionary,
+    compress_text,
+    decompress_text,
+    iter_decompressed,
+    read_header,
+    train_dictionary
+)
+from src.settings import app_config
+
+NAMES = "Mara Tobias Ilse Corin Wren Dalia Oren Sefa".split()
+WORDS = (
+    "the of and a to in was it that for on with her his had as at they but from "
+    "door window light rain road night morning house river city voice hand eyes "
+    "slowly again still never always almost quietly suddenly "
+    "walked turned looked waited whispered laughed remembered opened closed ran"
+).split()
+SAID = "said asked replied muttered answered".split()
+
+
+def _paragraph(rng: random.Random) -> str:
+    # narration, or a line of dialogue with its attribution
+    words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 90))).capitalize()
+    if rng.random() < 0.4:
+        return f'"{words}," {rng.choice(NAMES)} {rng.choice(SAID)}.'
+    return f"{words}."
+
+
+def _chapter(rng: random.Random, words: int) -> str:
+    paragraphs = []
+    while sum(len(paragraph.split()) for paragraph in paragraphs) < words:
+        paragraphs.append(_paragraph(rng))
+    return '\n\n'.join(paragraphs)
+
+
+async def _chunks(payload: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    # the stored value a chunk at a time, as ChapterService._stored_chunks reads it
+    for position in range(0, len(payload), chunk_size):
+        yield payload[position:position + chunk_size]
+
+
+async def _stream(stored: bytes, chunk_size: int) -> Tuple[float, float]:
+    # ChapterService.stream_content of the whole text without the database: time to the first piece, and to the last
+    codec_id, size = read_header(stored)
+    started = time.perf_counter()
+    first = None
+    if codec_id == CODEC_RAW:
+        pieces = _chunks(stored[HEADER_SIZE:], chunk_size)
+    else:
+        pieces = iter_decompressed(codec_id, _chunks(stored[HEADER_SIZE:], chunk_size), 0, size - 1)
+    async for _ in pieces:
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def _p99(timings: List[float]) -> float:
+    return statistics.quantiles(timings, n=100)[98] if len(timings) > 1 else timings[0]
+
+
+async def _measure(chapters: List[str], codec: str) -> Tuple[float, float, float, float, float]:
+    stored = [compress_text(chapter, codec) for chapter in chapters]
+    ratio = sum(len(chapter.encode('utf-8')) for chapter in chapters) / sum(len(data) for data in stored)
+
+    reads = []
+    for data, chapter in zip(stored, chapters):
+        started = time.perf_counter()
+        assert decompress_text(data) == chapter
+        reads.append(time.perf_counter() - started)
+
+    firsts, streams = [], []
+    for data in stored:
+        first, whole = await _stream(data, app_config.CHAPTER_STREAM_CHUNK_SIZE)
+        firsts.append(first)
+        streams.append(whole)
+    return ratio, statistics.median(reads), _p99(reads), statistics.median(firsts), statistics.median(streams)
+
+
+async def main(chapters: int, sizes: Tuple[int, ...], samples: int, seed: int) -> None:
+    rng = random.Random(seed)
+    # the dictionary is trained on one set of chapters and measured on others, as a trained one meets new writes
+    dictionary = train_dictionary(_chapter(rng, rng.choice(sizes)) for _ in range(samples))
+    corpus = {words: [_chapter(rng, words) for _ in range(chapters)] for words in sizes}
+
+    path = os.path.join(tempfile.mkdtemp(), 'chapters.dict')
+    with open(path, 'wb') as output:
+        output.write(dictionary)
+    settings = app_config.CHAPTER_COMPRESSION_DICT
+
+    # medians, but for the p99 of a whole read
+    print(
+        f"{'words':>6} {'codec':>9} {'ratio':>6} {'read ms':>8} {'p99 ms':>7} {'first ms':>9} {'stream ms':>10}"
+        f"   (level {app_config.CHAPTER_COMPRESSION_LEVEL}, {chapters} chapters each, {len(dictionary)} byte dictionary)"
+    )
+    try:
+        for words in sizes:
+            for name, codec, dict_path in (
+                ('raw', 'none', None),
+                ('zlib', 'zlib', None),
+                ('zstd', 'zstd', None),
+                ('zstd+dict', 'zstd', path)
+            ):
+                app_config.CHAPTER_COMPRESSION_DICT = dict_path
+                ratio, read, read_p99, first, stream = await _measure(corpus[words], codec)
+                print(
+                    f"{words:>6} {name:>9} {ratio:>6.2f} {read * 1000:>8.3f} {read_p99 * 1000:>7.3f} "
+                    f"{first * 1000:>9.3f} {stream * 1000:>10.3f}"
+                )
+    finally:
+        app_config.CHAPTER_COMPRESSION_DICT = settings
+        _load_dictionary.cache_clear()
+        os.remove(path)
+
+
+# python -m benchmarks.compression
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Chapter storage ratio and read latency per compression codec")
+    parser.add_argument('--chapters', type=int, default=200, help="chapters measured per size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[150, 1000, 5000], help="chapter lengths in words")
+    parser.add_argument('--samples', type=int, default=500, help="chapters the dictionary is trained on")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.chapters, tuple(args.sizes), args.samples, args.seed))
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from src.background.jobs import Worker, job, status_key, stream_key
+
+QUEUE = 'benchmark'
+
+
+class Work(BaseModel):
+    # seconds the handler waits, standing in for the database or network time of a real job
+    wait: float
+
+
+@job(queue=QUEUE, name='benchmark.wait')
+async def wait(payload: Work) -> None:
+    await asyncio.sleep(payload.wait)
+
+
+async def _run(redis: Redis, jobs: int, concurrency: int, work: float) -> None:
+    await redis.delete(stream_key(QUEUE))
+    worker = Worker(redis, {QUEUE: concurrency}, consumer='benchmark')
+    await worker._ensure_group(QUEUE)
+
+    started = time.perf_counter()
+    job_ids = [await wait.enqueue(redis, Work(wait=work)) for _ in range(jobs)]
+    enqueued = time.perf_counter() - started
+
+    running = asyncio.create_task(worker.run())
+    started = time.perf_counter()
+    while worker.processed < jobs:
+        await asyncio.sleep(0.001)
+    processed = time.perf_counter() - started
+    running.cancel()
+    await redis.delete(*(status_key(job_id) for job_id in job_ids))
+
+    print(f"{concurrency:>11} {jobs / enqueued:>13.0f} {jobs / processed:>13.0f}")
+
+
+async def main(url: str, jobs: int, concurrency: int, work: float) -> None:
+    # a real redis, fakeredis answers a blocking read at once and idle consumers would starve the loop
+    redis = Redis.from_url(url)
+
+    print(f"{'concurrency':>11} {'enqueued/s':>13} {'processed/s':>13}   ({jobs} jobs of {work * 1000:.0f}ms)")
+    for slots in sorted({1, concurrency // 4 or 1, concurrency}):
+        await _run(redis, jobs, slots, work)
+    await redis.delete(stream_key(QUEUE))
+    await redis.aclose()
+
+
+# python -m benchmarks.jobs --redis-url redis://localhost:6379/15
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput of the job queue, enqueueing and through a worker")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--work', type=float, default=0.005, help="seconds each job waits")
+    args = parser.parse_args()
+    asyncio.run(main(args.redis_url, args.jobs, args.concurrency, args.work))
@@ -0,0 +1,98 @@
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from types import SimpleNamespace
+from typing import Callable
+from src.logging import CustomFormatter, DeferredQueueHandler
+
+LOG_FORMAT = "%(asctime)s | %(name)s | %(levelname)s | %(message)s"
+
+
+class EagerFormatter(logging.Formatter):
+    # CustomFormatter as it was, building a Formatter for every record
+    def format(self, record):
+        return logging.Formatter(CustomFormatter.blue + LOG_FORMAT + CustomFormatter.reset).format(record)
+
+
+def _handlers(directory: str, formatter: logging.Formatter):
+    console = logging.StreamHandler(open(os.devnull, 'w'))
+    console.setFormatter(formatter)
+    file = RotatingFileHandler(os.path.join(directory, 'benchmark.log'), maxBytes=10485760, backupCount=5, encoding='utf-8')
+    file.setFormatter(logging.Formatter(LOG_FORMAT))
+    return [console, file]
+
+
+def _logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def _eager(logger: logging.Logger, story: SimpleNamespace) -> None:
+    # the log calls of create_story, formatted with f-strings before the level check
+    logger.info(f"Attempting to create story with name: {story.name}")
+    logger.debug(f"Checking for existing story with same title")
+    logger.debug(f"Creating new story object")
+    logger.debug(f"Story object created: {story.__dict__}")
+    logger.debug(f"Adding story to database")
+    logger.debug(f"Committing transaction")
+    logger.info(f"Successfully created story with ID: {story.id}")
+
+
+def _lazy(logger: logging.Logger, story: SimpleNamespace) -> None:
+    logger.info("Attempting to create story with name: %s", story.name)
+    logger.debug("Checking for existing story with same title")
+    logger.debug("Creating new story object")
+    logger.debug("Story object created: %s", story.__dict__)
+    logger.debug("Adding story to database")
+    logger.debug("Committing transaction")
+    logger.info("Successfully created story with ID: %s", story.id)
+
+
+def _run(requests: int, logger: logging.Logger, calls: Callable, listener=None) -> None:
+    story = SimpleNamespace(id=42, name="A story", blurb="A blurb " * 20, user_id=7)
+    started = time.perf_counter()
+    for _ in range(requests):
+        calls(logger, story)
+    calling = time.perf_counter() - started
+    if listener is not None:
+        # stopping the listener waits for it to write out everything queued
+        listener.stop()
+    total = time.perf_counter() - started
+    print(f"{calling / requests * 1_000_000:>10.1f} {total / requests * 1_000_000:>10.1f}")
+
+
+def main(requests: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'':>8} {'caller':>10} {'total':>10}   (us per request of 7 log calls at INFO, {requests} requests)")
+
+        before = _logger('benchmark.before')
+        for handler in _handlers(directory, EagerFormatter()):
+            before.addHandler(handler)
+        print(f"{'before':>8} ", end='')
+        _run(requests, before, _eager)
+
+        after = _logger('benchmark.after')
+        log_queue = queue.SimpleQueue()
+        after.addHandler(DeferredQueueHandler(log_queue))
+        listener = QueueListener(log_queue, *_handlers(directory, CustomFormatter(LOG_FORMAT)), respect_handler_level=True)
+        listener.start()
+        print(f"{'after':>8} ", end='')
+        _run(requests, after, _lazy, listener)
+
+        for logger in (before, after):
+            for handler in logger.handlers:
+                handler.close()
+
+
+# python -m benchmarks.logs
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cost of a request's log calls on the calling thread, before and after the queued handlers")
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+    main(args.requests)
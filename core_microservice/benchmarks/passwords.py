@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+from uuid import uuid4
+import httpx
+from fastapi import FastAPI
+from redis.asyncio import Redis
+from sqlmodel import SQLModel
+from starlette.concurrency import run_in_threadpool
+from src.cache import get_redis
+from src.database import async_session, engine
+from src.middleware.queries import QueryStatsMiddleware
+from src.models import Story, User
+from src.routes import stories, users
+from src.services.auth import auth_service
+from src.services.passwords import PasswordHasher, pwd_context
+from src.services.tokens import refresh_token_store
+
+PASSWORD = 'correct horse battery staple'
+
+
+class ThreadpoolHasher:
+    # what AuthService did before the pool, bcrypt in starlette's threadpool
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await run_in_threadpool(pwd_context.verify, plain_password, hashed_password)
+
+
+def _p99(samples: List[float]) -> float:
+    return statistics.quantiles(samples, n=100)[98] if len(samples) > 1 else samples[0]
+
+
+async def _probe(lags: List[float], stop: asyncio.Event) -> None:
+    # how late the loop gets back to a task sleeping a millisecond
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def _reads(client: httpx.AsyncClient, story_id: int, latencies: List[float], stop: asyncio.Event, interval: float) -> None:
+    # story pages requested at a steady rate whatever the server is doing, each timed from when it was sent
+    async def read() -> None:
+        started = time.perf_counter()
+        response = await client.get(f'/api/stories/{story_id}')
+        assert response.status_code == 200, response.text
+        latencies.append(time.perf_counter() - started)
+
+    pending = set()
+    while not stop.is_set():
+        task = asyncio.create_task(read())
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        await asyncio.sleep(interval)
+    await asyncio.gather(*pending)
+
+
+async def _run(client: httpx.AsyncClient, email: str, story_id: int, logins: int, concurrency: int, interval: float) -> None:
+    login_latencies: List[float] = []
+    read_latencies: List[float] = []
+    lags: List[float] = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def login() -> None:
+        async with slots:
+            started = time.perf_counter()
+            response = await client.post('/api/users/login', json={'email': email, 'password': PASSWORD})
+            assert response.status_code == 200, response.text
+            login_latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    background = [
+        asyncio.create_task(_probe(lags, stop)),
+        asyncio.create_task(_reads(client, story_id, read_latencies, stop, interval))
+    ]
+    started = time.perf_counter()
+    if logins:
+        await asyncio.gather(*(login() for _ in range(logins)))
+    else:
+        await asyncio.sleep(2)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*background)
+
+    print(
+        f"{logins / elapsed if logins else 0:>10.1f} {_p99(login_latencies) * 1000 if logins else 0:>13.0f} "
+        f"{statistics.median(read_latencies) * 1000:>12.1f} {_p99(read_latencies) * 1000:>11.1f} {_p99(lags) * 1000:>11.1f}"
+    )
+
+
+async def main(url: str, logins: int, concurrency: int, workers: int, interval: float) -> None:
+    # the login and story routes as the app serves them, in process, with the database of DATABASE_URL
+    redis = Redis.from_url(url)
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware)
+    app.include_router(users.router)
+    app.include_router(stories.router)
+    app.dependency_overrides[get_redis] = lambda: redis
+
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    username = f"benchmark-{uuid4().hex[:8]}"
+    hashed = pwd_context.hash(PASSWORD)
+    async with async_session() as db:
+        user = User(username=username, email=f"{username}@example.com", password_hash=hashed)
+        db.add(user)
+        await db.flush()
+        story = Story(user_id=user.id, name="A story", blurb="A blurb")
+        db.add(story)
+        await db.commit()
+        user_id, email, story_id = user.id, user.email, story.id
+
+    pool = PasswordHasher(max_workers=workers, max_pending=logins)
+    pool.start()
+    # warm the pool's processes up, so their start-up is not counted
+    await asyncio.gather(*(pool.verify(PASSWORD, hashed) for _ in range(workers)))
+    hasher = auth_service.password_hasher
+
+    print(
+        f"{'':>10} {'logins/s':>10} {'p99 login ms':>13} {'read ms':>12} {'p99 read ms':>11} {'p99 lag ms':>11}"
+        f"   ({logins} logins, {concurrency} at a time, a story read every {interval * 1000:.0f}ms)"
+    )
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://benchmark') as client:
+            for name, verifier, count in (
+                ('idle', hasher, 0),
+                ('threadpool', ThreadpoolHasher(), logins),
+                ('pool', pool, logins)
+            ):
+                auth_service.password_hasher = verifier
+                print(f"{name:>10} ", end='', flush=True)
+                await _run(client, email, story_id, count, concurrency, interval)
+    finally:
+        auth_service.password_hasher = hasher
+        pool.shutdown()
+        await refresh_token_store.revoke_all(redis, username)
+        async with async_session() as db:
+            await db.delete(await db.get(Story, story_id))
+            await db.delete(await db.get(User, user_id))
+            await db.commit()
+        await engine.dispose()
+        await redis.aclose()
+
+
+# python -m benchmarks.passwords --redis-url redis://localhost:6379/15
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Login throughput and the latency of other requests during logins, bcrypt in the threadpool and in the process pool")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--interval', type=float, default=0.01, help="seconds between story reads")
+    args = parser.parse_args()
+    asyncio.run(main(args.redis_url, args.logins, args.concurrency, args.workers, args.interval))
@@ -0,0 +1,103 @@
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+from typing import List, Tuple
+import src.services.revisions as revisions
+from src.services.revisions import apply_delta, make_delta
+from src.settings import app_config
+
+WORDS = "the of and a to in he she was it said that for on with her his had as at they but from".split()
+
+
+def _paragraph(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 120))).capitalize() + '.'
+
+
+def _edits(rng: random.Random, paragraphs: int, edits: int) -> List[str]:
+    # a chapter of blank line separated paragraphs, then versions of it with one paragraph touched each
+    chapter = [_paragraph(rng) for _ in range(paragraphs)]
+    versions = ['\n\n'.join(chapter)]
+    for _ in range(edits):
+        at = rng.randrange(len(chapter))
+        kind = rng.random()
+        if kind < 0.7:
+            words = chapter[at].split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            chapter[at] = ' '.join(words)
+        elif kind < 0.9:
+            chapter.insert(at, _paragraph(rng))
+        elif len(chapter) > 1:
+            del chapter[at]
+        versions.append('\n\n'.join(chapter))
+    return versions
+
+
+def _record(versions: List[str]) -> Tuple[List[Tuple[bool, str]], float]:
+    # what RevisionService.record stores for each version, and the time spent diffing
+    stored = [(True, versions[0])]
+    chain_length = 0
+    diffing = 0.0
+    for previous, content in zip(versions, versions[1:]):
+        started = time.perf_counter()
+        delta = make_delta(previous, content)
+        diffing += time.perf_counter() - started
+        chain_length += 1
+        if chain_length >= app_config.CHAPTER_REVISION_SNAPSHOT_INTERVAL or len(delta) >= len(content):
+            stored.append((True, content))
+            chain_length = 0
+        else:
+            stored.append((False, delta))
+    return stored, diffing / (len(versions) - 1)
+
+
+def _rebuild(stored: List[Tuple[bool, str]], revision: int) -> str:
+    # RevisionService._rebuild without the database: the snapshot at or before it, then its deltas
+    start = max(i for i in range(revision + 1) if stored[i][0])
+    text = stored[start][1]
+    for _, delta in stored[start + 1:revision + 1]:
+        text = apply_delta(text, delta)
+    return text
+
+
+def main(paragraphs: int, edits: int, seed: int) -> None:
+    versions = _edits(random.Random(seed), paragraphs, edits)
+    size = sum(len(version) for version in versions) / len(versions)
+
+    print(f"{'':>11} {'bytes/edit':>11} {'of text':>8} {'per delta':>10} {'snapshots':>10} {'diff ms':>8} {'rebuild ms':>11} {'worst ms':>9}")
+    for name, autojunk in (('autojunk', True), ('no autojunk', False)):
+        # make_delta builds its matcher through the module, so the heuristic can be switched under it,
+        # whatever make_delta itself asks for
+        revisions.SequenceMatcher = lambda isjunk, a, b, autojunk=None, _autojunk=autojunk: SequenceMatcher(
+            isjunk, a, b, autojunk=_autojunk
+        )
+        assert revisions.SequenceMatcher(None, [], []).autojunk is autojunk
+        try:
+            stored, diffing = _record(versions)
+        finally:
+            revisions.SequenceMatcher = SequenceMatcher
+
+        per_edit = sum(len(data) for _, data in stored[1:]) / edits
+        deltas = [len(data) for is_snapshot, data in stored[1:] if not is_snapshot]
+        snapshots = edits - len(deltas)
+
+        timings = []
+        for revision, version in enumerate(versions):
+            started = time.perf_counter()
+            assert _rebuild(stored, revision) == version
+            timings.append(time.perf_counter() - started)
+
+        print(
+            f"{name:>11} {per_edit:>11.0f} {per_edit / size:>8.1%} {sum(deltas) / len(deltas):>10.0f} {snapshots:>10} {diffing * 1000:>8.2f} "
+            f"{sum(timings) / len(timings) * 1000:>11.2f} {max(timings) * 1000:>9.2f}"
+        )
+
+
+# python -m benchmarks.revisions
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Revision storage per edit and rebuild time, with and without difflib's autojunk")
+    parser.add_argument('--paragraphs', type=int, default=150)
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    main(args.paragraphs, args.edits, args.seed)
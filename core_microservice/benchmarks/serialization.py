@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, List
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from src.schema import UIStoriesResponse
+from src.services.stories import _to_story_response
+from src.responses import ModelResponse
+from src.cache import to_json
+
+PAGE_SIZES = (10, 50, 100)
+
+
+def _rows(count: int) -> List[SimpleNamespace]:
+    # stand-ins for the rows of _story_response_statement
+    started = datetime(2026, 1, 1)
+    return [
+        SimpleNamespace(
+            id=i,
+            name=f"Story {i}",
+            blurb="A blurb of about the length people write for their stories. " * 3,
+            author_id=i % 7,
+            author_username=f"author{i % 7}",
+            chapter_count=24,
+            published_chapter_count=20,
+            word_count=61000,
+            last_chapter_at=started + timedelta(hours=i)
+        )
+        for i in range(count)
+    ]
+
+
+def _per_call(function: Callable[[], object], repeat: int, number: int) -> float:
+    # best of `repeat` runs, in microseconds per call
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number * 1_000_000
+
+
+def main(repeat: int, number: int) -> None:
+    loop = asyncio.new_event_loop()
+    field = create_model_field(name='Response_get_stories', type_=UIStoriesResponse, mode='serialization')
+
+    def through_fastapi(page: UIStoriesResponse) -> bytes:
+        # what FastAPI does with a model returned from a route with a response_model
+        content = loop.run_until_complete(serialize_response(field=field, response_content=page))
+        return JSONResponse(content).body
+
+    print(f"{'page size':>9} {'build':>9} {'fastapi':>9} {'model':>9} {'hit+fastapi':>12} {'hit raw':>9}   (us per page)")
+    for size in PAGE_SIZES:
+        rows = _rows(size)
+
+        def build() -> UIStoriesResponse:
+            return UIStoriesResponse(page=1, page_count=10, stories=[_to_story_response(row) for row in rows])
+
+        page = build()
+        cached = to_json(page)
+        assert through_fastapi(page) == ModelResponse(page).body == ModelResponse(cached).body
+
+        timings = [
+            _per_call(build, repeat, number),
+            # a miss: the built page serialized by FastAPI, and by ModelResponse
+            _per_call(lambda: through_fastapi(page), repeat, number),
+            _per_call(lambda: ModelResponse(page).body, repeat, number),
+            # a hit: the cached JSON parsed back into a model for FastAPI, and sent as it is
+            _per_call(lambda: through_fastapi(UIStoriesResponse.model_validate_json(cached)), repeat, number),
+            _per_call(lambda: ModelResponse(cached).body, repeat, number)
+        ]
+        print(f"{size:>9} {timings[0]:>9.0f} {timings[1]:>9.0f} {timings[2]:>9.0f} {timings[3]:>12.0f} {timings[4]:>9.0f}")
+
+    loop.close()
+
+
+# python -m benchmarks.serialization
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cost of serializing a page of stories per response path")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+    main(args.repeat, args.number)
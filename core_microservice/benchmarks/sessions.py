@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from jose import jwt
+from redis.asyncio import Redis
+from src.settings import app_config
+from src.services.tokens import LEGACY_INDEX_PREFIX, refresh_token_store, session_id
+
+TTL = 7 * 24 * 60 * 60
+
+
+async def _legacy(redis: Redis, username: str, sessions: int) -> None:
+    # a string key per refresh token named after the whole token, and a set of them per user
+    expires_at = int(time.time()) + TTL
+    async with redis.pipeline(transaction=False) as pipe:
+        for n in range(sessions):
+            # the claims create_refresh_token signed before the jti, a second apart as logins would be
+            claims = {'sub': username, 'exp': expires_at - n, 'type': 'refresh'}
+            token = jwt.encode(claims, app_config.SECRET_KEY, app_config.AUTH_ALGO)
+            pipe.setex(f"refresh_token:{username}:{token}", TTL, 1)
+            pipe.sadd(f"{LEGACY_INDEX_PREFIX}{username}", f"refresh_token:{username}:{token}")
+        await pipe.execute()
+
+
+async def _sessions(redis: Redis, username: str, sessions: int) -> None:
+    expires_at = int(time.time()) + TTL
+    for _ in range(sessions):
+        await refresh_token_store.add(redis, username, session_id(uuid4().hex), expires_at)
+
+
+async def _measure(redis: Redis, pattern: str) -> int:
+    # MEMORY USAGE of every key of the layout, sampling all of a key's elements
+    total = 0
+    async for key in redis.scan_iter(match=pattern, count=1000):
+        total += await redis.memory_usage(key, samples=0)
+    return total
+
+
+async def main(url: str, users: int, per_user: tuple) -> None:
+    redis = Redis.from_url(url)
+    if await redis.dbsize():
+        raise SystemExit(f"{url} is not empty, point --redis-url at a spare database")
+
+    # MEMORY USAGE leaves out the keyspace and expiry entries of each key, used_memory counts everything
+    print(
+        f"{'sessions/user':>13} {'legacy':>8} {'sorted set':>11} {'saved':>6}   "
+        f"{'legacy':>8} {'sorted set':>11} {'saved':>6}   (bytes per session, {users} users)"
+    )
+    print(f"{'':>13} {'MEMORY USAGE':^27}   {'used_memory':^27}")
+    try:
+        for sessions in per_user:
+            results = []
+            for fill, patterns in (
+                (_legacy, ('refresh_token:*', f"{LEGACY_INDEX_PREFIX}*")),
+                (_sessions, (refresh_token_store.key('*'),))
+            ):
+                before = (await redis.info('memory'))['used_memory']
+                for user in range(users):
+                    await fill(redis, f"user{user}", sessions)
+                grown = (await redis.info('memory'))['used_memory'] - before
+                used = 0
+                for pattern in patterns:
+                    used += await _measure(redis, pattern)
+                results.append((used / (users * sessions), grown / (users * sessions)))
+                await redis.flushdb()
+            (legacy, legacy_grown), (current, current_grown) = results
+            print(
+                f"{sessions:>13} {legacy:>8.0f} {current:>11.0f} {1 - current / legacy:>6.0%}   "
+                f"{legacy_grown:>8.0f} {current_grown:>11.0f} {1 - current_grown / legacy_grown:>6.0%}"
+            )
+    finally:
+        await redis.flushdb()
+        await redis.aclose()
+
+
+# python -m benchmarks.sessions --redis-url redis://localhost:6379/15
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Redis memory per refresh session, legacy keys against the per-user sorted sets")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 3, 10, 200])
+    args = parser.parse_args()
+    asyncio.run(main(args.redis_url, args.users, tuple(args.sessions)))
@@ -1,15 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from src.settings import app_config
-from src.routes import users, stories, chapters
+from src.cache import redis_pool
+from src.database import replica_router
+from src.services.passwords import password_hasher
+from src.services.user_cache import user_cache
+from src.services.autocomplete import autocomplete_service
+from src.background.revisions import run_compaction
+from src.background.story_stats import run_story_stats
+from src.background.jobs import Worker
+import src.background.tasks  # noqa: F401 registers the jobs
+from src.middleware.queries import QueryStatsMiddleware
+from src.middleware.ratelimit import RateLimitMiddleware
+from src.middleware.metrics import MetricsMiddleware, mark_process_dead, request_metrics
+from src.routes import users, stories, chapters, search, jobs, metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    redis = await redis_pool.connect()
+    password_hasher.start()
+    if app_config.USER_CACHE_PUBSUB:
+        user_cache_listener = asyncio.create_task(user_cache.listen(redis))
+    if app_config.CHAPTER_REVISION_COMPACTION_INTERVAL > 0:
+        revision_compaction = asyncio.create_task(run_compaction(redis))
+    story_stats_worker = asyncio.create_task(run_story_stats(redis))
+    if replica_router.engines:
+        replica_health_checks = asyncio.create_task(replica_router.run_health_checks())
+    if app_config.JOB_WORKER_IN_APP:
+        job_worker = asyncio.create_task(Worker(redis, app_config.JOB_QUEUES).run())
+    if app_config.METRICS_ENABLED:
+        metrics_flusher = asyncio.create_task(request_metrics.run_flush())
+    if app_config.AUTOCOMPLETE_MEMORY_INDEX:
+        autocomplete_listener = asyncio.create_task(autocomplete_service.listen(redis))
+        await autocomplete_service.load()
+    yield
+    if app_config.AUTOCOMPLETE_MEMORY_INDEX:
+        autocomplete_listener.cancel()
+    if app_config.METRICS_ENABLED:
+        metrics_flusher.cancel()
+    if app_config.JOB_WORKER_IN_APP:
+        job_worker.cancel()
+    if replica_router.engines:
+        replica_health_checks.cancel()
+    story_stats_worker.cancel()
+    if app_config.CHAPTER_REVISION_COMPACTION_INTERVAL > 0:
+        revision_compaction.cancel()
+    if app_config.USER_CACHE_PUBSUB:
+        user_cache_listener.cancel()
+    password_hasher.shutdown()
+    await redis_pool.close()
+    if app_config.METRICS_ENABLED:
+        await mark_process_dead()
 
 
 app = FastAPI(
     title="App Backend API",
     description="The backend API for my AO3 clone",
-    version="1.0"
+    version="1.0",
+    lifespan=lifespan
 )
 
+# inside CORS, so a 429 still carries the CORS headers the browser needs to read it
+if app_config.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[app_config.ALLOWED_DOMAIN],
@@ -18,6 +75,15 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+app.add_middleware(QueryStatsMiddleware)
+
+if app_config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(stories.router)
 app.include_router(chapters.router)
-app.include_router(users.router)
\ No newline at end of file
+app.include_router(users.router)
+app.include_router(search.router)
+app.include_router(jobs.router)
+if app_config.METRICS_ENABLED:
+    app.include_router(metrics.router)
\ No newline at end of file
@@ -0,0 +1,268 @@
+import asyncio
+import inspect
+import os
+import socket
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, Type, TypeVar
+from uuid import uuid4
+from pydantic import BaseModel, ValidationError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+from src.settings import app_config
+from src.logging import app_logger
+
+P = TypeVar('P', bound=BaseModel)
+
+# every queue is read by this one consumer group
+GROUP = "workers"
+
+# id of the job a handler is running for, so it can report progress
+current_job_id: ContextVar[Optional[str]] = ContextVar('current_job_id', default=None)
+
+
+def stream_key(queue: str) -> str:
+    return f"jobs:{queue}"
+
+
+def dead_letter_key(queue: str) -> str:
+    return f"jobs:{queue}:dead"
+
+
+def status_key(job_id: str) -> str:
+    return f"jobs:status:{job_id}"
+
+
+class JobDefinition(Generic[P]):
+    """
+    A named async handler with a typed payload, bound to a queue
+
+    Created with the @job decorator, which reads the payload model off the
+    handler's annotation. Enqueueing validates and serializes the payload,
+    so a handler only ever sees a payload of its own type.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        queue: str,
+        payload_model: Type[P],
+        handler: Callable[[P], Awaitable[Any]],
+        max_retries: int
+    ):
+        self.name = name
+        self.queue = queue
+        self.payload_model = payload_model
+        self.handler = handler
+        self.max_retries = max_retries
+
+    async def enqueue(self, redis: Redis, payload: P, owner_id: Optional[int] = None) -> str:
+        """
+        Add a job to the queue and return its id, without waiting for it to run
+
+        Only the owner, the user the job was queued for, can look up its
+        status. A job queued without one is internal and is never shown.
+        """
+        job_id = uuid4().hex
+        status = {
+            'job': self.name,
+            'queue': self.queue,
+            'state': 'queued',
+            'attempts': 0,
+            'updated_at': time.time()
+        }
+        if owner_id is not None:
+            status['owner_id'] = owner_id
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hset(status_key(job_id), mapping=status)
+            pipe.expire(status_key(job_id), app_config.JOB_STATUS_TTL)
+            pipe.xadd(
+                stream_key(self.queue),
+                {'id': job_id, 'job': self.name, 'payload': payload.model_dump_json()},
+                maxlen=app_config.JOB_STREAM_MAXLEN,
+                approximate=True
+            )
+            await pipe.execute()
+        return job_id
+
+    async def __call__(self, payload: P) -> Any:
+        # run in-process, as the worker would
+        return await self.handler(payload)
+
+
+# every job by name, filled in as modules defining jobs are imported
+registry: Dict[str, JobDefinition] = {}
+
+
+def job(queue: str = 'default', name: Optional[str] = None, max_retries: int = 3):
+    def register(handler: Callable[[P], Awaitable[Any]]) -> JobDefinition[P]:
+        parameter = next(iter(inspect.signature(handler).parameters.values()))
+        definition = JobDefinition(name or handler.__name__, queue, parameter.annotation, handler, max_retries)
+        registry[definition.name] = definition
+        return definition
+    return register
+
+
+async def get_status(redis: Redis, job_id: str) -> Optional[Dict[str, str]]:
+    status = await redis.hgetall(status_key(job_id))
+    return {key.decode(): value.decode() for key, value in status.items()} or None
+
+
+async def _update_status(redis: Redis, job_id: str, fields: Dict[str, Any]) -> None:
+    # writing to a status that has expired brings it back, so it needs its TTL again
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(status_key(job_id), mapping=fields)
+        pipe.expire(status_key(job_id), app_config.JOB_STATUS_TTL)
+        await pipe.execute()
+
+
+async def set_status(redis: Redis, job_id: str, state: str, **fields) -> None:
+    await _update_status(redis, job_id, {'state': state, 'updated_at': time.time(), **fields})
+
+
+async def set_progress(redis: Redis, done: int, total: Optional[int] = None) -> None:
+    # called by a handler while it runs, outside of a worker there is no job to update
+    job_id = current_job_id.get()
+    if job_id is None:
+        return
+    progress = {'progress': done, 'updated_at': time.time()}
+    if total is not None:
+        progress['total'] = total
+    await _update_status(redis, job_id, progress)
+
+
+class Worker:
+    """
+    Runs the jobs of one or more queues with a set concurrency each
+
+    Every queue is a redis stream read through a consumer group, so jobs are
+    shared out across all workers. A job is acknowledged once its handler
+    returns. One that fails, or whose worker died, stays pending and is
+    claimed again after JOB_RETRY_AFTER_MS, until it has been tried
+    max_retries times more and is moved to the queue's dead-letter stream.
+    """
+
+    def __init__(self, redis: Redis, concurrency: Dict[str, int], consumer: Optional[str] = None):
+        self.redis = redis
+        self.concurrency = concurrency
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.processed = 0
+        self._slots = {queue: asyncio.Semaphore(slots) for queue, slots in concurrency.items()}
+
+    async def _ensure_group(self, queue: str) -> None:
+        try:
+            await self.redis.xgroup_create(stream_key(queue), GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def run(self) -> None:
+        for queue in self.concurrency:
+            await self._ensure_group(queue)
+        app_logger.info("Worker %s running queues %s", self.consumer, self.concurrency)
+
+        loops = [self._reclaim(queue) for queue in self.concurrency]
+        for queue, slots in self.concurrency.items():
+            loops.extend(self._consume(queue) for _ in range(slots))
+        await asyncio.gather(*loops)
+
+    async def _consume(self, queue: str) -> None:
+        while True:
+            try:
+                response = await self.redis.xreadgroup(
+                    GROUP,
+                    self.consumer,
+                    {stream_key(queue): '>'},
+                    count=1,
+                    block=app_config.JOB_BLOCK_MS
+                )
+            except RedisError as e:
+                app_logger.warning("Failed to read from queue %s: %s", queue, e)
+                await asyncio.sleep(1)
+                continue
+
+            for _, messages in response or []:
+                for message_id, fields in messages:
+                    async with self._slots[queue]:
+                        await self._process(queue, message_id, fields)
+
+    async def _reclaim(self, queue: str) -> None:
+        # pick up jobs that failed, or whose worker went away, once they have sat long enough
+        retry_after = app_config.JOB_RETRY_AFTER_MS
+        while True:
+            await asyncio.sleep(retry_after / 1000 / 2)
+            try:
+                pending = await self.redis.xpending_range(
+                    stream_key(queue), GROUP, '-', '+', 100, idle=retry_after
+                )
+                for entry in pending:
+                    claimed = await self.redis.xclaim(
+                        stream_key(queue), GROUP, self.consumer, retry_after, [entry['message_id']]
+                    )
+                    for message_id, fields in claimed:
+                        async with self._slots[queue]:
+                            await self._process(queue, message_id, fields)
+            except RedisError as e:
+                app_logger.warning("Failed to reclaim jobs of queue %s: %s", queue, e)
+
+    async def _dead_letter(self, queue: str, message_id: bytes, fields: dict, job_id: str, error: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(dead_letter_key(queue), {**fields, b'error': error}, maxlen=app_config.JOB_STREAM_MAXLEN, approximate=True)
+            pipe.xack(stream_key(queue), GROUP, message_id)
+            pipe.hset(status_key(job_id), mapping={
+                'job': fields[b'job'],
+                'queue': queue,
+                'state': 'dead',
+                'error': error,
+                'updated_at': time.time()
+            })
+            pipe.expire(status_key(job_id), app_config.JOB_STATUS_TTL)
+            await pipe.execute()
+        app_logger.error("Job %s moved to the dead-letter queue: %s", job_id, error)
+
+    async def _process(self, queue: str, message_id: bytes, fields: dict) -> None:
+        job_id = fields[b'id'].decode()
+        definition = registry.get(fields[b'job'].decode())
+        # counted here rather than from the stream so it survives reclaims
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(status_key(job_id), 'attempts', 1)
+            pipe.expire(status_key(job_id), app_config.JOB_STATUS_TTL)
+            attempts, _ = await pipe.execute()
+
+        try:
+            if definition is None:
+                raise LookupError(f"Unknown job {fields[b'job'].decode()}")
+            payload = definition.payload_model.model_validate_json(fields[b'payload'])
+        except (LookupError, ValidationError) as e:
+            # retrying cannot fix a job this worker does not understand
+            await self._dead_letter(queue, message_id, fields, job_id, str(e))
+            return
+
+        if attempts > definition.max_retries + 1:
+            # its worker died on the last attempt
+            await self._dead_letter(queue, message_id, fields, job_id, f"Gave up after {attempts - 1} attempts")
+            return
+
+        await set_status(self.redis, job_id, 'running')
+        token = current_job_id.set(job_id)
+        try:
+            result = await definition.handler(payload)
+        except Exception as e:
+            app_logger.warning("Job %s (%s) failed on attempt %s: %s", job_id, definition.name, attempts, e, exc_info=True)
+            if attempts > definition.max_retries:
+                await self._dead_letter(queue, message_id, fields, job_id, f"Gave up after {attempts} attempts: {e}")
+            else:
+                await set_status(self.redis, job_id, 'failed', error=str(e))
+            return
+        finally:
+            current_job_id.reset(token)
+
+        done = {'state': 'done', 'updated_at': time.time()}
+        if result is not None:
+            done['result'] = str(result)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(stream_key(queue), GROUP, message_id)
+            pipe.hset(status_key(job_id), mapping=done)
+            pipe.expire(status_key(job_id), app_config.JOB_STATUS_TTL)
+            await pipe.execute()
+        self.processed += 1
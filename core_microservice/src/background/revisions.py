@@ -0,0 +1,39 @@
+import asyncio
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from src.database import async_session
+from src.services.revisions import revision_service
+from src.settings import app_config
+from src.logging import app_logger
+
+# held for one interval by whichever worker runs the compaction
+COMPACTION_LOCK = "chapter-revisions:compaction"
+
+
+async def compact_revisions() -> int:
+    async with async_session() as db:
+        return await revision_service.compact(db)
+
+
+async def run_compaction(redis: Redis) -> None:
+    """
+    Compact old chapter revisions every CHAPTER_REVISION_COMPACTION_INTERVAL
+
+    Every worker runs this loop, the redis lock makes sure only one of them
+    actually compacts in each interval.
+    """
+    interval = app_config.CHAPTER_REVISION_COMPACTION_INTERVAL
+    while True:
+        try:
+            if await redis.set(COMPACTION_LOCK, 1, nx=True, ex=interval):
+                await compact_revisions()
+        except RedisError as e:
+            app_logger.warning("Skipping revision compaction, redis is unavailable: %s", e)
+        except Exception as e:
+            app_logger.error("Revision compaction failed: %s", e, exc_info=True)
+        await asyncio.sleep(interval)
+
+
+# python -m src.background.revisions
+if __name__ == '__main__':
+    asyncio.run(compact_revisions())
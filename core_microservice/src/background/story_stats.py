@@ -0,0 +1,243 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import case, literal, or_
+from sqlalchemy.dialects.postgresql import insert
+from src.database import async_session
+from src.cache import story_validators
+from src.models import Chapter, Story, StoryStats
+from src.settings import app_config
+from src.logging import app_logger
+
+# list of pending stats changes, pushed by chapter writes and drained by the worker
+DELTAS_KEY = "story-stats:deltas"
+# held for one interval by whichever worker runs the reconciliation
+RECONCILE_LOCK = "story-stats:reconcile"
+# stories recomputed per transaction when reconciling
+RECONCILE_BATCH_SIZE = 1000
+
+
+async def record_change(
+    redis: Optional[Redis],
+    story_id: int,
+    chapters: int = 0,
+    published: int = 0,
+    words: int = 0,
+    at: Optional[datetime] = None
+) -> None:
+    """
+    Queue a change to a story's stats, after the chapter write has committed
+
+    A change that never makes it to redis is corrected by the next
+    reconciliation pass, so failures are only logged. The change is stamped
+    with when it was queued, which tells the worker whether a reconciliation
+    has already counted it.
+    """
+    if redis is None:
+        return
+    delta = {
+        'story_id': story_id,
+        'chapters': chapters,
+        'published': published,
+        'words': words,
+        'queued_at': datetime.utcnow().isoformat()
+    }
+    if at is not None:
+        delta['at'] = at.isoformat()
+    try:
+        await redis.lpush(DELTAS_KEY, json.dumps(delta))
+    except RedisError as e:
+        app_logger.warning("Failed to queue stats change for story %s: %s", story_id, e)
+
+
+def _counted(delta: dict, reconciled_at: Optional[datetime]) -> bool:
+    # a change queued before a reconciliation snapshot was committed before it, so the snapshot has it
+    if reconciled_at is None:
+        return False
+    return datetime.fromisoformat(delta.get('queued_at', datetime.min.isoformat())) < reconciled_at
+
+
+def _merge(deltas: List[dict]) -> Dict[int, dict]:
+    # one row per story, however many chapter writes it saw
+    merged: Dict[int, dict] = {}
+    for delta in deltas:
+        story = merged.setdefault(
+            delta['story_id'],
+            {'story_id': delta['story_id'], 'chapter_count': 0, 'published_chapter_count': 0,
+             'word_count': 0, 'last_chapter_at': None}
+        )
+        story['chapter_count'] += delta['chapters']
+        story['published_chapter_count'] += delta['published']
+        story['word_count'] += delta['words']
+        if 'at' in delta:
+            at = datetime.fromisoformat(delta['at'])
+            story['last_chapter_at'] = max(filter(None, (story['last_chapter_at'], at)))
+    return merged
+
+
+async def _upsert(raw: List[str], db: AsyncSession) -> Tuple[List[int], List[str]]:
+    # adds the changes to the stats, returns the stories updated and the changes to try again
+    deltas = [json.loads(delta) for delta in raw]
+    reconciled = dict((await db.exec(
+        select(Story.id, StoryStats.reconciled_at)
+        .outerjoin(StoryStats, StoryStats.story_id == Story.id)
+        .where(Story.id.in_({delta['story_id'] for delta in deltas}))
+    )).all())
+    # skip stories deleted since the change was queued, and changes already reconciled
+    pending = [
+        (entry, delta) for entry, delta in zip(raw, deltas)
+        if delta['story_id'] in reconciled and not _counted(delta, reconciled[delta['story_id']])
+    ]
+    if not pending:
+        return [], []
+
+    now = datetime.utcnow()
+    rows = [
+        {**row, 'updated_at': now, 'reconciled_at': reconciled[story_id]}
+        for story_id, row in _merge([delta for _, delta in pending]).items()
+    ]
+    statement = insert(StoryStats).values(rows)
+    excluded = statement.excluded
+    updated = set((await db.exec(statement.on_conflict_do_update(
+        index_elements=[StoryStats.story_id],
+        set_={
+            'chapter_count': StoryStats.chapter_count + excluded.chapter_count,
+            'published_chapter_count': StoryStats.published_chapter_count + excluded.published_chapter_count,
+            'word_count': StoryStats.word_count + excluded.word_count,
+            'last_chapter_at': func.greatest(StoryStats.last_chapter_at, excluded.last_chapter_at),
+            'updated_at': excluded.updated_at
+        },
+        # a story reconciled since it was read above is left alone, its changes are
+        # queued again and checked against the new snapshot on the next round
+        where=StoryStats.reconciled_at.is_not_distinct_from(excluded.reconciled_at)
+    ).returning(StoryStats.story_id))).scalars().all())
+    await db.commit()
+    return list(updated), [entry for entry, delta in pending if delta['story_id'] not in updated]
+
+
+async def apply_changes(redis: Redis, db: AsyncSession) -> int:
+    """
+    Apply up to STORY_STATS_BATCH_SIZE queued changes in one upsert
+
+    Changes go back on the list if the upsert does not commit, so a
+    database error delays them rather than losing them.
+    """
+    raw = await redis.rpop(DELTAS_KEY, app_config.STORY_STATS_BATCH_SIZE)
+    if not raw:
+        return 0
+
+    try:
+        updated, retry = await _upsert(raw, db)
+    except BaseException:
+        # cancellation at shutdown included, rpop took them from the tail so that is where they go back
+        await db.rollback()
+        await redis.rpush(DELTAS_KEY, *raw)
+        raise
+    if retry:
+        await redis.rpush(DELTAS_KEY, *retry)
+    # the stats are part of the story's representation, so its ETag moves with them
+    await story_validators.forget(redis, *updated)
+
+    return len(raw)
+
+
+async def reconcile(db: AsyncSession, redis: Optional[Redis] = None) -> int:
+    """
+    Recompute every story's stats from the chapter table
+
+    Catches changes lost between a commit and redis, run in batches of
+    stories so no transaction holds locks for long. Each row records when
+    its batch was snapshotted, so queued changes the snapshot already
+    includes are dropped instead of counted twice, but only rows that were
+    actually off get a new updated_at, so the other stories keep their ETags.
+    """
+    reconciled = 0
+    last_id = 0
+    while True:
+        story_ids = (await db.exec(
+            select(Story.id).where(Story.id > last_id).order_by(Story.id).limit(RECONCILE_BATCH_SIZE)
+        )).all()
+        if not story_ids:
+            break
+
+        snapshot = datetime.utcnow()
+        totals = (
+            select(
+                Story.id,
+                func.count(Chapter.id),
+                func.count(case((Chapter.is_published, 1))),
+                func.coalesce(func.sum(case((Chapter.is_published, Chapter.word_count), else_=0)), 0),
+                func.max(func.coalesce(Chapter.updated_at, Chapter.created_at)),
+                literal(snapshot),
+                literal(snapshot)
+            )
+            .outerjoin(Chapter, Chapter.story_id == Story.id)
+            .where(Story.id.in_(story_ids))
+            .group_by(Story.id)
+        )
+        statement = insert(StoryStats).from_select(
+            [
+                'story_id', 'chapter_count', 'published_chapter_count', 'word_count', 'last_chapter_at',
+                'updated_at', 'reconciled_at'
+            ],
+            totals
+        )
+        excluded = statement.excluded
+        columns = ['chapter_count', 'published_chapter_count', 'word_count', 'last_chapter_at']
+        off = or_(*(StoryStats.__table__.c[column].is_distinct_from(excluded[column]) for column in columns))
+        written = (await db.exec(statement.on_conflict_do_update(
+            index_elements=[StoryStats.story_id],
+            set_={
+                **{column: excluded[column] for column in columns},
+                'updated_at': case((off, excluded.updated_at), else_=StoryStats.updated_at),
+                'reconciled_at': excluded.reconciled_at
+            }
+        ).returning(StoryStats.story_id, StoryStats.updated_at))).all()
+        await db.commit()
+        await story_validators.forget(redis, *(story_id for story_id, updated_at in written if updated_at == snapshot))
+
+        reconciled += len(story_ids)
+        last_id = story_ids[-1]
+
+    app_logger.info("Reconciled stats of %s stories", reconciled)
+    return reconciled
+
+
+async def run_story_stats(redis: Redis) -> None:
+    """
+    Keep story stats current, started by the app lifespan
+
+    Every worker drains the change list (pops are atomic, so each change is
+    applied once) and the redis lock makes only one of them reconcile in
+    each STORY_STATS_RECONCILE_INTERVAL. Changes queued before a story's
+    reconciliation are dropped when they come off the list, whichever
+    worker reconciled it.
+    """
+    while True:
+        try:
+            async with async_session() as db:
+                if await redis.set(RECONCILE_LOCK, 1, nx=True, ex=app_config.STORY_STATS_RECONCILE_INTERVAL):
+                    await reconcile(db, redis)
+                # keep draining while there is a backlog
+                while await apply_changes(redis, db) == app_config.STORY_STATS_BATCH_SIZE:
+                    pass
+        except RedisError as e:
+            app_logger.warning("Story stats worker cannot reach redis: %s", e)
+        except Exception as e:
+            app_logger.error("Story stats worker failed: %s", e, exc_info=True)
+        await asyncio.sleep(app_config.STORY_STATS_FLUSH_INTERVAL)
+
+
+async def reconcile_all() -> None:
+    async with async_session() as db:
+        await reconcile(db)
+
+
+# python -m src.background.story_stats
+if __name__ == '__main__':
+    asyncio.run(reconcile_all())
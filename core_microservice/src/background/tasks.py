@@ -0,0 +1,68 @@
+import os
+import time
+from typing import Optional
+from pydantic import BaseModel
+from src.background.jobs import job, set_progress
+from src.cache import redis_pool
+from src.settings import app_config
+from src.database import async_session
+from src.models import Chapter
+from src.services.search import search_service
+from src.logging import app_logger
+
+
+# payload of the chapter search indexing job
+class ChapterIndexJob(BaseModel):
+    chapter_id: int
+
+
+@job(queue='search')
+async def index_chapter(payload: ChapterIndexJob) -> None:
+    # rebuilds from the committed chapter, so a late or repeated run is harmless
+    async with async_session() as db:
+        chapter = await db.get(Chapter, payload.chapter_id)
+        if chapter is None:
+            app_logger.info("Chapter %s is gone, nothing to index", payload.chapter_id)
+            return
+        await search_service.index_chapter(chapter, db)
+        await db.commit()
+
+
+# payload of the story import job, the archive itself waits on disk at upload_path
+class StoryImportJob(BaseModel):
+    upload_path: str
+    user_id: int
+    name: Optional[str] = None
+    blurb: str = ''
+
+
+@job(queue='imports', max_retries=0)
+async def import_story(payload: StoryImportJob) -> int:
+    # a failed import is rolled back whole, and retrying a bad archive cannot help
+    from src.services.imports import ArchiveError, StoryArchive, remove_upload, story_import_service, sweep_uploads
+
+    redis = redis_pool.client
+    try:
+        try:
+            upload = open(payload.upload_path, 'rb')
+        except FileNotFoundError:
+            raise ArchiveError("The upload expired before it could be imported")
+        with upload:
+            if os.fstat(upload.fileno()).st_mtime < time.time() - app_config.STORY_IMPORT_UPLOAD_TTL:
+                raise ArchiveError("The upload expired before it could be imported")
+            # the archive is read straight from the file, one entry at a time
+            archive = StoryArchive(upload)
+            await set_progress(redis, 0, len(archive))
+            async with async_session() as db:
+                return await story_import_service.import_story(
+                    archive,
+                    payload.user_id,
+                    payload.name,
+                    payload.blurb,
+                    db,
+                    redis,
+                    progress=lambda done, total: set_progress(redis, done, total)
+                )
+    finally:
+        remove_upload(payload.upload_path)
+        sweep_uploads()
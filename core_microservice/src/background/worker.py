@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+from typing import Dict
+from src.cache import redis_pool
+from src.background.jobs import Worker
+from src.settings import app_config
+import src.background.tasks  # noqa: F401 registers the jobs
+
+
+def parse_concurrency(values: list[str]) -> Dict[str, int]:
+    concurrency = {}
+    for value in values:
+        queue, _, slots = value.partition('=')
+        concurrency[queue] = int(slots or 1)
+    return concurrency
+
+
+async def run_worker(concurrency: Dict[str, int]) -> None:
+    redis = await redis_pool.connect()
+    try:
+        await Worker(redis, concurrency).run()
+    finally:
+        await redis_pool.close()
+
+
+# python -m src.background.worker [--queue search=4 ...]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    parser.add_argument(
+        '--queue',
+        action='append',
+        default=[],
+        help="queue to work on as name=concurrency, repeatable, defaults to JOB_QUEUES"
+    )
+    args = parser.parse_args()
+    asyncio.run(run_worker(parse_concurrency(args.queue) or app_config.JOB_QUEUES))
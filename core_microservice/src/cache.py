@@ -0,0 +1,339 @@
+import asyncio
+import calendar
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Mapping, Optional, Tuple, Type, TypeVar
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.exceptions import RedisError
+from pydantic import BaseModel
+from src.settings import app_config
+from src.logging import app_logger
+
+T = TypeVar('T', bound=BaseModel)
+
+
+def to_json(value: BaseModel) -> bytes:
+    # model_dump_json without the round trip through str
+    return value.__pydantic_serializer__.to_json(value)
+
+
+class RedisPool:
+    """
+    Shared redis connection pool, opened and closed by the app lifespan
+
+    The pool blocks for up to REDIS_POOL_TIMEOUT when every connection is
+    busy instead of opening unbounded connections, and idle connections are
+    health checked before reuse.
+    """
+
+    def __init__(self):
+        self.client: Optional[Redis] = None
+
+    async def connect(self) -> Redis:
+        pool = BlockingConnectionPool(
+            host=app_config.REDIS_HOST,
+            port=app_config.REDIS_PORT,
+            max_connections=app_config.REDIS_POOL_SIZE,
+            timeout=app_config.REDIS_POOL_TIMEOUT,
+            socket_timeout=app_config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=app_config.REDIS_CONNECT_TIMEOUT,
+            health_check_interval=app_config.REDIS_HEALTH_CHECK_INTERVAL
+        )
+        client = Redis(connection_pool=pool)
+        try:
+            await client.ping()
+        except RedisError as e:
+            await client.aclose()
+            raise Exception(f"Failed to connect to redis: {e}")
+        self.client = client
+        app_logger.info("Connected to redis with a pool of %s", app_config.REDIS_POOL_SIZE)
+        return client
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+redis_pool = RedisPool()
+
+
+# redis dependancy, tests can override it with a stand-in such as fakeredis
+def get_redis() -> Redis:
+    if redis_pool.client is None:
+        raise RuntimeError("Redis pool is not connected")
+    return redis_pool.client
+
+
+class ResponseCache:
+    """
+    Read-through cache for serialized response models
+
+    Every key is prefixed with a namespace version number, so bumping the
+    version invalidates everything cached under the namespace at once and
+    the stale entries simply age out through their TTL.
+    Concurrent misses on the same key are coalesced: within a worker only one
+    task runs the loader, and across workers a short redis lock makes the
+    other workers wait for the value instead of hitting the database.
+    """
+
+    def __init__(self, namespace: str, ttl: int, lock_timeout_ms: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_timeout_ms = lock_timeout_ms
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def version_key(self) -> str:
+        return f"{self.namespace}:version"
+
+    async def _versioned_key(self, redis: Redis, key: str) -> str:
+        version = int(await redis.get(self.version_key) or 0)
+        return f"{self.namespace}:v{version}:{key}"
+
+    async def _wait_for_value(self, redis: Redis, cache_key: str) -> bytes | None:
+        # another worker holds the fill lock, poll until it has stored the value
+        deadline = time.monotonic() + self.lock_timeout_ms / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+            cached = await redis.get(cache_key)
+            if cached is not None:
+                return cached
+        return None
+
+    async def get_or_load(
+        self,
+        redis: Redis,
+        key: str,
+        model: Type[T],
+        loader: Callable[[], Awaitable[T]]
+    ) -> T:
+        value, cached = await self._get_or_load(redis, key, loader)
+        return value if value is not None else model.model_validate_json(cached)
+
+    async def get_or_load_json(
+        self,
+        redis: Redis,
+        key: str,
+        loader: Callable[[], Awaitable[T]]
+    ) -> bytes:
+        """
+        Like get_or_load, but returns the value as JSON, for sending as is
+
+        A hit comes back exactly as it was cached, rather than being parsed
+        and validated into a model only to be serialized again.
+        """
+        value, cached = await self._get_or_load(redis, key, loader)
+        return cached if cached is not None else to_json(value)
+
+    async def _get_or_load(
+        self,
+        redis: Redis,
+        key: str,
+        loader: Callable[[], Awaitable[T]]
+    ) -> Tuple[Optional[T], Optional[bytes]]:
+        # the loaded value, the cached JSON, or both when the value was just cached
+        try:
+            cache_key = await self._versioned_key(redis, key)
+            cached = await redis.get(cache_key)
+        except RedisError as e:
+            self.errors += 1
+            app_logger.warning("Cache read failed for %s, falling back to database: %s", key, e)
+            return await loader(), None
+
+        if cached is not None:
+            self.hits += 1
+            return None, cached
+
+        lock = self._locks.setdefault(cache_key, asyncio.Lock())
+        try:
+            async with lock:
+                return await self._fill(redis, key, cache_key, loader)
+        finally:
+            # drop the lock from the table so it does not grow with every key
+            # ever seen, tasks already waiting on it still re-check the cache
+            self._locks.pop(cache_key, None)
+
+    async def _fill(
+        self,
+        redis: Redis,
+        key: str,
+        cache_key: str,
+        loader: Callable[[], Awaitable[T]]
+    ) -> Tuple[Optional[T], Optional[bytes]]:
+        lock_key = f"{cache_key}:lock"
+        acquired = False
+        try:
+            # a task that held the lock before us may have filled the key
+            cached = await redis.get(cache_key)
+            if cached is None:
+                acquired = bool(await redis.set(lock_key, 1, nx=True, px=self.lock_timeout_ms))
+                if not acquired:
+                    cached = await self._wait_for_value(redis, cache_key)
+        except RedisError as e:
+            self.errors += 1
+            app_logger.warning("Cache lock failed for %s, falling back to database: %s", key, e)
+            return await loader(), None
+
+        if cached is not None:
+            self.hits += 1
+            return None, cached
+
+        self.misses += 1
+        value = await loader()
+        encoded = to_json(value)
+
+        try:
+            await redis.set(cache_key, encoded, ex=self.ttl)
+            if acquired:
+                await redis.delete(lock_key)
+        except RedisError as e:
+            self.errors += 1
+            app_logger.warning("Cache write failed for %s: %s", key, e)
+
+        return value, encoded
+
+    async def invalidate(self, redis: Redis) -> None:
+        try:
+            await redis.incr(self.version_key)
+        except RedisError as e:
+            self.errors += 1
+            app_logger.error("Failed to invalidate %s cache: %s", self.namespace, e)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+story_cache = ResponseCache(
+    "stories",
+    ttl=app_config.STORY_CACHE_TTL,
+    lock_timeout_ms=app_config.CACHE_LOCK_TIMEOUT_MS
+)
+
+
+class Validators(BaseModel):
+    """
+    The ETag and Last-Modified of a resource, for answering conditional GETs
+
+    The ETag is strong, built from the row id and the times the row (and
+    anything embedded in its representation) last changed, so it moves with
+    every write without the body ever being read. `owner_id` is set when
+    only that user may see the resource, like a draft chapter, so a cached
+    entry also answers who can read it.
+    """
+    etag: str
+    last_modified: datetime
+    owner_id: Optional[int] = None
+
+    @classmethod
+    def of(cls, id: int, *modified: Optional[datetime], owner_id: Optional[int] = None) -> 'Validators':
+        # timestamps are naive UTC, to the microsecond like postgres keeps them
+        stamps = [
+            calendar.timegm(at.utctimetuple()) * 1_000_000 + at.microsecond if at is not None else 0
+            for at in modified
+        ]
+        return cls(
+            etag='"' + '-'.join(format(part, 'x') for part in (id, *stamps)) + '"',
+            last_modified=max(at for at in modified if at is not None),
+            owner_id=owner_id
+        )
+
+    def headers(self) -> Dict[str, str]:
+        # no-cache lets clients keep the body but makes them revalidate it every time
+        return {
+            'ETag': self.etag,
+            'Last-Modified': format_datetime(self.last_modified.replace(tzinfo=timezone.utc), usegmt=True),
+            'Cache-Control': 'no-cache'
+        }
+
+    def not_modified(self, headers: Mapping[str, str]) -> bool:
+        if_none_match = headers.get('if-none-match')
+        # If-Modified-Since is only looked at without If-None-Match (RFC 9110 13.2.2)
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or any(tag.removeprefix('W/') == self.etag for tag in tags)
+
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates only go down to the second
+        return self.last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+class ValidatorCache:
+    """
+    Validators per resource id, so a conditional GET needs one redis read
+
+    Misses are filled from a lookup of the row's timestamps and writes drop
+    the entry once they have committed. A fill only goes in when the key is
+    absent, but one that raced a write can still leave the old validators
+    behind, for at most VALIDATOR_CACHE_TTL.
+    """
+
+    def __init__(self, namespace: str, ttl: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, id: int) -> str:
+        # v2: entries from before owner_id was kept would show drafts to anyone
+        return f"{self.namespace}:validators:v2:{id}"
+
+    async def get(
+        self,
+        redis: Optional[Redis],
+        id: int,
+        loader: Callable[[], Awaitable[Validators]]
+    ) -> Validators:
+        if redis is None:
+            return await loader()
+        try:
+            cached = await redis.get(self._key(id))
+        except RedisError as e:
+            self.errors += 1
+            app_logger.warning("Validator read failed for %s %s, falling back to database: %s", self.namespace, id, e)
+            return await loader()
+
+        if cached is not None:
+            self.hits += 1
+            return Validators.model_validate_json(cached)
+
+        self.misses += 1
+        validators = await loader()
+        try:
+            await redis.set(self._key(id), validators.model_dump_json(), ex=self.ttl, nx=True)
+        except RedisError as e:
+            self.errors += 1
+            app_logger.warning("Validator write failed for %s %s: %s", self.namespace, id, e)
+        return validators
+
+    async def forget(self, redis: Optional[Redis], *ids: int) -> None:
+        if redis is None or not ids:
+            return
+        try:
+            await redis.delete(*(self._key(id) for id in ids))
+        except RedisError as e:
+            self.errors += 1
+            app_logger.error("Failed to drop validators of %s %s: %s", self.namespace, ids, e)
+
+
+story_validators = ValidatorCache("stories", ttl=app_config.VALIDATOR_CACHE_TTL)
+chapter_validators = ValidatorCache("chapters", ttl=app_config.VALIDATOR_CACHE_TTL)
@@ -0,0 +1,216 @@
+import asyncio
+import struct
+import sys
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Optional
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+from src.settings import app_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# stored values start with a codec byte and the uncompressed size in bytes,
+# so the size (and how to read the rest) is known without decompressing.
+# A zstd payload is a zstd frame, whose own header has the id of the
+# dictionary it was compressed with
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {'none': CODEC_RAW, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+HEADER = struct.Struct('>BI')
+HEADER_SIZE = HEADER.size
+
+# compressing a few hundred bytes costs more than it saves
+MIN_COMPRESS_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def _load_dictionary(path: str) -> "zstandard.ZstdCompressionDict":
+    dictionary = zstandard.ZstdCompressionDict(Path(path).read_bytes())
+    # rows only say which dictionary they need by its id, raw content dictionaries have none
+    if not dictionary.dict_id():
+        raise RuntimeError(f"{path} is not a trained zstd dictionary, it has no dictionary id")
+    return dictionary
+
+
+def _zstd_dictionary() -> Optional["zstandard.ZstdCompressionDict"]:
+    # the dictionary new rows are written with
+    if not app_config.CHAPTER_COMPRESSION_DICT:
+        return None
+    return _load_dictionary(app_config.CHAPTER_COMPRESSION_DICT)
+
+
+def _zstd_dictionaries() -> Dict[int, "zstandard.ZstdCompressionDict"]:
+    # every dictionary rows may have been written with, the current one and
+    # those listed in CHAPTER_COMPRESSION_OLD_DICTS after being replaced
+    paths = [app_config.CHAPTER_COMPRESSION_DICT, *app_config.CHAPTER_COMPRESSION_OLD_DICTS]
+    dictionaries = [_load_dictionary(path) for path in paths if path]
+    return {dictionary.dict_id(): dictionary for dictionary in dictionaries}
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise RuntimeError("zstd chapter compression needs the zstandard package installed")
+
+
+def _zstd_compressor() -> "zstandard.ZstdCompressor":
+    _require_zstandard()
+    return zstandard.ZstdCompressor(
+        level=app_config.CHAPTER_COMPRESSION_LEVEL,
+        dict_data=_zstd_dictionary(),
+        write_dict_id=True
+    )
+
+
+def _zstd_decompressor(frame: bytes) -> "zstandard.ZstdDecompressor":
+    # a decompressor with the dictionary the frame was written with
+    _require_zstandard()
+    dict_id = zstandard.get_frame_parameters(frame).dict_id
+    if not dict_id:
+        return zstandard.ZstdDecompressor()
+    dictionary = _zstd_dictionaries().get(dict_id)
+    if dictionary is None:
+        raise ValueError(
+            f"Content was compressed with zstd dictionary {dict_id}, "
+            "which is neither CHAPTER_COMPRESSION_DICT nor in CHAPTER_COMPRESSION_OLD_DICTS"
+        )
+    return zstandard.ZstdDecompressor(dict_data=dictionary)
+
+
+def compress_text(text: str, codec: Optional[str] = None) -> bytes:
+    raw = text.encode('utf-8')
+    codec_id = CODECS[codec or app_config.CHAPTER_COMPRESSION]
+
+    if codec_id == CODEC_RAW or len(raw) < MIN_COMPRESS_SIZE:
+        return HEADER.pack(CODEC_RAW, len(raw)) + raw
+    if codec_id == CODEC_ZLIB:
+        return HEADER.pack(CODEC_ZLIB, len(raw)) + zlib.compress(raw, app_config.CHAPTER_COMPRESSION_LEVEL)
+    return HEADER.pack(CODEC_ZSTD, len(raw)) + _zstd_compressor().compress(raw)
+
+
+def decompress_text(data: bytes) -> str:
+    codec_id, size = HEADER.unpack_from(data)
+    payload = data[HEADER_SIZE:]
+
+    if codec_id == CODEC_RAW:
+        raw = payload
+    elif codec_id == CODEC_ZLIB:
+        raw = zlib.decompress(payload)
+    else:
+        raw = _zstd_decompressor(payload).decompress(payload, max_output_size=size)
+    return bytes(raw).decode('utf-8')
+
+
+def read_header(data: bytes) -> tuple[int, int]:
+    # codec id and uncompressed size
+    return HEADER.unpack_from(data)
+
+
+async def iter_decompressed(
+    codec_id: int,
+    chunks: AsyncIterator[bytes],
+    start: int,
+    end: int,
+    output_size: int = 65536
+) -> AsyncIterator[bytes]:
+    """
+    Decompress a stream of stored chunks, yielding bytes `start` to `end`
+
+    Output is produced a piece at a time and everything before `start` is
+    discarded as it is produced, so memory stays bounded by the chunk size
+    (times the compression ratio for zstd) rather than the size of the text.
+    """
+    if codec_id == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+    elif codec_id == CODEC_ZSTD:
+        # the dictionary is only known once the frame header has been read
+        decompressor = None
+    else:
+        raise ValueError(f"Unknown compression codec {codec_id}")
+
+    def outputs(chunk: bytes) -> Iterable[bytes]:
+        nonlocal decompressor
+        if codec_id == CODEC_ZSTD:
+            if decompressor is None:
+                decompressor = _zstd_decompressor(chunk).decompressobj()
+            yield decompressor.decompress(chunk)
+            return
+        # zlib can cap each output, keeping the rest of the input for later
+        while True:
+            output = decompressor.decompress(chunk, output_size)
+            yield output
+            chunk = decompressor.unconsumed_tail
+            if not chunk and len(output) < output_size:
+                return
+
+    async def all_outputs() -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            for output in outputs(chunk):
+                yield output
+        if codec_id == CODEC_ZLIB:
+            yield decompressor.flush()
+
+    position = 0
+    async for output in all_outputs():
+        output_start, position = position, position + len(output)
+        if position <= start:
+            continue
+        yield output[max(start - output_start, 0):end - output_start + 1]
+        if position > end:
+            return
+
+
+def train_dictionary(samples: Iterable[str], dict_size: int = 112640) -> bytes:
+    """Train a shared zstd dictionary from sample chapter texts"""
+    _require_zstandard()
+    encoded = [sample.encode('utf-8') for sample in samples]
+    return zstandard.train_dictionary(dict_size, encoded).as_bytes()
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text stored compressed, decompressed transparently on read
+
+    The codec is picked by CHAPTER_COMPRESSION when a value is written and
+    recorded in the stored header, along with the id of the zstd dictionary
+    if one was used, so rows written under different settings can always be
+    read back as long as replaced dictionaries stay in
+    CHAPTER_COMPRESSION_OLD_DICTS.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value: Optional[bytes], dialect) -> Optional[str]:
+        if value is None:
+            return None
+        return decompress_text(value)
+
+
+async def train(output: str, sample_size: int = 2000) -> None:
+    from sqlmodel import select
+    from src.database import async_session, engine
+    from src.models import Chapter
+    from src.logging import app_logger
+
+    async with async_session() as db:
+        samples = (await db.exec(select(Chapter.content).limit(sample_size))).all()
+    await engine.dispose()
+
+    Path(output).write_bytes(train_dictionary(samples))
+    app_logger.info("Trained a zstd dictionary from %s chapters into %s", len(samples), output)
+
+
+# python -m src.compression <dictionary path> [sample size]
+if __name__ == '__main__':
+    asyncio.run(train(sys.argv[1], *map(int, sys.argv[2:3])))
@@ -1,23 +1,181 @@
-from sqlmodel import create_engine, Session
-from sqlalchemy.pool import QueuePool
+import asyncio
+import hashlib
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+from fastapi import Depends, Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
 from src.settings import app_config
+from src.cache import get_redis
+from src.middleware.queries import instrument_engine
+from src.logging import db_logger
 
-# create the engine with connection pooling
-engine = create_engine(
-    app_config.DATABASE_URL,
-    poolclass=QueuePool,
-    pool_size=5,
-    max_overflow=10,
-    pool_timeout=30,
-    pool_pre_ping = True,
-    echo=False
+T = TypeVar('T')
+
+# async drivers for the sync urls we may find in the environment
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url: str) -> URL:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+
+
+def engine_options(url: URL) -> dict:
+    # sqlite (used by the tests through aiosqlite) does not take pool sizing
+    if url.get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': app_config.DATABASE_POOL_SIZE,
+        'max_overflow': app_config.DATABASE_MAX_OVERFLOW,
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+    }
+
+
+# create the async engine with connection pooling
+database_url = async_url(app_config.DATABASE_URL)
+engine = create_async_engine(
+    database_url,
+    echo=False,
+    **engine_options(database_url)
 )
+# per-request query counts and the slow query log
+instrument_engine(engine)
 
+# nothing may lazy load after a commit in async code, so keep attributes loaded
+async_session = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
 
-# create the session generator that we will use in our dependancy injection
-def get_db():
-    with Session(engine) as db:
+
+class ReplicaRouter:
+    """
+    Read sessions spread over the replicas in DATABASE_REPLICA_URLS
+
+    Replicas are handed out round-robin, skipping any that failed their last
+    health check. With none configured or none healthy there is no replica
+    session and callers use the primary.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.engines: List[AsyncEngine] = []
+        self.sessions: List[async_sessionmaker] = []
+        for url in urls:
+            replica_url = async_url(url)
+            engine = create_async_engine(replica_url, echo=False, **engine_options(replica_url))
+            instrument_engine(engine)
+            self.engines.append(engine)
+            self.sessions.append(async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+        # nothing is read from a replica until it has passed a health check
+        self.healthy = [False] * len(urls)
+        self._turn = itertools.count()
+
+    def session_factory(self) -> Optional[async_sessionmaker]:
+        for _ in range(len(self.sessions)):
+            index = next(self._turn) % len(self.sessions)
+            if self.healthy[index]:
+                return self.sessions[index]
+        return None
+
+    async def _check(self, index: int) -> None:
+        engine = self.engines[index]
         try:
-            yield db
-        finally:
-            db.close()
\ No newline at end of file
+            async with engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text('SELECT 1')), timeout=app_config.DATABASE_REPLICA_CHECK_TIMEOUT)
+            healthy = True
+        except Exception as e:
+            healthy = False
+            error = e
+        if healthy != self.healthy[index]:
+            replica = engine.url.render_as_string(hide_password=True)
+            if healthy:
+                db_logger.info("Replica %s is healthy", replica)
+            else:
+                db_logger.warning("Replica %s failed its health check, reading from the others: %s", replica, error)
+        self.healthy[index] = healthy
+
+    async def run_health_checks(self) -> None:
+        # long running task started by the app lifespan
+        while True:
+            await asyncio.gather(*(self._check(index) for index in range(len(self.engines))))
+            await asyncio.sleep(app_config.DATABASE_REPLICA_CHECK_INTERVAL)
+
+
+replica_router = ReplicaRouter(app_config.DATABASE_REPLICA_URLS)
+
+# requests that may be served from a replica, everything else is a write
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+def _sticky_key(request: Request) -> str:
+    # the caller's token identifies them, anonymous callers fall back to their address
+    caller = request.headers.get('authorization') or (request.client.host if request.client else '')
+    return "db:primary:" + hashlib.blake2b(caller.encode(), digest_size=16).hexdigest()
+
+
+async def _session_factory(request: Request, redis: Redis) -> async_sessionmaker:
+    if not replica_router.sessions:
+        return async_session
+    key = _sticky_key(request)
+    try:
+        if request.method not in READ_METHODS:
+            # reads from this caller stay on the primary until the replicas have caught up
+            await redis.set(key, 1, ex=app_config.DATABASE_READ_YOUR_WRITES_SECONDS)
+            return async_session
+        if await redis.exists(key):
+            return async_session
+    except RedisError as e:
+        db_logger.warning("Cannot check read-your-writes window, reading from the primary: %s", e)
+        return async_session
+    return replica_router.session_factory() or async_session
+
+
+# the sessions a request reads through, also for work that outlives the
+# request's own session such as a streamed response
+async def get_session_factory(request: Request, redis: Redis = Depends(get_redis)) -> async_sessionmaker:
+    return await _session_factory(request, redis)
+
+
+# create the session generator that we will use in our dependancy injection,
+# reads go to a replica when there is one and the caller has not just written
+async def get_db(session_factory: async_sessionmaker = Depends(get_session_factory)):
+    async with session_factory() as db:
+        yield db
+
+
+@asynccontextmanager
+async def primary_session(db: AsyncSession) -> AsyncIterator[AsyncSession]:
+    # the session itself when it is on the primary, otherwise one that is
+    if db.bind is engine:
+        yield db
+    else:
+        async with async_session() as primary:
+            yield primary
+
+
+def from_primary(db: AsyncSession, load: Callable[[AsyncSession], Awaitable[T]]) -> Callable[[], Awaitable[T]]:
+    """
+    A loader for the shared redis caches that always reads the primary
+
+    A write drops or bumps the cache entries it changes, and the next miss
+    refills them for everyone. Filled from a replica that has not caught up
+    yet, the old row would be cached for the whole TTL, served to the writer
+    too despite its read-your-writes window, and keep old ETags answering
+    304. Misses are rare, so sending them to the primary costs little.
+    """
+    async def loader() -> T:
+        async with primary_session(db) as session:
+            return await load(session)
+    return loader
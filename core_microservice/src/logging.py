@@ -1,9 +1,14 @@
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
-from typing import Optional
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
+from src.settings import app_config
 
 class CustomFormatter(logging.Formatter):
     """Custom formatter with colors for different log levels"""
@@ -18,18 +23,64 @@ class CustomFormatter(logging.Formatter):
     def __init__(self, fmt: str):
         super().__init__()
         self.fmt = fmt
+        # one formatter per level, built once rather than for every record
         self.FORMATS = {
-            logging.DEBUG: self.grey + self.fmt + self.reset,
-            logging.INFO: self.blue + self.fmt + self.reset,
-            logging.WARNING: self.yellow + self.fmt + self.reset,
-            logging.ERROR: self.red + self.fmt + self.reset,
-            logging.CRITICAL: self.bold_red + self.fmt + self.reset
+            logging.DEBUG: logging.Formatter(self.grey + self.fmt + self.reset),
+            logging.INFO: logging.Formatter(self.blue + self.fmt + self.reset),
+            logging.WARNING: logging.Formatter(self.yellow + self.fmt + self.reset),
+            logging.ERROR: logging.Formatter(self.red + self.fmt + self.reset),
+            logging.CRITICAL: logging.Formatter(self.bold_red + self.fmt + self.reset)
         }
+        self.default = logging.Formatter(self.fmt)
 
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self.FORMATS.get(record.levelno, self.default).format(record)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hands records to a listener thread that formats and writes them
+
+    Only the message arguments and any traceback are rendered on the
+    calling thread, since they may not survive until the listener gets to
+    the record. Everything else, including the handlers' formatting and the
+    I/O, happens off the request path.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_traceback_formatter = logging.Formatter()
+
+# listener threads of every logger, stopped at exit so queued records are flushed
+_listeners: List[QueueListener] = []
+
+def stop_logging() -> None:
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(stop_logging)
 
 def setup_logger(
     name: str,
@@ -39,6 +90,9 @@ def setup_logger(
 ) -> logging.Logger:
     """
     Setup logger with console and file handlers
+
+    The logger itself only queues records, the handlers run on a listener
+    thread. LOG_FORMAT=json switches both handlers to JSON lines.
     
     Args:
         name: Logger name
@@ -54,10 +108,13 @@ def setup_logger(
     if logger.handlers:
         return logger
 
+    json_output = app_config.LOG_FORMAT == 'json'
+    handlers = []
+
     # Console handler with colors
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(CustomFormatter(log_format))
-    logger.addHandler(console_handler)
+    console_handler.setFormatter(JsonFormatter() if json_output else CustomFormatter(log_format))
+    handlers.append(console_handler)
 
     # File handler if log_file specified
     if log_file:
@@ -71,8 +128,14 @@ def setup_logger(
             backupCount=5,
             encoding='utf-8'
         )
-        file_handler.setFormatter(logging.Formatter(log_format))
-        logger.addHandler(file_handler)
+        file_handler.setFormatter(JsonFormatter() if json_output else logging.Formatter(log_format))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
 
     return logger
 
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, List, Sequence, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest
+)
+from prometheus_client import multiprocess
+from prometheus_client.core import HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.settings import app_config
+
+# set for every worker when running several, each process then writes its
+# samples to files there and /metrics aggregates them
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# label for requests no route matched, so unknown paths cannot blow up the label set
+UNMATCHED = '<unmatched>'
+
+LABELS = ['method', 'route', 'status']
+# both end in +Inf, as a histogram's buckets must
+LATENCY_BUCKETS = Histogram.DEFAULT_BUCKETS
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, float('inf'))
+LATENCY_METRIC = ('http_request_duration_seconds', 'Time to send the full response')
+SIZE_METRIC = ('http_response_size_bytes', 'Size of the response body')
+
+# requests flush() observes before letting the loop run again, a few milliseconds' worth
+FLUSH_CHUNK = 250
+
+# observed only in multiprocess mode, where they write to the worker's files.
+# In a single process RequestMetrics serves its own totals under these names
+REQUEST_LATENCY = Histogram(*LATENCY_METRIC, LABELS, buckets=LATENCY_BUCKETS, registry=None)
+RESPONSE_SIZE = Histogram(*SIZE_METRIC, LABELS, buckets=SIZE_BUCKETS, registry=None)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests currently being served',
+    ['method'],
+    multiprocess_mode='livesum'
+)
+
+
+class _Totals:
+    # one series' requests per bucket (not cumulative yet) and the sums
+    __slots__ = ('latencies', 'latency_sum', 'sizes', 'size_sum')
+
+    def __init__(self):
+        self.latencies = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.sizes = [0] * len(SIZE_BUCKETS)
+        self.size_sum = 0
+
+
+def _buckets(bounds: Sequence[float], counts: List[int]) -> List[Tuple[str, int]]:
+    return list(zip(map(floatToGoString, bounds), accumulate(counts)))
+
+
+class RequestMetrics:
+    """
+    Per-process request metrics, recorded out of the request's way
+
+    Observing straight into prometheus_client takes a label lookup, a lock
+    and a bucket scan per metric, and an mmap write per value in
+    multiprocess mode. In a single process a request only adds itself to
+    its series' bucket counts and sums, and the registry collects those
+    totals from here at scrape time, so there is nothing to flush.
+
+    In multiprocess mode the values have to reach the worker's files
+    through the histograms, so a request appends its samples and flush()
+    observes them once a second and before every scrape. It lets the loop
+    run again every FLUSH_CHUNK requests, so a backlog is never replayed in
+    one go.
+    """
+
+    def __init__(self, multiprocess: bool = MULTIPROCESS):
+        self.multiprocess = multiprocess
+        # (method, route, status) -> (latencies, sizes) waiting for flush(), in multiprocess mode
+        self._pending: Dict[Tuple[str, str, int], Tuple[List[float], List[int]]] = {}
+        # (method, route, status) -> totals since the start, in a single process
+        self._totals: Dict[Tuple[str, str, int], _Totals] = {}
+        self._flushing = asyncio.Lock()
+        self.in_flight: Dict[str, int] = {}
+
+    def observe(self, method: str, route: str, status: int, elapsed: float, size: int) -> None:
+        key = (method, route, status)
+        if self.multiprocess:
+            series = self._pending.get(key)
+            if series is None:
+                series = self._pending[key] = ([], [])
+            series[0].append(elapsed)
+            series[1].append(size)
+            return
+
+        totals = self._totals.get(key)
+        if totals is None:
+            totals = self._totals[key] = _Totals()
+        # a value on a bound falls in that bucket, as le means
+        totals.latencies[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        totals.latency_sum += elapsed
+        totals.sizes[bisect_left(SIZE_BUCKETS, size)] += 1
+        totals.size_sum += size
+
+    def collect(self) -> List[HistogramMetricFamily]:
+        # called by the registry on a scrape, in a single process
+        latency = HistogramMetricFamily(*LATENCY_METRIC, labels=LABELS)
+        response_size = HistogramMetricFamily(*SIZE_METRIC, labels=LABELS)
+        for (method, route, status), totals in self._totals.items():
+            labels = [method, route, str(status)]
+            latency.add_metric(labels, _buckets(LATENCY_BUCKETS, totals.latencies), totals.latency_sum)
+            response_size.add_metric(labels, _buckets(SIZE_BUCKETS, totals.sizes), totals.size_sum)
+        return [latency, response_size]
+
+    async def flush(self) -> None:
+        # a scrape waits for a flush already under way, then takes what came in since
+        async with self._flushing:
+            for method, count in self.in_flight.items():
+                IN_FLIGHT.labels(method).set(count)
+
+            pending, self._pending = self._pending, {}
+            observed = 0
+            for (method, route, status), (latencies, sizes) in pending.items():
+                labels = (method, route, str(status))
+                latency = REQUEST_LATENCY.labels(*labels)
+                response_size = RESPONSE_SIZE.labels(*labels)
+                for elapsed, size in zip(latencies, sizes):
+                    latency.observe(elapsed)
+                    response_size.observe(size)
+                    observed += 1
+                    if observed % FLUSH_CHUNK == 0:
+                        await asyncio.sleep(0)
+
+    async def run_flush(self) -> None:
+        # long running task started by the app lifespan
+        while True:
+            await asyncio.sleep(app_config.METRICS_FLUSH_INTERVAL)
+            await self.flush()
+
+
+request_metrics = RequestMetrics()
+if not MULTIPROCESS:
+    REGISTRY.register(request_metrics)
+
+
+async def render_metrics() -> Tuple[bytes, str]:
+    await request_metrics.flush()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+async def mark_process_dead() -> None:
+    # hand over what is left and drop this worker's live gauges, called when it shuts down
+    await request_metrics.flush()
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    Records latency and response size per route, method and status
+
+    Written as plain ASGI rather than on BaseHTTPMiddleware to stay out of
+    the way of streaming responses and keep the per-request cost down. The
+    route label is the path template (/api/chapters/{id}), which the router
+    leaves in the scope once it has matched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        in_flight = request_metrics.in_flight
+        in_flight[method] = in_flight.get(method, 0) + 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight[method] -= 1
+            route = scope.get('route')
+            request_metrics.observe(
+                method,
+                route.path_format if route is not None else UNMATCHED,
+                status,
+                elapsed,
+                size
+            )
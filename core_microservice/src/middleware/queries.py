@@ -0,0 +1,117 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Optional
+from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.settings import app_config
+from src.logging import db_logger
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryStats:
+    """Statements run and time spent in the database while serving one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.budget: Optional[int] = None
+
+
+# the stats of the request being served, unset outside of requests
+current_queries: ContextVar[Optional[QueryStats]] = ContextVar('current_queries', default=None)
+
+
+def _redact(parameters: Any, executemany: bool) -> Any:
+    # only the shape and types of the parameters, never their values
+    if executemany:
+        return f"{len(parameters)} parameter sets"
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    stats = current_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+    if app_config.DB_SLOW_QUERY_MS is not None and elapsed * 1000 >= app_config.DB_SLOW_QUERY_MS:
+        db_logger.warning(
+            "Slow query (%.1f ms): %s parameters: %s",
+            elapsed * 1000, statement, _redact(parameters, executemany)
+        )
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def query_budget(limit: int):
+    """
+    Declare the most statements a route should run, as a route dependency
+
+    Going over is logged, or fails the request with DB_QUERY_BUDGET_STRICT
+    on, which is how the tests catch N+1 regressions:
+
+        @router.get('/', dependencies=[query_budget(3)])
+    """
+    def declare() -> None:
+        stats = current_queries.get()
+        if stats is not None:
+            stats.budget = limit
+    return Depends(declare)
+
+
+class QueryStatsMiddleware:
+    """
+    Counts the statements each request runs and reports them
+
+    The totals go out in a Server-Timing header (db;dur=<ms>;desc="<n>
+    queries"), which browsers show next to the request, and are checked
+    against the route's query_budget when the response starts.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_queries.set(stats)
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                if stats.budget is not None and stats.count > stats.budget:
+                    detail = (
+                        f"{scope['method']} {scope['path']} ran {stats.count} queries, "
+                        f"over its budget of {stats.budget}"
+                    )
+                    if app_config.DB_QUERY_BUDGET_STRICT:
+                        raise QueryBudgetExceeded(detail)
+                    db_logger.warning(detail)
+                if app_config.DB_SERVER_TIMING:
+                    headers = MutableHeaders(scope=message)
+                    headers.append('Server-Timing', f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_queries.reset(token)
@@ -0,0 +1,233 @@
+import math
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from jose import JWTError, jwt
+from redis.exceptions import RedisError
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.settings import app_config
+from src.cache import redis_pool
+from src.logging import app_logger
+
+# take a token from every bucket a request falls under, or from none of them.
+# KEYS are the buckets, ARGV their capacity and refill per second in turn.
+# Returns whether the request is allowed, then each bucket's level after it
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local level = tonumber(bucket[1]) or capacity
+    local at = tonumber(bucket[2]) or now
+    levels[i] = math.min(capacity, level + math.max(0, now - at) * rate)
+    if levels[i] < 1 then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local level = levels[i] - allowed
+    redis.call('HSET', key, 'tokens', level, 'at', now)
+    -- a full bucket is the same as no bucket, so it only lives until it refills
+    redis.call('PEXPIRE', key, math.ceil((capacity - level) / rate * 1000) + 1000)
+    -- numbers are cut down to integers on the way out of lua, strings are not
+    result[i + 1] = tostring(level)
+end
+return result
+"""
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class RateLimit:
+    """
+    A token bucket, written as "<count>/<period>" such as "10/minute"
+
+    The bucket holds `count` tokens and refills at count per period, so a
+    client can burst up to the full count and is then held to the average.
+    """
+
+    def __init__(self, spec: str):
+        count, _, period = spec.partition('/')
+        if not count.strip().isdigit() or int(count) < 1 or period.strip() not in PERIODS:
+            raise ValueError(f"Invalid rate limit {spec!r}, expected <count>/<{'|'.join(PERIODS)}>")
+        self.capacity = int(count)
+        self.window = PERIODS[period.strip()]
+        self.rate = self.capacity / self.window
+
+
+class RateLimitRule:
+    # the limits of one route, by what the client is identified with
+    def __init__(self, name: str, pattern: re.Pattern, limits: Dict[str, RateLimit]):
+        self.name = name
+        self.pattern = pattern
+        self.limits = limits
+
+
+def compile_rules(config: Dict[str, Dict[str, str]]) -> Dict[str, List[RateLimitRule]]:
+    # "POST /api/stories/{id}/import" -> rules by method, matched on the path template
+    rules: Dict[str, List[RateLimitRule]] = {}
+    for name, limits in config.items():
+        method, _, path = name.partition(' ')
+        pattern, _, _ = compile_path(path)
+        rules.setdefault(method.upper(), []).append(
+            RateLimitRule(name, pattern, {scope: RateLimit(spec) for scope, spec in limits.items()})
+        )
+    return rules
+
+
+class LocalBuckets:
+    """
+    In-process token buckets, used while redis cannot be reached
+
+    Each worker then only counts its own requests, so a client gets up to
+    the limit times the number of workers. Buckets are dropped oldest first
+    past RATE_LIMIT_FALLBACK_SIZE, which at worst lets a client start over
+    with a full bucket.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, buckets: List[Tuple[str, RateLimit]]) -> Tuple[bool, List[float]]:
+        now = time.monotonic()
+        levels = []
+        for key, limit in buckets:
+            level, at = self._buckets.pop(key, (limit.capacity, now))
+            levels.append(min(limit.capacity, level + (now - at) * limit.rate))
+        allowed = all(level >= 1 for level in levels)
+        if allowed:
+            levels = [level - 1 for level in levels]
+
+        for (key, _), level in zip(buckets, levels):
+            self._buckets[key] = (level, now)
+        while len(self._buckets) > self.size:
+            del self._buckets[next(iter(self._buckets))]
+        return allowed, levels
+
+
+def _client_ip(scope: Scope) -> Optional[str]:
+    # behind a proxy this is only the client's address when uvicorn runs with --proxy-headers
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+def _username(scope: Scope) -> Optional[str]:
+    # the user a valid bearer token was issued to, forged or expired tokens count as anonymous
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            if scheme.lower() != 'bearer':
+                return None
+            try:
+                payload = jwt.decode(token, app_config.SECRET_KEY, algorithms=[app_config.AUTH_ALGO])
+            except JWTError:
+                return None
+            return payload.get('sub')
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    Token bucket rate limits per route, by client IP and by user
+
+    Every bucket a request falls under is checked and taken from in a single
+    lua script, one redis round trip, and only for routes that have limits
+    in RATE_LIMITS. Responses carry RateLimit-Limit, -Remaining, -Reset and
+    -Policy for the bucket closest to running out, and a rejected request
+    gets a 429 with Retry-After. When redis is down the buckets are kept in
+    process instead of failing open.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Optional[Dict[str, Dict[str, str]]] = None):
+        self.app = app
+        self.rules = compile_rules(app_config.RATE_LIMITS if limits is None else limits)
+        self.fallback = LocalBuckets(app_config.RATE_LIMIT_FALLBACK_SIZE)
+        self._redis_down = False
+
+    def _match(self, scope: Scope) -> Optional[RateLimitRule]:
+        for rule in self.rules.get(scope['method'], ()):
+            if rule.pattern.match(scope['path']):
+                return rule
+        return None
+
+    async def _take(self, buckets: List[Tuple[str, RateLimit]]) -> Tuple[bool, List[float]]:
+        args = []
+        for _, limit in buckets:
+            args.extend((limit.capacity, limit.rate))
+        try:
+            redis = redis_pool.client
+            if redis is None:
+                raise RedisError("Redis pool is not connected")
+            allowed, *levels = await redis.eval(TAKE_SCRIPT, len(buckets), *(key for key, _ in buckets), *args)
+        except RedisError as e:
+            if not self._redis_down:
+                app_logger.warning("Rate limiting in process, redis is unavailable: %s", e)
+                self._redis_down = True
+            return self.fallback.take(buckets)
+
+        if self._redis_down:
+            app_logger.info("Rate limiting back on redis")
+            self._redis_down = False
+        return bool(allowed), [float(level) for level in levels]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        rule = self._match(scope)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        identities = {'ip': _client_ip(scope)}
+        if 'user' in rule.limits:
+            identities['user'] = _username(scope)
+        buckets = [
+            (f"ratelimit:{rule.name}:{kind}:{identities[kind]}", limit)
+            for kind, limit in rule.limits.items()
+            if identities.get(kind) is not None
+        ]
+        if not buckets:
+            await self.app(scope, receive, send)
+            return
+
+        allowed, levels = await self._take(buckets)
+
+        # report the bucket closest to running out
+        level, limit = min(zip(levels, (limit for _, limit in buckets)), key=lambda bucket: bucket[0])
+        headers = {
+            'RateLimit-Limit': str(limit.capacity),
+            'RateLimit-Remaining': str(max(math.floor(level), 0)),
+            'RateLimit-Reset': str(math.ceil((limit.capacity - level) / limit.rate)),
+            'RateLimit-Policy': f"{limit.capacity};w={limit.window}"
+        }
+
+        if not allowed:
+            retry_after = max(
+                (1 - level) / limit.rate
+                for level, (_, limit) in zip(levels, buckets)
+                if level < 1
+            )
+            headers['Retry-After'] = str(math.ceil(retry_after))
+            app_logger.debug("Rate limited %s %s for %s", scope['method'], scope['path'], identities)
+            response = JSONResponse({'detail': 'Too many requests'}, status_code=429, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,8 +1,12 @@
 from typing import List, Optional
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Text, UniqueConstraint, MetaData
+from sqlalchemy import Text, UniqueConstraint, MetaData, Index, Column, Computed, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from pydantic import EmailStr
 from datetime import datetime
+from src.compression import CompressedText
 
 # Create metadata object with naming convention
 metadata = MetaData(naming_convention={
@@ -16,6 +20,9 @@ metadata = MetaData(naming_convention={
 # Set SQLModel metadata
 SQLModel.metadata = metadata
 
+# text search configuration the search documents are built with
+SEARCH_CONFIG = 'english'
+
 
 class User(SQLModel, table=True):
 
@@ -31,6 +38,11 @@ class User(SQLModel, table=True):
     # relationship
     stories: List["Story"] = Relationship(back_populates='user')
 
+    # trigram index for username autocomplete
+    __table_args__ = (
+        Index('ix_user_username_trgm', 'username', postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}),
+    )
+
 
 class Story(SQLModel, table=True):
 
@@ -46,6 +58,14 @@ class Story(SQLModel, table=True):
     user: Optional["User"] = Relationship(back_populates='stories')
     chapters: List["Chapter"] = Relationship(back_populates='story')
 
+    # keyset pagination indexes, one per sortable column with id as the tiebreaker
+    __table_args__ = (
+        Index('ix_story_created_at_id', 'created_at', 'id'),
+        Index('ix_story_updated_at_id', text('coalesce(updated_at, created_at)'), 'id'),
+        # trigram index for story name autocomplete
+        Index('ix_story_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
+
 
 class Chapter(SQLModel, table=True):
 
@@ -53,10 +73,13 @@ class Chapter(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     story_id: int = Field(foreign_key='story.id')
     title: str = Field(index=True)
-    content: str = Field(sa_type=Text)
+    content: str = Field(sa_type=CompressedText)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: Optional[datetime] = Field(default=None)
     is_published: bool = Field(default=False)
+    # computed from the content whenever it is written
+    word_count: int = Field(default=0)
+    reading_time: int = Field(default=0)
 
     # relationships
     story: Optional["Story"] = Relationship(back_populates='chapters')
@@ -64,6 +87,79 @@ class Chapter(SQLModel, table=True):
     # constraints
     __table_args__ = (
         UniqueConstraint('story_id', 'title', name='unique_chapter_title_per_story'),
+        # covers the table of contents, so it is answered by an index only scan
+        Index(
+            'ix_chapter_toc',
+            'story_id',
+            'is_published',
+            'id',
+            postgresql_include=['title', 'created_at', 'updated_at', 'word_count', 'reading_time']
+        ),
     )
 
-    
\ No newline at end of file
+
+class StoryStats(SQLModel, table=True):
+
+    # aggregates over a story's chapters, kept current by src.background.story_stats
+    story_id: int = Field(foreign_key='story.id', primary_key=True, ondelete='CASCADE')
+    chapter_count: int = Field(default=0)
+    published_chapter_count: int = Field(default=0)
+    # words in published chapters
+    word_count: int = Field(default=0)
+    last_chapter_at: Optional[datetime] = Field(default=None)
+    # when the row last changed, part of the story's ETag
+    updated_at: Optional[datetime] = Field(default=None)
+    # when a reconciliation last snapshotted the story, changes queued before it are already counted
+    reconciled_at: Optional[datetime] = Field(default=None)
+
+
+# full text search documents, maintained by postgres and left unmapped so
+# loading a story or chapter never drags them along. Chapter content is
+# stored compressed, so its document is written with every chapter update
+# instead of being generated, and only exists while the chapter is published.
+# Search is postgres only, so on other databases (sqlite in tests) the tables
+# and indexes are created without them
+@compiles(CreateColumn)
+def _create_column(element, compiler, **kw):
+    if element.element.info.get('postgresql_only') and compiler.dialect.name != 'postgresql':
+        return None
+    return compiler.visit_create_column(element, **kw)
+
+
+Story.__table__.append_column(Column(
+    'search_vector',
+    TSVECTOR,
+    Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', name), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', blurb), 'B')",
+        persisted=True
+    ),
+    info={'postgresql_only': True}
+))
+Chapter.__table__.append_column(Column('search_vector', TSVECTOR, nullable=True, info={'postgresql_only': True}))
+Index('ix_story_search_vector', Story.__table__.c.search_vector, postgresql_using='gin').ddl_if(dialect='postgresql')
+Index(
+    'ix_chapter_search_vector',
+    Chapter.__table__.c.search_vector,
+    postgresql_using='gin',
+    postgresql_where=Chapter.__table__.c.is_published
+).ddl_if(dialect='postgresql')
+
+
+class ChapterRevision(SQLModel, table=True):
+
+    # main cols
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chapter_id: int = Field(foreign_key='chapter.id', ondelete='CASCADE')
+    revision: int
+    # snapshots hold the full text, deltas an edit script against the revision before
+    is_snapshot: bool
+    # deltas since the last snapshot, bounds the work to rebuild this revision
+    chain_length: int = Field(default=0)
+    data: str = Field(sa_type=CompressedText)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # constraints
+    __table_args__ = (
+        UniqueConstraint('chapter_id', 'revision', name='unique_revision_per_chapter'),
+    )
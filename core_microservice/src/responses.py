@@ -0,0 +1,22 @@
+from typing import Union
+from pydantic import BaseModel
+from starlette.responses import Response
+from src.cache import to_json
+
+
+class ModelResponse(Response):
+    """
+    JSON response for output the services have already validated
+
+    A model returned from a route is validated against the route's
+    response_model, dumped to python and encoded again by FastAPI, which
+    costs twice what building it did. Routes return this instead, keeping
+    response_model for the OpenAPI schema, and the model is encoded once by
+    pydantic-core. JSON taken from the response cache is sent as it is.
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Union[BaseModel, bytes]) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content)
@@ -0,0 +1,199 @@
+from fastapi import APIRouter, Request, Depends, HTTPException, Query, Header
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional, Tuple
+from src.database import get_db
+from src.middleware.queries import query_budget
+from src.responses import ModelResponse
+from src.cache import get_redis
+from redis.asyncio import Redis
+from src.services.auth import get_current_active_user, get_optional_user
+from src.services.chapters import chapter_service
+from src.services.revisions import revision_service
+from src.schema import (
+    AuthenticatedUser,
+    ChapterCreate,
+    ChapterUpdate,
+    ChapterResponse,
+    PaginatedChapterResponse,
+    ChapterTOCResponse,
+    ChapterRevisionSummary,
+    ChapterRevisionResponse
+)
+
+router = APIRouter(
+    prefix='/api/chapters',
+    tags=['chapters'],
+    responses={404: {'description': 'Not found'}}
+)
+
+
+def _parse_range(range_header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive offsets
+
+    Returns None when the whole body should be sent. Multiple ranges are
+    not supported and, as the spec allows, are answered with the full body.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    unsatisfiable = HTTPException(
+        status_code=416,
+        detail="Requested range not satisfiable",
+        headers={'Content-Range': f"bytes */{length}"}
+    )
+
+    start, dash, end = range_header[len('bytes='):].strip().partition('-')
+    if not dash:
+        # not a range at all, ignored like any other malformed header
+        return None
+    try:
+        if not start:
+            # suffix range: the last N bytes, of which an empty body has none
+            suffix = int(end)
+            if suffix <= 0 or length == 0:
+                raise unsatisfiable
+            return max(length - suffix, 0), length - 1
+        first = int(start)
+        last = int(end) if end else length - 1
+    except ValueError:
+        return None
+
+    if first >= length or last < first:
+        raise unsatisfiable
+
+    return first, min(last, length - 1)
+
+
+# get the chapters of a story, drafts only for its author
+@router.get('/story/{story_id}', response_model=PaginatedChapterResponse, dependencies=[query_budget(2)])
+async def get_chapters(
+    story_id: int,
+    page: int = Query(default=1, gt=0),
+    page_size: int = Query(default=10, gt=0, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> ModelResponse:
+    user_id = current_user.id if current_user is not None else None
+    return ModelResponse(await chapter_service.get_chapters(story_id, db, page, page_size, user_id))
+
+# get a story's table of contents, without any chapter content.
+# Only the author can include their drafts, everyone else gets the published chapters
+@router.get('/story/{story_id}/toc', response_model=ChapterTOCResponse, dependencies=[query_budget(2)])
+async def get_table_of_contents(
+    story_id: int,
+    published_only: bool = Query(default=True),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> ModelResponse:
+    user_id = current_user.id if current_user is not None else None
+    return ModelResponse(await chapter_service.get_table_of_contents(story_id, db, published_only, user_id))
+
+# get a chapter by id, a conditional request is answered without reading the content.
+# A draft is a 404 for anyone but the author
+@router.get('/{id}', response_model=ChapterResponse)
+async def get_chapter(
+    id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> Response:
+    user_id = current_user.id if current_user is not None else None
+    validators = await chapter_service.get_chapter_validators(id, db, redis, user_id)
+    if validators.not_modified(request.headers):
+        return Response(status_code=304, headers=validators.headers())
+    return ModelResponse(await chapter_service.get_chapter(id, db), headers=validators.headers())
+
+# stream a chapter's raw text, honouring Range so readers can resume
+@router.get('/{id}/content')
+async def get_chapter_content(
+    id: int,
+    request: Request,
+    range_header: Optional[str] = Header(default=None, alias='Range'),
+    if_range: Optional[str] = Header(default=None, alias='If-Range'),
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> Response:
+    user_id = current_user.id if current_user is not None else None
+    validators = await chapter_service.get_chapter_validators(id, db, redis, user_id)
+    if validators.not_modified(request.headers):
+        return Response(status_code=304, headers=validators.headers())
+
+    codec, length = await chapter_service.get_content_header(id, db)
+    # a resumed download of an older version starts over with the whole text
+    if if_range is not None and if_range not in (validators.etag, validators.headers()['Last-Modified']):
+        range_header = None
+    byte_range = _parse_range(range_header, length)
+
+    headers = {'Accept-Ranges': 'bytes', **validators.headers()}
+    if byte_range is None:
+        start, end, status_code = 0, length - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers['Content-Range'] = f"bytes {start}-{end}/{length}"
+    headers['Content-Length'] = str(end - start + 1 if length else 0)
+
+    return StreamingResponse(
+        chapter_service.stream_content(id, codec, start, end),
+        status_code=status_code,
+        media_type='text/plain; charset=utf-8',
+        headers=headers
+    )
+
+# list the revisions of a chapter, newest first, for its author only
+@router.get('/{id}/revisions', response_model=List[ChapterRevisionSummary])
+async def get_chapter_revisions(
+    id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> List[ChapterRevisionSummary]:
+    user_id = current_user.id if current_user is not None else None
+    return await revision_service.get_revisions(id, db, user_id)
+
+# get a chapter as it was at a given revision, for its author only
+@router.get('/{id}/revisions/{revision}', response_model=ChapterRevisionResponse)
+async def get_chapter_revision(
+    id: int,
+    revision: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> ChapterRevisionResponse:
+    user_id = current_user.id if current_user is not None else None
+    return await revision_service.get_revision(id, revision, db, user_id)
+
+# create a chapter
+@router.post('/', response_model=ChapterResponse)
+async def create_chapter(
+    request: Request,
+    chapter_data: ChapterCreate,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> ChapterResponse:
+    return await chapter_service.create_chapter(chapter_data, current_user.id, db, redis)
+
+# update a chapter
+@router.put('/', response_model=ChapterResponse)
+async def update_chapter(
+    request: Request,
+    chapter_data: ChapterUpdate,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> ChapterResponse:
+    return await chapter_service.update_chapter(chapter_data, current_user.id, db, redis)
+
+# delete a chapter
+@router.delete('/{id}')
+async def delete_chapter(
+    id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> dict[str, str]:
+    return await chapter_service.delete_chapter(id, current_user.id, db, redis)
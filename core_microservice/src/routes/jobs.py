@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from src.cache import get_redis
+from redis.asyncio import Redis
+from src.services.auth import get_current_active_user
+from src.background.jobs import get_status
+from src.schema import AuthenticatedUser, JobStatusResponse
+
+router = APIRouter(
+    prefix='/api/jobs',
+    tags=['jobs'],
+    responses={404: {'description': 'Not found'}}
+)
+
+# check on a job a route enqueued
+@router.get('/{job_id}', response_model=JobStatusResponse)
+async def get_job_status(
+    job_id: str,
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> JobStatusResponse:
+    job = await get_status(redis, job_id)
+    # someone else's job is reported as missing, so job ids cannot be probed
+    if job is None or job.get('owner_id') != str(current_user.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(
+        id=job_id,
+        job=job['job'],
+        queue=job['queue'],
+        state=job['state'],
+        attempts=int(job['attempts']),
+        progress=job.get('progress'),
+        total=job.get('total'),
+        result=job.get('result'),
+        error=job.get('error'),
+        updated_at=datetime.utcfromtimestamp(float(job['updated_at']))
+    )
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from src.middleware.metrics import render_metrics
+
+router = APIRouter(tags=['metrics'])
+
+# request metrics in the prometheus text format, for the scraper
+@router.get('/metrics', include_in_schema=False)
+async def metrics() -> Response:
+    body, content_type = await render_metrics()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Query, Depends
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Optional
+from src.database import get_db
+from src.middleware.queries import query_budget
+from src.services.search import search_service
+from src.services.autocomplete import autocomplete_service
+from src.schema import SearchResponse, AutocompleteResponse
+
+router = APIRouter(
+    prefix='/api/search',
+    tags=['search']
+)
+
+# full text search over stories and published chapters, best matches first
+@router.get('/', response_model=SearchResponse, dependencies=[query_budget(4)])
+async def search(
+    q: str = Query(min_length=1, max_length=200),
+    cursor: Optional[str] = Query(default=None),
+    page_size: int = Query(default=20, gt=0, le=50),
+    db: AsyncSession = Depends(get_db)
+) -> SearchResponse:
+    return await search_service.search(q, db, cursor, page_size)
+
+# type-ahead suggestions for story names and usernames
+@router.get('/autocomplete', response_model=AutocompleteResponse, dependencies=[query_budget(2)])
+async def autocomplete(
+    q: str = Query(min_length=2, max_length=100),
+    limit: int = Query(default=10, gt=0, le=20),
+    db: AsyncSession = Depends(get_db)
+) -> AutocompleteResponse:
+    return await autocomplete_service.autocomplete(q, db, limit)
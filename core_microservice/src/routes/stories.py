@@ -1,15 +1,28 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, Query
-from sqlmodel import Session
-from src.database import get_db
-from src.services.auth import get_current_active_user
+from fastapi import APIRouter, Request, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Optional, Union
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from src.database import get_db, get_session_factory
+from src.middleware.queries import query_budget
+from src.responses import ModelResponse
+from src.cache import get_redis, story_cache
+from redis.asyncio import Redis
+from src.services.auth import get_current_active_user, get_optional_user
 from src.services.stories import story_service
-from src.models import User
+from src.services.imports import story_import_service
+from src.services.exports import ExportFormat, MEDIA_TYPES, export_filename, story_export_service
 from src.schema import (
+    AuthenticatedUser,
     StoryCreate,
     StoryInfo,
     StoryResponse,
     UIStoriesResponse,
-    UserNameTag
+    CursorStoriesResponse,
+    StorySortField,
+    SortOrder,
+    CacheStatsResponse,
+    JobAcceptedResponse
 )
 
 router = APIRouter(
@@ -18,59 +31,102 @@ router = APIRouter(
     responses={404: {'description': 'Not found'}}
 )
 
-# get stories
-@router.get('/', response_model = UIStoriesResponse)
-def get_stories(
+# get stories, by page number when `page` is given and by cursor otherwise
+@router.get('/', response_model = Union[UIStoriesResponse, CursorStoriesResponse], dependencies=[query_budget(2)])
+async def get_stories(
     request: Request,
-    page: int = Query(gt=0),  
+    page: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[str] = Query(default=None),
     page_size: int = Query(default=10, gt=0, le=100),  
-    db: Session = Depends(get_db)
-) -> UIStoriesResponse:
-    return story_service.get_stories(db, page, page_size)
+    sort_by: StorySortField = Query(default='id'),
+    order: SortOrder = Query(default='asc'),
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis)
+) -> ModelResponse:
+    if page is not None:
+        return ModelResponse(await story_service.get_stories_json(db, page, page_size, sort_by, order, redis))
+    return ModelResponse(await story_service.get_stories_by_cursor_json(db, cursor, page_size, sort_by, order, redis))
 
-# get a story by id
-@router.get('/{id}', response_model=StoryResponse)
-def get_story(
+# story cache counters, for sizing the cache
+@router.get('/cache-stats', response_model=CacheStatsResponse)
+async def get_cache_stats() -> CacheStatsResponse:
+    return CacheStatsResponse(**story_cache.stats())
+
+# get a story by id, a conditional request is answered from the story's validators alone
+@router.get('/{id}', response_model=StoryResponse, dependencies=[query_budget(2)])
+async def get_story(
     id: int,
-    db: Session = Depends(get_db)
-) -> StoryResponse:
-    story = story_service.get_story_by_id(id, db)
-    return StoryResponse(
-        id=story.id,
-        name=story.name,
-        blurb=story.blurb,
-        author=UserNameTag(
-            id=story.user.id,
-            username=story.user.username
-        )
-    )
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis)
+) -> Response:
+    validators = await story_service.get_story_validators(id, db, redis)
+    if validators.not_modified(request.headers):
+        return Response(status_code=304, headers=validators.headers())
+    return ModelResponse(await story_service.get_story_json(id, db, redis, validators), headers=validators.headers())
 
 # create a story
 @router.post('/', response_model = StoryResponse)
-def create_story(
+async def create_story(
     request: Request,
     story_data: StoryInfo,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ) -> StoryResponse:
     story_create_data = StoryCreate(user_id=current_user.id, info=story_data)
-    return story_service.create_story(story_create_data, db)
+    return await story_service.create_story(story_create_data, db, redis)
+
+# import a whole story from an EPUB or a zip of Markdown/HTML chapters,
+# the import runs in the background and is followed through /api/jobs
+@router.post('/import', response_model=JobAcceptedResponse, status_code=202)
+async def import_story(
+    file: UploadFile = File(...),
+    name: Optional[str] = Form(default=None),
+    blurb: str = Form(default=''),
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> JobAcceptedResponse:
+    job_id = await story_import_service.enqueue(file, current_user.id, name, blurb, db, redis)
+    return JobAcceptedResponse(job_id=job_id)
 
+# download a story as an EPUB or a zip of Markdown chapters, streamed as it is built.
+# Only the author can include their drafts, everyone else gets the published chapters
+@router.get('/{id}/export', dependencies=[query_budget(1)])
+async def export_story(
+    id: int,
+    format: ExportFormat = Query(default='epub'),
+    published_only: bool = Query(default=True),
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    session_factory: async_sessionmaker = Depends(get_session_factory),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+) -> StreamingResponse:
+    story = await story_service.get_story_by_id(id, db, redis)
+    if current_user is None or current_user.id != story.author.id:
+        published_only = True
+    return StreamingResponse(
+        story_export_service.export(story, format, published_only, session_factory),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(story.name, format)}"'}
+    )
 
 # delete a story
 @router.delete('/{id}')
-def delete_story(
+async def delete_story(
     id: int,
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ) -> dict[str, str]:
-    story = story_service.get_story_by_id(id, db)
+    story = await story_service.get_story_by_id(id, db, redis)
 
-    if story.user.id != current_user.id:
+    if story.author.id != current_user.id:
         raise HTTPException(
             status_code=403,
             detail="You are not authorized to delete this story"
         )
     
-    return story_service.delete_story(id, db)
\ No newline at end of file
+    return await story_service.delete_story(id, db, redis)
\ No newline at end of file
@@ -1,13 +1,19 @@
 from fastapi import APIRouter, Request, Depends, Body
-from sqlmodel import Session
-from src.models import User
+from typing import List
+from sqlmodel.ext.asyncio.session import AsyncSession
 from src.services.auth import auth_service, get_current_active_user
+from src.services.user_cache import user_cache
 from src.database import get_db
+from src.cache import get_redis
+from redis.asyncio import Redis
 from src.schema import (
+    AuthenticatedUser,
     UserCreate,
     UserLogin,
     UserResponse,
-    TokenResponse
+    TokenResponse,
+    SessionResponse,
+    CacheStatsResponse
 )
 
 
@@ -19,37 +25,74 @@ router = APIRouter(
 
 
 @router.post('/register', response_model=UserResponse)
-def register(
+async def register(
     request: Request,
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis)
 ) -> UserResponse:
-    return auth_service.create_user(request, user_data, db)
+    return await auth_service.create_user(request, user_data, db, redis)
 
 
 
 @router.post('/login', response_model=UserResponse)
-def login(
+async def login(
     request: Request,
     login_data: UserLogin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis)
 ) -> UserResponse:
-    return auth_service.login(request, login_data, db)
+    return await auth_service.login(request, login_data, db, redis)
 
 
 @router.post('/token-refresh', response_model=TokenResponse)
-def refresh_token(
+async def refresh_token(
     request: Request,
-    refresh_token: str = Body(...)
+    refresh_token: str = Body(...),
+    redis: Redis = Depends(get_redis)
 ) -> TokenResponse:
-    return auth_service.verify_refresh_token(refresh_token)
+    return await auth_service.verify_refresh_token(refresh_token, redis)
 
 
 @router.post('/logout')
-def logout(
+async def logout(
     request: Request,
     refresh_token: str = Body(...),
-    current_user: User = Depends(get_current_active_user)
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> dict:
+    return await auth_service.logout(current_user, refresh_token, redis)
+
+
+@router.post('/logout-all')
+async def logout_all(
+    request: Request,
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> dict:
+    return await auth_service.logout_all(current_user, redis)
+
+
+@router.get('/sessions', response_model=List[SessionResponse])
+async def list_sessions(
+    request: Request,
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+) -> List[SessionResponse]:
+    return await auth_service.list_sessions(current_user, redis)
+
+
+@router.delete('/sessions/{session_id}')
+async def revoke_session(
+    session_id: str,
+    request: Request,
+    redis: Redis = Depends(get_redis),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ) -> dict:
-    return auth_service.logout(current_user, refresh_token)
-    
\ No newline at end of file
+    return await auth_service.revoke_session(current_user, session_id, redis)
+
+
+# authenticated user cache counters
+@router.get('/cache-stats', response_model=CacheStatsResponse)
+async def get_cache_stats() -> CacheStatsResponse:
+    return CacheStatsResponse(**user_cache.stats())
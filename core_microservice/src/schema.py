@@ -1,5 +1,5 @@
 from sqlmodel import SQLModel, Field
-from typing import List
+from typing import List, Literal
 from sqlalchemy import Text, Column
 from pydantic import EmailStr
 from datetime import datetime
@@ -20,11 +20,22 @@ class UserNameTag(SQLModel):
     id: int
     username: str
 
+# slim user record resolved from an access token
+class AuthenticatedUser(SQLModel):
+    id: int
+    username: str
+    email: str
+
 class TokenResponse(SQLModel):
     access_token: str
     refresh_token: str
     token_type: str = "bearer"
 
+# an active refresh token session
+class SessionResponse(SQLModel):
+    session_id: str
+    expires_at: datetime
+
 
 # story info schema
 class StoryInfo(SQLModel):
@@ -67,18 +78,120 @@ class PaginatedChapterResponse(SQLModel):
     page: int
     page_size: int
 
+# a chapter in a table of contents, without its content
+class ChapterTOCEntry(SQLModel):
+    id: int
+    title: str
+    is_published: bool
+    created_at: datetime
+    updated_at: datetime | None = None
+    word_count: int
+    reading_time: int
+
+# table of contents of a story
+class ChapterTOCResponse(SQLModel):
+    story_id: int
+    chapters: List[ChapterTOCEntry]
+    total_word_count: int
+    total_reading_time: int
+
+# a chapter revision without its content
+class ChapterRevisionSummary(SQLModel):
+    revision: int
+    is_snapshot: bool
+    created_at: datetime
+
+# a chapter revision rebuilt in full
+class ChapterRevisionResponse(SQLModel):
+    chapter_id: int
+    revision: int
+    created_at: datetime
+    content: str = Field(sa_column=Column(Text))
+
+# chapter aggregates shown on story cards
+class StoryStatsInfo(SQLModel):
+    chapter_count: int = 0
+    published_chapter_count: int = 0
+    word_count: int = 0
+    last_chapter_at: datetime | None = None
+
 # schema for shallow story response
 class StoryResponse(SQLModel):
     id: int
     name: str
     blurb: str = Field(sa_column=Column(Text))
     author: UserNameTag
+    stats: StoryStatsInfo = StoryStatsInfo()
 
 class UIStoriesResponse(SQLModel):
     page: int
     page_count: int
     stories: List[StoryResponse]
+
+# sort options for story listings
+StorySortField = Literal['id', 'created_at', 'updated_at']
+SortOrder = Literal['asc', 'desc']
+
+# keyset paginated story response
+class CursorStoriesResponse(SQLModel):
+    stories: List[StoryResponse]
+    next_cursor: str | None = None
+
+# read-through cache counters
+class CacheStatsResponse(SQLModel):
+    hits: int
+    misses: int
+    errors: int
+    hit_ratio: float
     
+# kinds of documents the search covers
+SearchResultKind = Literal['story', 'chapter']
+
+# a ranked search hit with a highlighted snippet
+class SearchResult(SQLModel):
+    kind: SearchResultKind
+    id: int
+    story_id: int
+    title: str
+    snippet: str
+    rank: float
+
+# keyset paginated search results
+class SearchResponse(SQLModel):
+    results: List[SearchResult]
+    next_cursor: str | None = None
+
+# a type-ahead suggestion
+class AutocompleteItem(SQLModel):
+    id: int
+    text: str
+
+# type-ahead suggestions for story names and usernames
+class AutocompleteResponse(SQLModel):
+    stories: List[AutocompleteItem]
+    users: List[AutocompleteItem]
+
+# kinds of states a background job moves through
+JobState = Literal['queued', 'running', 'failed', 'done', 'dead']
+
+# progress of a background job
+class JobStatusResponse(SQLModel):
+    id: str
+    job: str
+    queue: str
+    state: JobState
+    attempts: int
+    progress: int | None = None
+    total: int | None = None
+    # what the job produced, such as the id of an imported story
+    result: str | None = None
+    error: str | None = None
+    updated_at: datetime
+
+# a job accepted to run in the background
+class JobAcceptedResponse(SQLModel):
+    job_id: str
+
 # schema for user response
 class UserResponse(SQLModel):
     id: int
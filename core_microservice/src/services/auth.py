@@ -1,45 +1,43 @@
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, Request, Depends, status
 import time
 from jose import jwt, JWTError
 from src.models import User
-from typing import Optional, Union
+from typing import List, Optional, Tuple, Union
+from uuid import uuid4
 from src.settings import app_config
 from src.database import get_db
-from sqlmodel import Session, select
-from redis import Redis
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.services.passwords import password_hasher
+from src.services.user_cache import user_cache
+from src.services.tokens import refresh_token_store, session_id
+from src.services.autocomplete import autocomplete_service
+from redis.asyncio import Redis
 from datetime import datetime, timedelta
 from src.schema import (
     UserCreate,
     UserLogin,
     TokenResponse,
-    UserResponse
+    UserResponse,
+    AuthenticatedUser,
+    SessionResponse
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
+# the same, for routes anonymous callers may use too
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token', auto_error=False)
 
 class AuthService:
 
     def __init__(self):
-        self.pwd_context = CryptContext(
-            schemes=['bcrypt'],
-            deprecated='auto'
-        )
-        self.redis = Redis(
-            host=app_config.REDIS_HOST,
-            port=app_config.REDIS_PORT
-        )
-        try:
-            self.redis.ping()
-        except Exception as e:
-            raise Exception(f"Failed to connect to redis: {e}")
+        self.password_hasher = password_hasher
 
-    def hash_password(self, password: str) -> str:
-        return self.pwd_context.hash(password)
+    async def hash_password(self, password: str) -> str:
+        return await self.password_hasher.hash(password)
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.password_hasher.verify(plain_password, hashed_password)
     
     def create_access_token(
         self,
@@ -63,15 +61,26 @@ class AuthService:
         })
         return jwt.encode(to_encode, app_config.SECRET_KEY, app_config.AUTH_ALGO)
 
-    def create_user(
+    def issue_refresh_token(
+        self,
+        username: str
+    ) -> Tuple[str, str, int]:
+        # returns the token, its session id and its expiry timestamp
+        jti = uuid4().hex
+        refresh_token = self.create_refresh_token(data={'sub': username, 'jti': jti})
+        expires_at = jwt.get_unverified_claims(refresh_token)['exp']
+        return refresh_token, session_id(jti), expires_at
+
+    async def create_user(
         self,
         request: Request,
         user_data: UserCreate,
-        db: Session
+        db: AsyncSession,
+        redis: Optional[Redis] = None
     ) -> UserResponse:
         try:
 
-            user = self.get_user(user_data.username, db)
+            user = await self.get_user(user_data.username, db)
 
             if user:
                 raise HTTPException(
@@ -82,13 +91,14 @@ class AuthService:
             user_to_create = User(
                 username=user_data.username,
                 email=user_data.email,
-                password_hash=self.hash_password(user_data.password),
+                password_hash=await self.hash_password(user_data.password),
                 bio=user_data.bio
             )
 
             db.add(user_to_create)
-            db.commit()
-            db.refresh(user_to_create)
+            await db.commit()
+            await db.refresh(user_to_create)
+            await autocomplete_service.add('user', user_to_create.id, user_to_create.username, redis)
 
             return user_to_create
 
@@ -101,9 +111,10 @@ class AuthService:
             )
         
 
-    def verify_refresh_token(
+    async def verify_refresh_token(
         self,
-        refresh_token: str
+        refresh_token: str,
+        redis: Redis
     ) -> TokenResponse:
         try:
 
@@ -123,9 +134,19 @@ class AuthService:
                     detail="Invalid token"
                 )
             
-            token_key = f"refresh_token:{username}:{refresh_token}"
+            # tokens issued before sessions had a jti are tracked by the whole token
+            old_session_id = session_id(payload.get('jti') or refresh_token)
+            new_refresh_token, new_session_id, expires_at = self.issue_refresh_token(username)
+
+            rotated = await refresh_token_store.rotate(
+                redis,
+                username,
+                old_session_id,
+                new_session_id,
+                expires_at
+            )
 
-            if not self.redis.exists(token_key):
+            if not rotated:
                 raise HTTPException(
                     status_code=401,
                     detail="Token has been revoked"
@@ -133,7 +154,7 @@ class AuthService:
             
             access_token = self.create_access_token(data={'sub': username})
 
-            return TokenResponse(access_token=access_token, refresh_token=refresh_token)
+            return TokenResponse(access_token=access_token, refresh_token=new_refresh_token)
 
         except JWTError:
             raise HTTPException(
@@ -141,23 +162,20 @@ class AuthService:
                 detail="Invalid token refresh"
             )
         
-    def login(
+    async def login(
         self,
         request: Request,
         login_data: UserLogin,
-        db: Session
+        db: AsyncSession,
+        redis: Redis
     ) -> UserResponse:
         try:
-            user = self.authenticate_user(login_data.email, login_data.password, db)
+            user = await self.authenticate_user(login_data.email, login_data.password, db)
 
             access_token = self.create_access_token(data={'sub': user.username})
-            refresh_token = self.create_refresh_token(data={'sub': user.username})
+            refresh_token, refresh_session_id, expires_at = self.issue_refresh_token(user.username)
 
-            self.redis.setex(
-                f"refresh_token:{user.username}:{refresh_token}",
-                60*60*24*7,
-                1
-            )
+            await refresh_token_store.add(redis, user.username, refresh_session_id, expires_at)
 
             token_response=TokenResponse(access_token=access_token, refresh_token=refresh_token)
 
@@ -176,41 +194,91 @@ class AuthService:
                 detail=f"A database error occured: {e}"
             )
         
-    def logout(
+    async def logout(
         self,
-        user: User,
-        refresh_token: str
+        user: AuthenticatedUser,
+        refresh_token: str,
+        redis: Redis
     ) -> dict:
+        await user_cache.invalidate(user.username, redis)
         try:
             payload = jwt.decode(refresh_token, app_config.SECRET_KEY, algorithms=[app_config.AUTH_ALGO])
 
             username = payload.get('sub')
 
-            token_key = f"refresh_token:{username}:{refresh_token}"
-
-            self.redis.delete(token_key)
+            await refresh_token_store.revoke(
+                redis,
+                username,
+                session_id(payload.get('jti') or refresh_token)
+            )
 
             return {"message": "Successfully logged out"}
 
         except JWTError:
             return {"message": "Successfully logged out"}
+
+    async def logout_all(
+        self,
+        user: AuthenticatedUser,
+        redis: Redis
+    ) -> dict:
+        await user_cache.invalidate(user.username, redis)
+        await refresh_token_store.revoke_all(redis, user.username)
+        return {"message": "Successfully logged out of all sessions"}
+
+    async def list_sessions(
+        self,
+        user: AuthenticatedUser,
+        redis: Redis
+    ) -> List[SessionResponse]:
+        sessions = await refresh_token_store.list(redis, user.username)
+        return [
+            SessionResponse(
+                session_id=sid,
+                expires_at=datetime.utcfromtimestamp(expires_at)
+            )
+            for sid, expires_at in sessions
+        ]
+
+    async def revoke_session(
+        self,
+        user: AuthenticatedUser,
+        sid: str,
+        redis: Redis
+    ) -> dict:
+        if not await refresh_token_store.revoke(redis, user.username, sid):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Session not found"
+            )
+        return {"message": "Session revoked"}
     
     @staticmethod
-    def get_user(
+    async def get_user(
         username: str,
-        db: Session
+        db: AsyncSession
     ) -> Optional[User]:
         statement = select(User).where(User.username == username)
-        return db.exec(statement).first()
+        return (await db.exec(statement)).first()
+    
+    @staticmethod
+    async def get_user_by_email(
+        email: str,
+        db: AsyncSession
+    ) -> Optional[User]:
+        statement = select(User).where(User.email == email)
+        return (await db.exec(statement)).first()
     
-    def authenticate_user(
+    async def authenticate_user(
         self,
-        username: str,
+        email: str,
         password: str,
-        db: Session
+        db: AsyncSession
     ) -> User:
-        user = self.get_user(username, db)
-        if not user or not self.verify_password(password, user.password_hash):
+        user = await self.get_user_by_email(email, db)
+        # end the read so the connection goes back to the pool, the hash may queue for seconds behind other logins
+        await db.commit()
+        if not user or not await self.verify_password(password, user.password_hash):
             raise HTTPException(
                 status_code=401,
                 detail="Invalid credentials"
@@ -218,10 +286,10 @@ class AuthService:
         return user
     
     @staticmethod
-    def get_current_user(
-        db: Session,
+    async def get_current_user(
+        db: AsyncSession,
         token: str
-    ) -> User:
+    ) -> AuthenticatedUser:
         
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -239,12 +307,23 @@ class AuthService:
             if username is None:
                 raise credentials_exception
 
+            # serve the user from the cache while the entry is fresh
+            cached_user = user_cache.get(username)
+            if cached_user is not None:
+                return cached_user
+
             # check the db and if it is not there raise an exception
-            user = AuthService.get_user(username, db)
+            user = await AuthService.get_user(username, db)
             if user is None:
                 raise credentials_exception
             
-            return user
+            current_user = AuthenticatedUser(
+                id=user.id,
+                username=user.username,
+                email=user.email
+            )
+            user_cache.set(username, current_user)
+            return current_user
         
         except JWTError:
             raise credentials_exception
@@ -253,17 +332,28 @@ class AuthService:
 auth_service = AuthService()
     
 
-def get_current_user(
+async def get_current_user(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     token: str = Depends(oauth2_scheme)
-) -> User:
-    return AuthService.get_current_user(db, token)
+) -> AuthenticatedUser:
+    return await AuthService.get_current_user(db, token)
 
 
-def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
+async def get_optional_user(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    token: Optional[str] = Depends(optional_oauth2_scheme)
+) -> Optional[AuthenticatedUser]:
+    # None for an anonymous caller, a token that was sent must still be valid
+    if token is None:
+        return None
+    return await AuthService.get_current_user(db, token)
+
+
+async def get_current_active_user(
+    current_user: AuthenticatedUser = Depends(get_current_user)
+) -> AuthenticatedUser:
     
     if not current_user:
         raise HTTPException(
@@ -0,0 +1,179 @@
+import asyncio
+import json
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import case
+from fastapi import HTTPException, status
+from src.models import Story, User
+from src.schema import AutocompleteItem, AutocompleteResponse
+from src.database import async_session
+from src.logging import db_logger
+
+# channel used to tell every worker about names added to or removed from the index
+UPDATES_CHANNEL = "autocomplete:updates"
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class PrefixIndex:
+    """
+    Sorted array of (folded name, id) for prefix lookups
+
+    A lookup is a binary search to the first key at or after the prefix
+    followed by a short forward scan, and names are inserted or removed in
+    place so the index never has to be rebuilt.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[str, int]] = []
+        self._names: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, id: int, name: str) -> None:
+        self.remove(id)
+        insort(self._keys, (name.casefold(), id))
+        self._names[id] = name
+
+    def remove(self, id: int) -> None:
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        key = (name.casefold(), id)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def search(self, prefix: str, limit: int) -> List[AutocompleteItem]:
+        prefix = prefix.casefold()
+        items = []
+        position = bisect_left(self._keys, (prefix,))
+        while position < len(self._keys) and len(items) < limit:
+            key, id = self._keys[position]
+            if not key.startswith(prefix):
+                break
+            items.append(AutocompleteItem(id=id, text=self._names[id]))
+            position += 1
+        return items
+
+
+class AutocompleteService:
+    """
+    Type-ahead over story names and usernames
+
+    Lookups run against pg_trgm GIN indexes, prefix matches first and then
+    anything containing the term, ordered by similarity. With
+    AUTOCOMPLETE_MEMORY_INDEX on, each worker also keeps in-memory prefix
+    indexes loaded at startup and kept current through redis pub/sub, and
+    answers from them alone whenever they have enough prefix matches.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.stories = PrefixIndex()
+        self.users = PrefixIndex()
+
+    def _index(self, kind: str) -> PrefixIndex:
+        return self.stories if kind == 'story' else self.users
+
+    async def load(self) -> None:
+        async with async_session() as db:
+            stories = (await db.exec(select(Story.id, Story.name))).all()
+            users = (await db.exec(select(User.id, User.username))).all()
+
+        for id, name in stories:
+            self.stories.add(id, name)
+        for id, username in users:
+            self.users.add(id, username)
+        self.loaded = True
+        db_logger.info("Loaded autocomplete index with %s stories and %s users", len(stories), len(users))
+
+    def _apply(self, update: dict) -> None:
+        index = self._index(update['kind'])
+        if update['op'] == 'add':
+            index.add(update['id'], update['text'])
+        else:
+            index.remove(update['id'])
+
+    async def _publish(self, update: dict, redis: Optional[Redis]) -> None:
+        if not self.loaded:
+            return
+        # every worker, this one included, applies the update when it comes
+        # back on the channel, so updates land in the order they were sent
+        if redis is not None:
+            try:
+                await redis.publish(UPDATES_CHANNEL, json.dumps(update))
+                return
+            except RedisError as e:
+                db_logger.warning("Failed to broadcast autocomplete update: %s", e)
+        self._apply(update)
+
+    async def add(self, kind: str, id: int, text: str, redis: Optional[Redis] = None) -> None:
+        await self._publish({'op': 'add', 'kind': kind, 'id': id, 'text': text}, redis)
+
+    async def remove(self, kind: str, id: int, redis: Optional[Redis] = None) -> None:
+        await self._publish({'op': 'remove', 'kind': kind, 'id': id}, redis)
+
+    async def listen(self, redis: Redis) -> None:
+        # long running task started by the app lifespan
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(UPDATES_CHANNEL)
+        try:
+            while True:
+                try:
+                    message = await pubsub.get_message(timeout=1.0)
+                except RedisError as e:
+                    db_logger.warning("Autocomplete update listener error: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                if message is not None:
+                    self._apply(json.loads(message['data']))
+        finally:
+            await pubsub.aclose()
+
+    async def _search_db(self, id_column, column, term: str, limit: int, db: AsyncSession) -> List[AutocompleteItem]:
+        pattern = _escape_like(term)
+        is_prefix = column.ilike(f"{pattern}%")
+        rows = (await db.exec(
+            select(id_column, column)
+            .where(column.ilike(f"%{pattern}%"))
+            .order_by(
+                case((is_prefix, 0), else_=1),
+                func.similarity(column, term).desc(),
+                func.lower(column)
+            )
+            .limit(limit)
+        )).all()
+        return [AutocompleteItem(id=id, text=text) for id, text in rows]
+
+    async def _search(self, kind: str, id_column, column, term: str, limit: int, db: AsyncSession) -> List[AutocompleteItem]:
+        if self.loaded:
+            items = self._index(kind).search(term, limit)
+            if len(items) == limit:
+                return items
+        return await self._search_db(id_column, column, term, limit, db)
+
+    async def autocomplete(self, term: str, db: AsyncSession, limit: int = 10) -> AutocompleteResponse:
+        db_logger.debug("Autocompleting %r", term)
+        try:
+            return AutocompleteResponse(
+                stories=await self._search('story', Story.id, Story.name, term, limit, db),
+                users=await self._search('user', User.id, User.username, term, limit, db)
+            )
+
+        except Exception as e:
+            db_logger.error("Error autocompleting: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+
+autocomplete_service = AutocompleteService()
@@ -0,0 +1,473 @@
+from src.models import Chapter, Story
+from src.schema import (
+    ChapterCreate,
+    ChapterUpdate,
+    ChapterResponse,
+    PaginatedChapterResponse,
+    ChapterTOCEntry,
+    ChapterTOCResponse
+)
+from src.database import async_session, from_primary
+from src.settings import app_config
+from src.cache import Validators, chapter_validators
+from src.compression import CODEC_RAW, HEADER_SIZE, iter_decompressed, read_header
+from src.services.revisions import revision_service
+from src.services.search import search_service
+from src.background.story_stats import record_change
+from src.background.tasks import ChapterIndexJob, index_chapter
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import LargeBinary, delete, or_, type_coerce
+from fastapi import HTTPException, status
+from typing import AsyncIterator, Optional, Tuple
+from datetime import datetime
+import math
+from src.logging import db_logger
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+# the stored (compressed) bytes, bypassing the transparent decompression
+stored_content = type_coerce(Chapter.content, LargeBinary)
+
+# average silent reading speed, for the reading time estimate
+WORDS_PER_MINUTE = 238
+
+
+def text_stats(content: str) -> Tuple[int, int]:
+    # word count and reading time in minutes
+    word_count = len(content.split())
+    return word_count, math.ceil(word_count / WORDS_PER_MINUTE)
+
+
+def _visible_to(story_id: int, user_id: Optional[int]):
+    # published chapters, and the drafts too when the story is the user's own
+    if user_id is None:
+        return Chapter.is_published
+    author_id = select(Story.user_id).where(Story.id == story_id).scalar_subquery()
+    return or_(Chapter.is_published, author_id == user_id)
+
+
+def _to_chapter_response(chapter: Chapter) -> ChapterResponse:
+    return ChapterResponse(
+        id=chapter.id,
+        story_id=chapter.story_id,
+        is_published=chapter.is_published,
+        title=chapter.title,
+        content=chapter.content
+    )
+
+
+class ChapterService:
+
+    async def _check_story_owner(self, story_id: int, user_id: int, db: AsyncSession) -> None:
+        owner_id = (await db.exec(select(Story.user_id).where(Story.id == story_id))).first()
+
+        if owner_id is None:
+            db_logger.warning("No story found with ID: %s", story_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Story with id {story_id} not found"
+            )
+
+        if owner_id != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not authorized to edit this story"
+            )
+
+    async def _get_chapter(self, id: int, db: AsyncSession) -> Chapter:
+        chapter = await db.get(Chapter, id)
+
+        if not chapter:
+            db_logger.warning("No chapter found with ID: %s", id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chapter with id {id} not found"
+            )
+
+        return chapter
+
+    async def get_chapter(self, id: int, db: AsyncSession) -> ChapterResponse:
+        db_logger.info("Attempting to get chapter by ID: %s", id)
+        try:
+            chapter = await self._get_chapter(id, db)
+            return _to_chapter_response(chapter)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving chapter: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def get_chapter_validators(
+        self,
+        id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None,
+        user_id: Optional[int] = None
+    ) -> Validators:
+        """
+        The chapter's validators, for a caller allowed to read it
+
+        A draft is only there for its story's author, anyone else gets the
+        same 404 as for a chapter that does not exist. Every read of a
+        chapter goes through here first, so the check costs nothing beyond
+        the validators lookup.
+        """
+        validators = await chapter_validators.get(redis, id, from_primary(db, lambda db: self._load_chapter_validators(id, db)))
+        if validators.owner_id is not None and validators.owner_id != user_id:
+            db_logger.warning("Chapter %s is a draft, hidden from user %s", id, user_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chapter with id {id} not found"
+            )
+        return validators
+
+    async def _load_chapter_validators(self, id: int, db: AsyncSession) -> Validators:
+        # the timestamps alone, the content is never read
+        db_logger.debug("Looking up validators of chapter %s", id)
+        try:
+            row = (await db.exec(
+                select(Chapter.created_at, Chapter.updated_at, Chapter.is_published, Story.user_id)
+                .join(Story, Story.id == Chapter.story_id)
+                .where(Chapter.id == id)
+            )).first()
+
+            if not row:
+                db_logger.warning("No chapter found with ID: %s", id)
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Chapter with id {id} not found"
+                )
+
+            return Validators.of(
+                id,
+                row.updated_at or row.created_at,
+                owner_id=None if row.is_published else row.user_id
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving chapter validators: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def get_chapters(
+        self,
+        story_id: int,
+        db: AsyncSession,
+        page: int,
+        page_size: int = 10,
+        user_id: Optional[int] = None
+    ) -> PaginatedChapterResponse:
+        db_logger.info("Retrieving chapters page %s of story %s", page, story_id)
+        try:
+            visible = _visible_to(story_id, user_id)
+            total_chapters = (await db.exec(
+                select(func.count(Chapter.id)).where(Chapter.story_id == story_id).where(visible)
+            )).first()
+
+            statement = (
+                select(Chapter)
+                .where(Chapter.story_id == story_id)
+                .where(visible)
+                .order_by(Chapter.id)
+                .limit(page_size)
+                .offset((page - 1)*page_size)
+            )
+            chapters = (await db.exec(statement)).all()
+            db_logger.debug("Retrieved %s chapters", len(chapters))
+
+            return PaginatedChapterResponse(
+                chapters=[_to_chapter_response(chapter) for chapter in chapters],
+                total_chapters=total_chapters,
+                total_pages=(total_chapters + page_size - 1) // page_size,
+                page=page,
+                page_size=page_size
+            )
+
+        except Exception as e:
+            db_logger.error("Error retrieving chapters: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def get_table_of_contents(
+        self,
+        story_id: int,
+        db: AsyncSession,
+        published_only: bool = True,
+        user_id: Optional[int] = None
+    ) -> ChapterTOCResponse:
+        db_logger.info("Retrieving table of contents of story %s", story_id)
+        try:
+            # only columns held by ix_chapter_toc, the content is never read
+            statement = (
+                select(
+                    Chapter.id,
+                    Chapter.title,
+                    Chapter.is_published,
+                    Chapter.created_at,
+                    Chapter.updated_at,
+                    Chapter.word_count,
+                    Chapter.reading_time
+                )
+                .where(Chapter.story_id == story_id)
+                .order_by(Chapter.id)
+            )
+            # drafts are only ever listed to the author, whatever was asked for
+            statement = statement.where(Chapter.is_published if published_only else _visible_to(story_id, user_id))
+            chapters = (await db.exec(statement)).all()
+
+            if not chapters and (await db.exec(select(Story.id).where(Story.id == story_id))).first() is None:
+                db_logger.warning("No story found with ID: %s", story_id)
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Story with id {story_id} not found"
+                )
+
+            entries = [ChapterTOCEntry.model_validate(chapter, from_attributes=True) for chapter in chapters]
+            return ChapterTOCResponse(
+                story_id=story_id,
+                chapters=entries,
+                total_word_count=sum(entry.word_count for entry in entries),
+                total_reading_time=sum(entry.reading_time for entry in entries)
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving table of contents: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def create_chapter(
+        self,
+        chapter_data: ChapterCreate,
+        user_id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> ChapterResponse:
+        db_logger.info("Attempting to create chapter %s in story %s", chapter_data.title, chapter_data.story_id)
+        try:
+            await self._check_story_owner(chapter_data.story_id, user_id, db)
+
+            existing_id = (await db.exec(
+                select(Chapter.id)
+                .where(Chapter.story_id == chapter_data.story_id)
+                .where(Chapter.title == chapter_data.title)
+            )).first()
+
+            if existing_id is not None:
+                db_logger.warning("Chapter already exists with title: %s", chapter_data.title)
+                raise HTTPException(
+                    status_code=400,
+                    detail="A chapter with that title already exists in this story"
+                )
+
+            word_count, reading_time = text_stats(chapter_data.content)
+            chapter = Chapter(
+                story_id=chapter_data.story_id,
+                title=chapter_data.title,
+                content=chapter_data.content,
+                word_count=word_count,
+                reading_time=reading_time
+            )
+            db.add(chapter)
+            await db.flush()
+            await revision_service.record(chapter.id, None, chapter.content, db)
+            await db.commit()
+            await record_change(redis, chapter.story_id, chapters=1, at=chapter.created_at)
+
+            db_logger.info("Successfully created chapter with ID: %s", chapter.id)
+            return _to_chapter_response(chapter)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error creating chapter: %s", e, exc_info=True)
+            await db.rollback()
+            db_logger.info("Database transaction rolled back")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def update_chapter(
+        self,
+        chapter_data: ChapterUpdate,
+        user_id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> ChapterResponse:
+        db_logger.info("Attempting to update chapter with ID: %s", chapter_data.id)
+        try:
+            chapter = await self._get_chapter(chapter_data.id, db)
+            await self._check_story_owner(chapter.story_id, user_id, db)
+
+            previous_content = chapter.content
+            previous_document = (chapter.title, chapter.is_published)
+            previous_words = chapter.word_count if chapter.is_published else 0
+            changes = chapter_data.model_dump(exclude_unset=True, exclude={'id', 'updated_at'})
+            for field, value in changes.items():
+                if value is not None:
+                    setattr(chapter, field, value)
+            chapter.updated_at = datetime.utcnow()
+
+            if chapter.content != previous_content:
+                chapter.word_count, chapter.reading_time = text_stats(chapter.content)
+                await revision_service.record(chapter.id, previous_content, chapter.content, db)
+            reindex = chapter.content != previous_content or (chapter.title, chapter.is_published) != previous_document
+            if reindex and redis is None:
+                await search_service.index_chapter(chapter, db)
+
+            db.add(chapter)
+            await db.commit()
+            await chapter_validators.forget(redis, chapter.id)
+
+            if reindex and redis is not None:
+                # building the search document is left to a worker so the write returns right away
+                try:
+                    await index_chapter.enqueue(redis, ChapterIndexJob(chapter_id=chapter.id), owner_id=user_id)
+                except RedisError as e:
+                    db_logger.warning("Failed to queue search indexing of chapter %s, indexing inline: %s", chapter.id, e)
+                    await index_chapter(ChapterIndexJob(chapter_id=chapter.id))
+
+            await record_change(
+                redis,
+                chapter.story_id,
+                published=int(chapter.is_published) - int(previous_document[1]),
+                words=(chapter.word_count if chapter.is_published else 0) - previous_words,
+                at=chapter.updated_at
+            )
+
+            db_logger.info("Successfully updated chapter %s", chapter.id)
+            return _to_chapter_response(chapter)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error updating chapter: %s", e, exc_info=True)
+            await db.rollback()
+            db_logger.info("Database transaction rolled back")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def delete_chapter(
+        self,
+        id: int,
+        user_id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> dict[str, str]:
+        db_logger.info("Attempting to delete chapter with ID: %s", id)
+        try:
+            chapter = await self._get_chapter(id, db)
+            await self._check_story_owner(chapter.story_id, user_id, db)
+
+            await db.exec(delete(Chapter).where(Chapter.id == id))
+            await db.commit()
+            await chapter_validators.forget(redis, id)
+
+            await record_change(
+                redis,
+                chapter.story_id,
+                chapters=-1,
+                published=-int(chapter.is_published),
+                words=-chapter.word_count if chapter.is_published else 0
+            )
+
+            db_logger.info("Successfully deleted chapter %s", id)
+            return {"message": "chapter successfully deleted"}
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error deleting chapter: %s", e, exc_info=True)
+            await db.rollback()
+            db_logger.info("Database transaction rolled back")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def get_content_header(self, id: int, db: AsyncSession) -> Tuple[int, int]:
+        # codec and size in bytes, read from the stored header alone
+        header = (await db.exec(
+            select(func.substr(stored_content, 1, HEADER_SIZE)).where(Chapter.id == id)
+        )).first()
+
+        if header is None:
+            db_logger.warning("No chapter found with ID: %s", id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chapter with id {id} not found"
+            )
+
+        return read_header(bytes(header))
+
+    async def _stored_chunks(
+        self,
+        id: int,
+        db: AsyncSession,
+        start: int,
+        end: Optional[int],
+        chunk_size: int
+    ) -> AsyncIterator[bytes]:
+        # slices of the stored value cut out by the database, up to `end` or the end
+        position = start
+        while end is None or position <= end:
+            length = chunk_size if end is None else min(chunk_size, end - position + 1)
+            chunk = (await db.exec(
+                select(func.substr(stored_content, position + 1, length)).where(Chapter.id == id)
+            )).first()
+            if not chunk:
+                return
+            yield bytes(chunk)
+            position += length
+
+    async def stream_content(
+        self,
+        id: int,
+        codec: int,
+        start: int,
+        end: int,
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Yield bytes `start` to `end` (inclusive) of a chapter's content
+
+        The stored value is read a chunk at a time by the database, and
+        compressed content is decompressed as it streams, so memory stays flat
+        whatever the size of the chapter. The generator runs after the
+        request's session has been closed, so it opens its own.
+        """
+        chunk_size = chunk_size or app_config.CHAPTER_STREAM_CHUNK_SIZE
+        async with async_session() as db:
+            if codec == CODEC_RAW:
+                # uncompressed bytes map straight onto the text, seek to the range
+                chunks = self._stored_chunks(id, db, HEADER_SIZE + start, HEADER_SIZE + end, chunk_size)
+            else:
+                chunks = iter_decompressed(
+                    codec,
+                    self._stored_chunks(id, db, HEADER_SIZE, None, chunk_size),
+                    start,
+                    end
+                )
+            async for chunk in chunks:
+                yield chunk
+
+
+chapter_service = ChapterService()
@@ -0,0 +1,171 @@
+import re
+import zipfile
+from datetime import datetime
+from html import escape
+from typing import AsyncIterator, List, Literal, Tuple
+from uuid import uuid4
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import select
+from src.models import Chapter
+from src.schema import StoryResponse
+from src.logging import db_logger
+
+ExportFormat = Literal['epub', 'zip']
+
+# chapters fetched from the server-side cursor per round trip
+EXPORT_BATCH_SIZE = 20
+
+MEDIA_TYPES = {'epub': 'application/epub+zip', 'zip': 'application/zip'}
+
+CONTAINER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+    '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+    '</container>\n'
+)
+
+
+class _Sink:
+    """Write-only file for ZipFile, whose output is taken away after every entry"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def export_filename(name: str, format: ExportFormat) -> str:
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-').lower() or 'story'
+    return f"{slug}.{format}"
+
+
+def _chapter_xhtml(title: str, content: str) -> str:
+    paragraphs = ''.join(
+        f"<p>{escape(paragraph.strip())}</p>\n"
+        for paragraph in re.split(r'\n\s*\n', content)
+        if paragraph.strip()
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml">'
+        f'<head><title>{escape(title)}</title></head>\n'
+        f'<body><h1>{escape(title)}</h1>\n{paragraphs}</body></html>\n'
+    )
+
+
+def _package(story: StoryResponse, titles: List[str]) -> str:
+    manifest = ''.join(
+        f'<item id="c{n}" href="chapter-{n}.xhtml" media-type="application/xhtml+xml"/>'
+        for n in range(1, len(titles) + 1)
+    )
+    spine = ''.join(f'<itemref idref="c{n}"/>' for n in range(1, len(titles) + 1))
+    modified = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:identifier id="id">urn:uuid:{uuid4()}</dc:identifier>'
+        f'<dc:title>{escape(story.name)}</dc:title>'
+        f'<dc:creator>{escape(story.author.username)}</dc:creator>'
+        f'<dc:description>{escape(story.blurb)}</dc:description>'
+        '<dc:language>en</dc:language>'
+        f'<meta property="dcterms:modified">{modified}</meta>'
+        '</metadata>'
+        f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{manifest}</manifest>'
+        f'<spine>{spine}</spine>'
+        '</package>\n'
+    )
+
+
+def _nav(story: StoryResponse, titles: List[str]) -> str:
+    entries = ''.join(
+        f'<li><a href="chapter-{n}.xhtml">{escape(title)}</a></li>'
+        for n, title in enumerate(titles, start=1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+        f'<head><title>{escape(story.name)}</title></head>'
+        f'<body><nav epub:type="toc"><ol>{entries}</ol></nav></body></html>\n'
+    )
+
+
+class StoryExportService:
+
+    async def _chapters(
+        self,
+        story_id: int,
+        published_only: bool,
+        session_factory: async_sessionmaker
+    ) -> AsyncIterator[Tuple[str, str]]:
+        # a server-side cursor, so only one batch of chapters is in memory at a time
+        statement = (
+            select(Chapter.title, Chapter.content)
+            .where(Chapter.story_id == story_id)
+            .order_by(Chapter.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        if published_only:
+            statement = statement.where(Chapter.is_published)
+
+        async with session_factory() as db:
+            result = await db.stream(statement)
+            async for title, content in result:
+                yield title, content
+
+    async def export(
+        self,
+        story: StoryResponse,
+        format: ExportFormat,
+        published_only: bool,
+        session_factory: async_sessionmaker
+    ) -> AsyncIterator[bytes]:
+        """
+        Yield a story as an EPUB or a zip of Markdown chapters, as it is built
+
+        Each chapter is compressed into the archive and its bytes handed on
+        before the next is read, so memory stays flat however long the story
+        is and the client starts receiving right away. The zip holds the
+        same "# Title" Markdown files the importer reads. The generator runs
+        after the request's session has been closed, so it opens its own
+        from `session_factory`, the request's, which keeps a caller that has
+        just written on the primary.
+        """
+        db_logger.info("Exporting story %s as %s", story.id, format)
+        sink = _Sink()
+        archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+
+        if format == 'epub':
+            # the mimetype comes first and uncompressed, so readers can sniff it
+            archive.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            archive.writestr('META-INF/container.xml', CONTAINER)
+            yield sink.drain()
+
+        titles = []
+        async for title, content in self._chapters(story.id, published_only, session_factory):
+            titles.append(title)
+            if format == 'epub':
+                archive.writestr(f'OEBPS/chapter-{len(titles)}.xhtml', _chapter_xhtml(title, content))
+            else:
+                archive.writestr(f'chapter-{len(titles)}.md', f"# {title}\n\n{content}\n")
+            yield sink.drain()
+
+        if format == 'epub':
+            archive.writestr('OEBPS/content.opf', _package(story, titles))
+            archive.writestr('OEBPS/nav.xhtml', _nav(story, titles))
+        archive.close()
+        yield sink.drain()
+        db_logger.info("Exported %s chapters of story %s", len(titles), story.id)
+
+
+story_export_service = StoryExportService()
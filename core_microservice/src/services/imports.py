@@ -0,0 +1,395 @@
+import asyncio
+import os
+import posixpath
+import re
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import BinaryIO, Awaitable, Callable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+from uuid import uuid4
+from xml.etree import ElementTree
+from fastapi import HTTPException, UploadFile, status
+from redis.asyncio import Redis
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import LargeBinary, bindparam, insert
+from src.models import Chapter, Story
+from src.settings import app_config
+from src.cache import story_cache
+from src.compression import compress_text
+from src.services.autocomplete import autocomplete_service
+from src.services.chapters import text_stats
+from src.background.story_stats import record_change
+from src.background.tasks import StoryImportJob, import_story
+from src.logging import db_logger
+
+# files read as chapters from a plain zip, in natural order of their names
+CHAPTER_EXTENSIONS = ('.md', '.markdown', '.txt', '.html', '.htm', '.xhtml')
+HTML_EXTENSIONS = ('.html', '.htm', '.xhtml')
+# no single chapter may inflate past this, whatever its compressed size
+MAX_CHAPTER_BYTES = 10 * 1024 * 1024
+# nor the whole story past this, or be split into more chapters than this
+MAX_STORY_BYTES = 200 * 1024 * 1024
+MAX_CHAPTERS = 5000
+# chapters sent to the database per executemany, a batch is sent early once
+# its text passes IMPORT_BATCH_BYTES
+IMPORT_BATCH_SIZE = 200
+IMPORT_BATCH_BYTES = 16 * 1024 * 1024
+# uploads are copied to disk this much at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+DC_NS = '{http://purl.org/dc/elements/1.1/}'
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    # block elements end a paragraph, everything inline runs together
+    BLOCKS = {'p', 'div', 'br', 'li', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'tr', 'section'}
+    SKIPPED = {'script', 'style', 'head'}
+
+    def __init__(self):
+        super().__init__()
+        self.paragraphs: List[str] = []
+        self.title: Optional[str] = None
+        self._current: List[str] = []
+        self._skipping = 0
+        self._heading: Optional[List[str]] = None
+
+    def _end_paragraph(self) -> None:
+        text = ' '.join(''.join(self._current).split())
+        if text:
+            self.paragraphs.append(text)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self._end_paragraph()
+        if tag in ('h1', 'h2') and self.title is None:
+            self._heading = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in self.BLOCKS:
+            if tag in ('h1', 'h2') and self._heading is not None:
+                self.title = ' '.join(''.join(self._heading).split()) or None
+                self._heading = None
+                # the heading becomes the chapter title rather than its first line
+                self._current = []
+                return
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if self._skipping:
+            return
+        if self._heading is not None:
+            self._heading.append(data)
+        else:
+            self._current.append(data)
+
+    def text(self) -> str:
+        self._end_paragraph()
+        return '\n\n'.join(self.paragraphs)
+
+
+def html_chapter(markup: str) -> Tuple[Optional[str], str]:
+    extractor = _TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    return extractor.title, extractor.text()
+
+
+def markdown_chapter(text: str) -> Tuple[Optional[str], str]:
+    # a leading "# Title" line names the chapter
+    first, _, rest = text.lstrip().partition('\n')
+    if first.startswith('#'):
+        return first.lstrip('#').strip() or None, rest.strip()
+    return None, text.strip()
+
+
+def upload_dir() -> str:
+    # where uploads wait for their import job, STORY_IMPORT_DIR must be shared when workers run on other hosts
+    directory = app_config.STORY_IMPORT_DIR or os.path.join(tempfile.gettempdir(), 'story-imports')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def remove_upload(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_uploads() -> None:
+    # uploads whose job never ran, past STORY_IMPORT_UPLOAD_TTL
+    directory = upload_dir()
+    cutoff = time.time() - app_config.STORY_IMPORT_UPLOAD_TTL
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.upload') and entry.stat().st_mtime < cutoff:
+            remove_upload(entry.path)
+
+
+def _save_upload(source: BinaryIO, path: str) -> int:
+    # copied in chunks, so an oversized upload is refused without being held in full
+    size = 0
+    with open(path, 'xb') as target:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > app_config.STORY_IMPORT_MAX_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Imports are limited to {app_config.STORY_IMPORT_MAX_BYTES} bytes"
+                )
+            target.write(chunk)
+    return size
+
+
+def _natural_key(name: str) -> list:
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+class StoryArchive:
+    """
+    A story uploaded as an EPUB or a zip of Markdown/HTML files
+
+    Only the archive's directory and, for an EPUB, its package document are
+    read up front. Chapters are inflated and parsed one at a time as
+    chapters() is iterated, in spine order for an EPUB and in natural file
+    name order (chapter-2 before chapter-10) for a plain zip. The sizes the
+    zip directory declares are checked before anything is inflated, and
+    zipfile refuses to inflate an entry past its declared size.
+    """
+
+    def __init__(self, file: BinaryIO):
+        try:
+            self.zip = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise ArchiveError("The upload is not a zip or EPUB archive")
+        self.title: Optional[str] = None
+        names = set(self.zip.namelist())
+        if 'META-INF/container.xml' in names:
+            self.entries = self._spine()
+        else:
+            self.entries = sorted(
+                (
+                    name for name in names
+                    if name.lower().endswith(CHAPTER_EXTENSIONS)
+                    and not name.startswith('__MACOSX/')
+                    and not posixpath.basename(name).startswith('.')
+                ),
+                key=_natural_key
+            )
+        if not self.entries:
+            raise ArchiveError("The archive has no chapters")
+        if len(self.entries) > MAX_CHAPTERS:
+            raise ArchiveError(f"The archive has more than {MAX_CHAPTERS} chapters")
+        size = 0
+        for name in self.entries:
+            try:
+                size += self.zip.getinfo(name).file_size
+            except KeyError:
+                raise ArchiveError(f"The archive lists {name} but does not contain it")
+        if size > MAX_STORY_BYTES:
+            raise ArchiveError(f"The archive inflates to more than {MAX_STORY_BYTES} bytes")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _xml(self, name: str) -> ElementTree.Element:
+        try:
+            return ElementTree.fromstring(self.zip.read(name))
+        except (KeyError, ElementTree.ParseError):
+            raise ArchiveError(f"The EPUB's {name} is missing or malformed")
+
+    def _spine(self) -> List[str]:
+        rootfile = self._xml('META-INF/container.xml').find(f'.//{CONTAINER_NS}rootfile')
+        if rootfile is None:
+            raise ArchiveError("The EPUB has no package document")
+        package_path = rootfile.get('full-path', '')
+        package = self._xml(package_path)
+        base = posixpath.dirname(package_path)
+
+        title = package.find(f'{OPF_NS}metadata/{DC_NS}title')
+        if title is not None and title.text:
+            self.title = title.text.strip()
+
+        documents = {
+            item.get('id'): posixpath.normpath(posixpath.join(base, unquote(item.get('href', ''))))
+            for item in package.iterfind(f'{OPF_NS}manifest/{OPF_NS}item')
+            if item.get('media-type') in ('application/xhtml+xml', 'text/html')
+            and 'nav' not in (item.get('properties') or '').split()
+        }
+        return [
+            documents[itemref.get('idref')]
+            for itemref in package.iterfind(f'{OPF_NS}spine/{OPF_NS}itemref')
+            if itemref.get('idref') in documents and itemref.get('linear') != 'no'
+        ]
+
+    def chapters(self) -> Iterator[Tuple[str, str]]:
+        titles = set()
+        for name in self.entries:
+            info = self.zip.getinfo(name)
+            if info.file_size > MAX_CHAPTER_BYTES:
+                raise ArchiveError(f"{name} is larger than {MAX_CHAPTER_BYTES} bytes")
+
+            with self.zip.open(info) as file:
+                text = file.read().decode('utf-8', errors='replace')
+            if name.lower().endswith(HTML_EXTENSIONS):
+                title, content = html_chapter(text)
+            else:
+                title, content = markdown_chapter(text)
+            # title pages and covers without any text are not chapters
+            if not content:
+                continue
+
+            title = title or posixpath.splitext(posixpath.basename(name))[0]
+            # titles are unique within a story
+            unique, copy = title, 2
+            while unique in titles:
+                unique, copy = f"{title} ({copy})", copy + 1
+            titles.add(unique)
+            yield unique, content
+
+
+def _chapter_rows(chapters: Iterator[Tuple[str, str]]) -> List[dict]:
+    # the next batch of the archive's chapters, ready to insert. Inflating,
+    # parsing, counting and compressing them is all CPU bound, so this runs
+    # in an executor and a large import does not stall the event loop
+    batch = []
+    batch_bytes = 0
+    for title, content in chapters:
+        word_count, reading_time = text_stats(content)
+        batch.append({
+            'title': title,
+            'content': compress_text(content),
+            'word_count': word_count,
+            'reading_time': reading_time
+        })
+        batch_bytes += len(content)
+        if len(batch) == IMPORT_BATCH_SIZE or batch_bytes >= IMPORT_BATCH_BYTES:
+            break
+    return batch
+
+
+class StoryImportService:
+
+    async def enqueue(
+        self,
+        file: UploadFile,
+        user_id: int,
+        name: Optional[str],
+        blurb: str,
+        db: AsyncSession,
+        redis: Redis
+    ) -> str:
+        """
+        Park an upload on disk and queue its import, returning the job id
+
+        The upload is copied to STORY_IMPORT_DIR in chunks off the event
+        loop, so neither this process nor redis ever holds it whole, and the
+        job only carries its path. An oversized upload is refused as soon as
+        it passes STORY_IMPORT_MAX_BYTES.
+        """
+        db_logger.info("Queueing an import of %s for user %s", file.filename, user_id)
+        if name is not None and (await db.exec(select(Story.id).where(Story.name == name))).first() is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="A story with that name already exists"
+            )
+
+        upload_path = os.path.join(upload_dir(), f"{uuid4().hex}.upload")
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, _save_upload, file.file, upload_path)
+            return await import_story.enqueue(
+                redis,
+                StoryImportJob(upload_path=upload_path, user_id=user_id, name=name, blurb=blurb),
+                owner_id=user_id
+            )
+        except BaseException:
+            remove_upload(upload_path)
+            raise
+
+    async def import_story(
+        self,
+        archive: StoryArchive,
+        user_id: int,
+        name: Optional[str],
+        blurb: str,
+        db: AsyncSession,
+        redis: Optional[Redis] = None,
+        progress: Optional[Callable[[int, Optional[int]], Awaitable[None]]] = None
+    ) -> int:
+        """
+        Create the story and every chapter of the archive in one transaction
+
+        Chapters go to the database IMPORT_BATCH_SIZE at a time, or fewer
+        once a batch holds IMPORT_BATCH_BYTES of text, as a single
+        executemany, which SQLAlchemy sends to postgres as multi-row INSERTs,
+        so only one batch of parsed chapters is held at once. Each batch is
+        read from the archive and compressed in an executor. Chapters come in
+        unpublished and without a revision, their first edit records the
+        imported text as revision 1.
+        """
+        name = name or archive.title
+        if not name:
+            raise ArchiveError("The story needs a name, the archive does not give one")
+        db_logger.info("Importing %s chapters into story %s for user %s", len(archive), name, user_id)
+
+        try:
+            if (await db.exec(select(Story.id).where(Story.name == name))).first() is not None:
+                raise ArchiveError("A story with that name already exists")
+
+            story = Story(user_id=user_id, name=name, blurb=blurb)
+            db.add(story)
+            await db.flush()
+            story_id = story.id
+
+            now = datetime.utcnow()
+            # content arrives already compressed, bound as bytes so it is not compressed again
+            statement = insert(Chapter).values(
+                story_id=story_id,
+                created_at=now,
+                is_published=False,
+                content=bindparam('content', type_=LargeBinary)
+            )
+            loop = asyncio.get_running_loop()
+            chapters = archive.chapters()
+            imported = 0
+            while batch := await loop.run_in_executor(None, _chapter_rows, chapters):
+                await db.exec(statement, params=batch)
+                imported += len(batch)
+                if progress is not None:
+                    await progress(imported, None)
+
+            await db.commit()
+
+        except Exception:
+            await db.rollback()
+            db_logger.info("Database transaction rolled back")
+            raise
+
+        if progress is not None:
+            # entries without text were skipped, so the total is what was imported
+            await progress(imported, imported)
+        if redis is not None:
+            await story_cache.invalidate(redis)
+        await autocomplete_service.add('story', story_id, name, redis)
+        await record_change(redis, story_id, chapters=imported, at=now)
+
+        db_logger.info("Imported %s chapters into story %s", imported, story_id)
+        return story_id
+
+
+story_import_service = StoryImportService()
@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from src.settings import app_config
+from src.logging import auth_logger
+
+# each worker process builds its own context on import
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto'
+)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated, size limited process pool
+
+    bcrypt is CPU bound and holds the GIL, so running it in the request
+    worker (or its threadpool) starves every other request during login
+    spikes. Work is queued to the pool up to `max_pending` jobs, past that
+    callers are turned away with a 503 straight away instead of piling up.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            auth_logger.info("Started password hashing pool with %s workers", self.max_workers)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, fn: Callable, *args):
+        if self.pending >= self.max_pending:
+            auth_logger.warning("Password hashing queue is full (%s pending)", self.pending)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The server is busy, please try again shortly",
+                headers={'Retry-After': '1'}
+            )
+
+        # started lazily when the app lifespan did not start it
+        self.start()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(_verify, plain_password, hashed_password)
+
+
+password_hasher = PasswordHasher(
+    max_workers=app_config.PASSWORD_HASH_WORKERS,
+    max_pending=app_config.PASSWORD_HASH_MAX_PENDING
+)
@@ -0,0 +1,315 @@
+import json
+from difflib import SequenceMatcher
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import delete, update
+from fastapi import HTTPException, status
+from src.models import Chapter, ChapterRevision, Story
+from src.schema import ChapterRevisionSummary, ChapterRevisionResponse
+from src.settings import app_config
+from src.logging import db_logger
+
+
+def make_delta(base: str, text: str) -> str:
+    """
+    Line based edit script turning `base` into `text`
+
+    The script is a JSON list in which a [start, end] pair copies those lines
+    of the base and a string is inserted as is, so unchanged paragraphs cost a
+    few bytes whatever their length.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+
+    script = []
+    # no autojunk: past 200 lines the blank lines between paragraphs count as
+    # popular junk, and the paragraphs around them stop matching
+    matcher = SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            script.append([i1, i2])
+        elif j2 > j1:
+            script.append(''.join(lines[j1:j2]))
+    return json.dumps(script, separators=(',', ':'))
+
+
+def apply_delta(base: str, delta: str) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(
+        ''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op
+        for op in json.loads(delta)
+    )
+
+
+class RevisionService:
+    """
+    Chapter history as periodic full snapshots with deltas in between
+
+    Every revision after a snapshot stores only a diff against the revision
+    before it, and a new snapshot is taken every CHAPTER_REVISION_SNAPSHOT_INTERVAL
+    revisions, so rebuilding any revision applies fewer diffs than that.
+    """
+
+    async def _check_author(self, chapter_id: int, user_id: Optional[int], db: AsyncSession) -> None:
+        # history holds text from before a chapter was published, so it is the author's alone
+        author_id = (await db.exec(
+            select(Story.user_id)
+            .join(Chapter, Chapter.story_id == Story.id)
+            .where(Chapter.id == chapter_id)
+        )).first()
+
+        if author_id is None or author_id != user_id:
+            db_logger.warning("Revisions of chapter %s hidden from user %s", chapter_id, user_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Chapter with id {chapter_id} not found"
+            )
+
+    async def _latest(self, chapter_id: int, db: AsyncSession) -> Optional[ChapterRevision]:
+        return (await db.exec(
+            select(ChapterRevision)
+            .where(ChapterRevision.chapter_id == chapter_id)
+            .order_by(ChapterRevision.revision.desc())
+            .limit(1)
+        )).first()
+
+    async def record(
+        self,
+        chapter_id: int,
+        previous: Optional[str],
+        content: str,
+        db: AsyncSession
+    ) -> ChapterRevision:
+        """
+        Add a revision for the chapter's new content, the caller commits
+
+        `previous` is the content being replaced. Chapters written before
+        history was kept get it recorded as their first revision, so their
+        first edit can still be undone.
+        """
+        latest = await self._latest(chapter_id, db)
+
+        if latest is None and previous is not None:
+            latest = ChapterRevision(chapter_id=chapter_id, revision=1, is_snapshot=True, data=previous)
+            db.add(latest)
+
+        if latest is None:
+            revision = ChapterRevision(chapter_id=chapter_id, revision=1, is_snapshot=True, data=content)
+        else:
+            chain_length = latest.chain_length + 1
+            delta = make_delta(previous, content) if previous is not None else None
+            # a delta as big as the text buys nothing over a snapshot
+            if (
+                delta is None
+                or chain_length >= app_config.CHAPTER_REVISION_SNAPSHOT_INTERVAL
+                or len(delta) >= len(content)
+            ):
+                revision = ChapterRevision(
+                    chapter_id=chapter_id,
+                    revision=latest.revision + 1,
+                    is_snapshot=True,
+                    data=content
+                )
+            else:
+                revision = ChapterRevision(
+                    chapter_id=chapter_id,
+                    revision=latest.revision + 1,
+                    is_snapshot=False,
+                    chain_length=chain_length,
+                    data=delta
+                )
+
+        db.add(revision)
+        return revision
+
+    async def _rebuild(self, chapter_id: int, revision: int, db: AsyncSession) -> Optional[str]:
+        # the nearest snapshot at or before the revision, then every delta after it
+        snapshot = (
+            select(func.max(ChapterRevision.revision))
+            .where(ChapterRevision.chapter_id == chapter_id)
+            .where(ChapterRevision.is_snapshot)
+            .where(ChapterRevision.revision <= revision)
+            .scalar_subquery()
+        )
+        chain = (await db.exec(
+            select(ChapterRevision.revision, ChapterRevision.is_snapshot, ChapterRevision.data)
+            .where(ChapterRevision.chapter_id == chapter_id)
+            .where(ChapterRevision.revision >= snapshot)
+            .where(ChapterRevision.revision <= revision)
+            .order_by(ChapterRevision.revision)
+        )).all()
+
+        if not chain or chain[-1].revision != revision:
+            return None
+
+        text = chain[0].data
+        for link in chain[1:]:
+            text = apply_delta(text, link.data)
+        return text
+
+    async def get_revisions(
+        self,
+        chapter_id: int,
+        db: AsyncSession,
+        user_id: Optional[int] = None
+    ) -> List[ChapterRevisionSummary]:
+        db_logger.info("Retrieving revisions of chapter %s", chapter_id)
+        try:
+            await self._check_author(chapter_id, user_id, db)
+            revisions = (await db.exec(
+                select(
+                    ChapterRevision.revision,
+                    ChapterRevision.is_snapshot,
+                    ChapterRevision.created_at
+                )
+                .where(ChapterRevision.chapter_id == chapter_id)
+                .order_by(ChapterRevision.revision.desc())
+            )).all()
+
+            return [
+                ChapterRevisionSummary(
+                    revision=revision.revision,
+                    is_snapshot=revision.is_snapshot,
+                    created_at=revision.created_at
+                )
+                for revision in revisions
+            ]
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving revisions: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def get_revision(
+        self,
+        chapter_id: int,
+        revision: int,
+        db: AsyncSession,
+        user_id: Optional[int] = None
+    ) -> ChapterRevisionResponse:
+        db_logger.info("Rebuilding revision %s of chapter %s", revision, chapter_id)
+        try:
+            await self._check_author(chapter_id, user_id, db)
+            created_at = (await db.exec(
+                select(ChapterRevision.created_at)
+                .where(ChapterRevision.chapter_id == chapter_id)
+                .where(ChapterRevision.revision == revision)
+            )).first()
+            content = await self._rebuild(chapter_id, revision, db) if created_at else None
+
+            if content is None:
+                db_logger.warning("No revision %s found for chapter %s", revision, chapter_id)
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Revision {revision} of chapter {chapter_id} not found"
+                )
+
+            return ChapterRevisionResponse(
+                chapter_id=chapter_id,
+                revision=revision,
+                created_at=created_at,
+                content=content
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error rebuilding revision: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def compact_chapter(self, chapter_id: int, cutoff: datetime, db: AsyncSession) -> int:
+        """
+        Drop the deltas of a chapter older than `cutoff`, the caller commits
+
+        Old snapshots are kept as coarse history, as is the latest revision.
+        The first delta left after the dropped ones has lost the revision it
+        was diffed against, so it is rewritten as a snapshot and the chain
+        lengths after it are shortened to match.
+        """
+        revisions = (await db.exec(
+            select(
+                ChapterRevision.revision,
+                ChapterRevision.is_snapshot,
+                ChapterRevision.chain_length,
+                ChapterRevision.created_at
+            )
+            .where(ChapterRevision.chapter_id == chapter_id)
+            .order_by(ChapterRevision.revision)
+        )).all()
+        stale = {
+            revision.revision for revision in revisions[:-1]
+            if not revision.is_snapshot and revision.created_at < cutoff
+        }
+        if not stale:
+            return 0
+
+        # every chain broken by a dropped delta restarts at the next kept revision
+        orphans = [
+            revision for previous, revision in zip(revisions, revisions[1:])
+            if previous.revision in stale and revision.revision not in stale and not revision.is_snapshot
+        ]
+        orphan_texts = [await self._rebuild(chapter_id, orphan.revision, db) for orphan in orphans]
+
+        await db.exec(
+            delete(ChapterRevision)
+            .where(ChapterRevision.chapter_id == chapter_id)
+            .where(ChapterRevision.revision.in_(stale))
+        )
+        for orphan, text in zip(orphans, orphan_texts):
+            # the deltas chained after it are now that much closer to a snapshot
+            next_snapshot = min(
+                (revision.revision for revision in revisions
+                 if revision.is_snapshot and revision.revision > orphan.revision),
+                default=None
+            )
+            chain = (
+                update(ChapterRevision)
+                .where(ChapterRevision.chapter_id == chapter_id)
+                .where(ChapterRevision.revision > orphan.revision)
+                .values(chain_length=ChapterRevision.chain_length - orphan.chain_length)
+            )
+            if next_snapshot is not None:
+                chain = chain.where(ChapterRevision.revision < next_snapshot)
+            await db.exec(chain)
+
+            await db.exec(
+                update(ChapterRevision)
+                .where(ChapterRevision.chapter_id == chapter_id)
+                .where(ChapterRevision.revision == orphan.revision)
+                .values(is_snapshot=True, chain_length=0, data=text)
+            )
+
+        return len(stale)
+
+    async def compact(self, db: AsyncSession) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=app_config.CHAPTER_REVISION_RETENTION_DAYS)
+        chapter_ids = (await db.exec(
+            select(ChapterRevision.chapter_id)
+            .where(ChapterRevision.created_at < cutoff)
+            .where(~ChapterRevision.is_snapshot)
+            .distinct()
+        )).all()
+
+        dropped = 0
+        for chapter_id in chapter_ids:
+            try:
+                dropped += await self.compact_chapter(chapter_id, cutoff, db)
+                await db.commit()
+            except Exception as e:
+                db_logger.error("Error compacting revisions of chapter %s: %s", chapter_id, e, exc_info=True)
+                await db.rollback()
+
+        db_logger.info("Compacted %s revisions across %s chapters", dropped, len(chapter_ids))
+        return dropped
+
+
+revision_service = RevisionService()
@@ -0,0 +1,181 @@
+from src.models import Chapter, Story, SEARCH_CONFIG
+from src.schema import SearchResult, SearchResponse
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import and_, bindparam, cast, literal, literal_column, or_, text, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import ARRAY, REGCONFIG
+from sqlalchemy.engine import Row
+from sqlalchemy.types import Text
+from fastapi import HTTPException, status
+from typing import Optional
+import base64
+import binascii
+import json
+from src.logging import db_logger
+
+story_vector = Story.__table__.c.search_vector
+chapter_vector = Chapter.__table__.c.search_vector
+
+# <mark> around matches, and a couple of short fragments rather than the whole text
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+# headlines for a whole page of documents in one round trip, in the order given
+HEADLINES = text(
+    "SELECT ts_headline(CAST(:config AS regconfig), doc, "
+    "websearch_to_tsquery(CAST(:config AS regconfig), :query), :options) "
+    "FROM unnest(:docs) WITH ORDINALITY AS page(doc, position) ORDER BY position"
+).bindparams(bindparam('docs', type_=ARRAY(Text)))
+
+
+def _config():
+    return cast(SEARCH_CONFIG, REGCONFIG)
+
+
+def chapter_search_document(title: str, content: str):
+    # the same weighting as the story document: titles above body text
+    return func.setweight(func.to_tsvector(_config(), title), literal_column("'A'")).op('||')(
+        func.setweight(func.to_tsvector(_config(), content), literal_column("'B'"))
+    )
+
+
+def _encode_cursor(result: Row) -> str:
+    payload = {'r': result.rank, 'k': result.kind, 'id': result.id}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        float(payload['r'])
+        int(payload['id'])
+        if payload['k'] not in ('story', 'chapter'):
+            raise ValueError(payload['k'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return payload
+
+
+class SearchService:
+
+    async def index_chapter(self, chapter: Chapter, db: AsyncSession) -> None:
+        """
+        Rebuild a chapter's search document, the caller commits
+
+        The document is computed by postgres from the text sent with the
+        statement, and cleared while the chapter is unpublished so drafts
+        never show up in results. Other databases have no search column.
+        """
+        if db.get_bind().dialect.name != 'postgresql':
+            return
+        document = chapter_search_document(chapter.title, chapter.content) if chapter.is_published else None
+        await db.exec(
+            update(Chapter.__table__)
+            .where(Chapter.__table__.c.id == chapter.id)
+            .values(search_vector=document)
+        )
+
+    async def search(
+        self,
+        query: str,
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        page_size: int = 20
+    ) -> SearchResponse:
+        db_logger.info("Searching for %r with page size %s", query, page_size)
+        try:
+            tsquery = func.websearch_to_tsquery(_config(), query)
+
+            stories = (
+                select(
+                    literal('story').label('kind'),
+                    Story.id.label('id'),
+                    Story.id.label('story_id'),
+                    Story.name.label('title'),
+                    func.ts_rank(story_vector, tsquery).label('rank')
+                )
+                .where(story_vector.op('@@')(tsquery))
+            )
+            chapters = (
+                select(
+                    literal('chapter').label('kind'),
+                    Chapter.id.label('id'),
+                    Chapter.story_id.label('story_id'),
+                    Chapter.title.label('title'),
+                    func.ts_rank(chapter_vector, tsquery).label('rank')
+                )
+                .where(Chapter.is_published)
+                .where(chapter_vector.op('@@')(tsquery))
+            )
+            hits = union_all(stories, chapters).subquery()
+
+            # best match first, kind and id break ties so the order is total
+            statement = (
+                select(*hits.c)
+                .order_by(hits.c.rank.desc(), hits.c.kind, hits.c.id)
+                .limit(page_size + 1)
+            )
+            if cursor:
+                after = _decode_cursor(cursor)
+                statement = statement.where(or_(
+                    hits.c.rank < after['r'],
+                    and_(
+                        hits.c.rank == after['r'],
+                        tuple_(hits.c.kind, hits.c.id) > tuple_(after['k'], after['id'])
+                    )
+                ))
+
+            results = (await db.exec(statement)).all()
+            next_cursor = _encode_cursor(results[page_size - 1]) if len(results) > page_size else None
+            results = results[:page_size]
+            db_logger.debug("Search matched %s results on this page", len(results))
+
+            return SearchResponse(
+                results=[
+                    SearchResult(
+                        kind=result.kind,
+                        id=result.id,
+                        story_id=result.story_id,
+                        title=result.title,
+                        rank=result.rank,
+                        snippet=snippet
+                    )
+                    for result, snippet in zip(results, await self._snippets(query, results, db))
+                ],
+                next_cursor=next_cursor
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error searching: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def _snippets(self, query: str, results: list[Row], db: AsyncSession) -> list[str]:
+        # headlines are expensive, so they are only built for the page being returned
+        if not results:
+            return []
+
+        story_ids = [result.id for result in results if result.kind == 'story']
+        chapter_ids = [result.id for result in results if result.kind == 'chapter']
+        blurbs = dict((await db.exec(select(Story.id, Story.blurb).where(Story.id.in_(story_ids)))).all()) if story_ids else {}
+        contents = dict((await db.exec(select(Chapter.id, Chapter.content).where(Chapter.id.in_(chapter_ids)))).all()) if chapter_ids else {}
+
+        docs = [
+            blurbs.get(result.id, '') if result.kind == 'story' else contents.get(result.id, '')
+            for result in results
+        ]
+        return list((await db.exec(
+            HEADLINES,
+            params={'config': SEARCH_CONFIG, 'query': query, 'options': HEADLINE_OPTIONS, 'docs': docs}
+        )).scalars())
+
+
+search_service = SearchService()
@@ -1,35 +1,172 @@
-from src.models import Story
+from src.models import Story, StoryStats, User
 from src.schema import (
     StoryCreate,
     StoryResponse,
     UIStoriesResponse,
+    CursorStoriesResponse,
+    StorySortField,
+    SortOrder,
     UserNameTag,
-    StoryInfo
+    StoryInfo,
+    StoryStatsInfo
 )
-from sqlmodel import Session, select, func
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import tuple_, delete
+from sqlalchemy.engine import Row
 from fastapi import HTTPException, status
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+import base64
+import binascii
+import json
 from src.logging import db_logger
+from src.cache import Validators, story_cache, story_validators
+from src.database import from_primary
+from src.services.autocomplete import autocomplete_service
+from redis.asyncio import Redis
+
+
+def _sort_key(sort_by: StorySortField) -> Any:
+    # updated_at is null until the first edit, so fall back to created_at
+    # (this matches the expression index ix_story_updated_at_id)
+    if sort_by == 'created_at':
+        return Story.created_at
+    if sort_by == 'updated_at':
+        return func.coalesce(Story.updated_at, Story.created_at)
+    return Story.id
+
+
+def _order_by(sort_by: StorySortField, order: SortOrder) -> list:
+    columns = [Story.id] if sort_by == 'id' else [_sort_key(sort_by), Story.id]
+    return [column.desc() if order == 'desc' else column.asc() for column in columns]
+
+
+def _encode_cursor(sort_by: StorySortField, order: SortOrder, story: Row) -> str:
+    payload = {'s': sort_by, 'o': order, 'id': story.id}
+    if sort_by == 'created_at':
+        payload['v'] = story.created_at.isoformat()
+    elif sort_by == 'updated_at':
+        payload['v'] = (story.updated_at or story.created_at).isoformat()
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str, sort_by: StorySortField, order: SortOrder) -> dict:
+    invalid_cursor = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor"
+    )
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if sort_by != 'id':
+            payload['v'] = datetime.fromisoformat(payload['v'])
+        int(payload['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise invalid_cursor
+
+    # a cursor is only valid for the ordering it was issued for
+    if payload.get('s') != sort_by or payload.get('o') != order:
+        raise invalid_cursor
+
+    return payload
+
+
+def _page_key(page: int, page_size: int, sort_by: StorySortField, order: SortOrder) -> str:
+    return f"page:{page}:{page_size}:{sort_by}:{order}"
+
+
+def _cursor_key(cursor: Optional[str], page_size: int, sort_by: StorySortField, order: SortOrder) -> str:
+    return f"cursor:{cursor or ''}:{page_size}:{sort_by}:{order}"
+
+
+def _story_key(id: int, validators: Optional[Validators] = None) -> str:
+    # keyed by the ETag when there is one, so the body sent with it is never older
+    return f"story:{id}:{validators.etag}" if validators is not None else f"story:{id}"
+
+
+def _story_response_statement():
+    # only the columns StoryResponse (and the keyset cursor) needs, with the
+    # author and stats joined in, so a page of stories is one round trip
+    return (
+        select(
+            Story.id,
+            Story.name,
+            Story.blurb,
+            Story.created_at,
+            Story.updated_at,
+            User.id.label('author_id'),
+            User.username.label('author_username'),
+            StoryStats.chapter_count,
+            StoryStats.published_chapter_count,
+            StoryStats.word_count,
+            StoryStats.last_chapter_at
+        )
+        .join(User, Story.user_id == User.id)
+        .outerjoin(StoryStats, StoryStats.story_id == Story.id)
+    )
+
+
+def _to_story_response(row: Row) -> StoryResponse:
+    return StoryResponse(
+        id=row.id,
+        name=row.name,
+        blurb=row.blurb,
+        author=UserNameTag(
+            id=row.author_id,
+            username=row.author_username
+        ),
+        # stories without chapters have no stats row yet
+        stats=StoryStatsInfo(
+            chapter_count=row.chapter_count or 0,
+            published_chapter_count=row.published_chapter_count or 0,
+            word_count=row.word_count or 0,
+            last_chapter_at=row.last_chapter_at
+        )
+    )
+
 
 class StoryService:
-    def get_stories(self, db: Session, page: int, page_size: int = 10) -> UIStoriesResponse:
-        db_logger.info(f"Retrieving stories page {page} with size {page_size}")
+    async def get_stories(
+        self,
+        db: AsyncSession,
+        page: int,
+        page_size: int = 10,
+        sort_by: StorySortField = 'id',
+        order: SortOrder = 'asc',
+        redis: Optional[Redis] = None
+    ) -> UIStoriesResponse:
+        if redis is not None:
+            return await story_cache.get_or_load(
+                redis,
+                _page_key(page, page_size, sort_by, order),
+                UIStoriesResponse,
+                from_primary(db, lambda db: self.get_stories(db, page, page_size, sort_by, order))
+            )
+
+        db_logger.info("Retrieving stories page %s with size %s", page, page_size)
         try:
             db_logger.debug("Counting total stories")
             count_statement = select(func.count(Story.id))
-            db_logger.debug(f"Count query: {count_statement}")
+            db_logger.debug("Count query: %s", count_statement)
             
-            total_count = db.exec(count_statement).first()
-            db_logger.debug(f"Total stories count: {total_count}")
+            total_count = (await db.exec(count_statement)).first()
+            db_logger.debug("Total stories count: %s", total_count)
 
             page_count = (total_count + page_size - 1) // page_size
-            db_logger.debug(f"Calculated total pages: {page_count}")
+            db_logger.debug("Calculated total pages: %s", page_count)
 
-            statement = select(Story).limit(page_size).offset((page - 1)*page_size)
-            db_logger.debug(f"Executing story query: {statement}")
+            statement = (
+                _story_response_statement()
+                .order_by(*_order_by(sort_by, order))
+                .limit(page_size)
+                .offset((page - 1)*page_size)
+            )
+            db_logger.debug("Executing story query: %s", statement)
 
-            stories = db.exec(statement).all()
-            db_logger.debug(f"Retrieved {len(stories)} stories")
+            stories = (await db.exec(statement)).all()
+            db_logger.debug("Retrieved %s stories", len(stories))
 
             if not stories:
                 db_logger.warning("No stories found in database")
@@ -39,170 +176,328 @@ class StoryService:
                 )
             
             db_logger.debug("Creating response objects for stories")
-            stories_to_get = [
-                StoryResponse(
-                    id=story.id,
-                    name=story.name,
-                    blurb=story.blurb,
-                    author=UserNameTag(
-                        id=story.user.id,
-                        username=story.user.username
-                    )
-                )
-                for story in stories
-            ]
-            db_logger.debug(f"Created {len(stories_to_get)} story response objects")
+            stories_to_get = [_to_story_response(story) for story in stories]
+            db_logger.debug("Created %s story response objects", len(stories_to_get))
 
             response = UIStoriesResponse(
                 page=page,
                 page_count=page_count,
                 stories=stories_to_get
             )
-            db_logger.info(f"Successfully retrieved page {page} of stories")
+            db_logger.info("Successfully retrieved page %s of stories", page)
             return response
 
         except HTTPException:
             raise
         except Exception as e:
-            db_logger.error(f"Error retrieving stories: {str(e)}", exc_info=True)
+            db_logger.error("Error retrieving stories: %s", e, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"A database error occurred: {e}"
             )
 
-    def create_story(self, story_data: StoryCreate, db: Session) -> StoryResponse:
-        db_logger.info(f"Attempting to create story with name: {story_data.info.name}")
+    async def get_stories_by_cursor(
+        self,
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        page_size: int = 10,
+        sort_by: StorySortField = 'id',
+        order: SortOrder = 'asc',
+        redis: Optional[Redis] = None
+    ) -> CursorStoriesResponse:
+        if redis is not None:
+            return await story_cache.get_or_load(
+                redis,
+                _cursor_key(cursor, page_size, sort_by, order),
+                CursorStoriesResponse,
+                from_primary(db, lambda db: self.get_stories_by_cursor(db, cursor, page_size, sort_by, order))
+            )
+
+        db_logger.info("Retrieving stories after cursor %s sorted by %s %s", cursor, sort_by, order)
+        try:
+            statement = _story_response_statement().order_by(*_order_by(sort_by, order))
+
+            if cursor:
+                db_logger.debug("Decoding cursor")
+                payload = _decode_cursor(cursor, sort_by, order)
+
+                # seek past the last row of the previous page instead of counting
+                # and skipping rows, so every page is a single index range scan
+                if sort_by == 'id':
+                    key, last_seen = Story.id, payload['id']
+                else:
+                    key = tuple_(_sort_key(sort_by), Story.id)
+                    last_seen = tuple_(payload['v'], payload['id'])
+                statement = statement.where(key < last_seen if order == 'desc' else key > last_seen)
+
+            # fetch one extra row to find out whether there is a next page
+            statement = statement.limit(page_size + 1)
+            db_logger.debug("Executing story query: %s", statement)
+
+            stories = (await db.exec(statement)).all()
+            db_logger.debug("Retrieved %s stories", len(stories))
+
+            has_more = len(stories) > page_size
+            stories = stories[:page_size]
+
+            stories_to_get = [_to_story_response(story) for story in stories]
+
+            response = CursorStoriesResponse(
+                stories=stories_to_get,
+                next_cursor=_encode_cursor(sort_by, order, stories[-1]) if has_more else None
+            )
+            db_logger.info("Successfully retrieved %s stories by cursor", len(stories_to_get))
+            return response
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving stories: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    async def create_story(
+        self,
+        story_data: StoryCreate,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> StoryResponse:
+        db_logger.info("Attempting to create story with name: %s", story_data.info.name)
         try:
             db_logger.debug("Checking for existing story with same title")
-            story = self.get_story_by_title(story_data.info.name, db)
+            existing_id = (await db.exec(
+                select(Story.id).where(Story.name == story_data.info.name)
+            )).first()
 
-            if story:
-                db_logger.warning(f"Story already exists with name: {story_data.info.name}")
+            if existing_id is not None:
+                db_logger.warning("Story already exists with name: %s", story_data.info.name)
                 raise HTTPException(
                     status_code=400,
                     detail="A story with that name already exists"
                 )
             
             db_logger.debug("Creating new story object")
-            story_to_create = Story(
+            db_story = Story(
                 user_id=story_data.user_id,
                 name=story_data.info.name,
                 blurb=story_data.info.blurb
             )
-            db_logger.debug(f"Story object created: {story_to_create.__dict__}")
-
-            db_logger.debug("Validating story model")
-            db_story = Story.model_validate(story_to_create)
+            db_logger.debug("Story object created: %s", db_story.__dict__)
 
             db_logger.debug("Adding story to database")
             db.add(db_story)
+            await db.flush()
+            story_id = db_story.id
             db_logger.debug("Committing transaction")
-            db.commit()
-            db_logger.debug("Refreshing story object")
-            db.refresh(db_story)
+            await db.commit()
+
+            if redis is not None:
+                db_logger.debug("Invalidating story cache")
+                await story_cache.invalidate(redis)
+            await story_validators.forget(redis, story_id)
+            await autocomplete_service.add('story', story_id, story_data.info.name, redis)
 
             db_logger.debug("Creating response object")
-            response = StoryResponse(
-                id=db_story.id,
-                name=db_story.name,
-                blurb=db_story.blurb,
-                author=UserNameTag(
-                    id=db_story.user.id,
-                    username=db_story.user.username
-                )
-            )
-            db_logger.info(f"Successfully created story with ID: {db_story.id}")
+            response = await self.get_story_by_id(story_id, db)
+            db_logger.info("Successfully created story with ID: %s", story_id)
             return response
   
+        except HTTPException:
+            raise
         except Exception as e:
-            db_logger.error(f"Error creating story: {str(e)}", exc_info=True)
-            db.rollback()
+            db_logger.error("Error creating story: %s", e, exc_info=True)
+            await db.rollback()
             db_logger.info("Database transaction rolled back")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"A database error occurred: {e}"
             )
 
-    def delete_story(self, id: int, db: Session) -> dict[str, str]:
-        db_logger.info(f"Attempting to delete story with ID: {id}")
+    async def delete_story(
+        self,
+        id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> dict[str, str]:
+        db_logger.info("Attempting to delete story with ID: %s", id)
         try:
-            db_logger.debug("Retrieving story to delete")
-            story_to_delete = self.get_story_by_id(id, db)
+            # a bulk delete instead of db.delete(story), which would lazy load
+            # the chapters relationship (not allowed on an async session)
+            db_logger.debug("Deleting story")
+            result = await db.exec(delete(Story).where(Story.id == id))
 
-            if not story_to_delete:
-                db_logger.warning(f"No story found with ID: {id}")
+            if not result.rowcount:
+                db_logger.warning("No story found with ID: %s", id)
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Story with id {id} not found"
                 )
 
-            db_logger.debug(f"Found story to delete: {story_to_delete.__dict__}")
-            db_logger.debug("Deleting story")
-            db.delete(story_to_delete)
             db_logger.debug("Committing deletion")
-            db.commit()
+            await db.commit()
+
+            if redis is not None:
+                db_logger.debug("Invalidating story cache")
+                await story_cache.invalidate(redis)
+            await story_validators.forget(redis, id)
+            await autocomplete_service.remove('story', id, redis)
 
-            db_logger.info(f"Successfully deleted story {id}")
+            db_logger.info("Successfully deleted story %s", id)
             return {"message": "story successfully deleted"}
         
         except HTTPException:
             raise
         except Exception as e:
-            db_logger.error(f"Error deleting story: {str(e)}", exc_info=True)
-            db.rollback()
+            db_logger.error("Error deleting story: %s", e, exc_info=True)
+            await db.rollback()
             db_logger.info("Database transaction rolled back")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"A database error occurred: {e}"
             )
 
-    def get_story_by_id(self, id: int, db: Session) -> Story:
-        db_logger.info(f"Attempting to get story by ID: {id}")
+    async def get_story_by_id(
+        self,
+        id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> StoryResponse:
+        if redis is not None:
+            return await story_cache.get_or_load(
+                redis,
+                _story_key(id),
+                StoryResponse,
+                from_primary(db, lambda db: self.get_story_by_id(id, db))
+            )
+
+        db_logger.info("Attempting to get story by ID: %s", id)
         try:
             db_logger.debug("Executing database query")
-            story = db.get(Story, id)
+            story = (await db.exec(_story_response_statement().where(Story.id == id))).first()
 
             if not story:
-                db_logger.warning(f"No story found with ID: {id}")
+                db_logger.warning("No story found with ID: %s", id)
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Story with id {id} not found"
                 )
             
-            db_logger.debug(f"Found story: {story.__dict__}")
-            return story
+            db_logger.debug("Found story: %s", story)
+            return _to_story_response(story)
         
         except HTTPException:
             raise
         except Exception as e:
-            db_logger.error(f"Error retrieving story: {str(e)}", exc_info=True)
+            db_logger.error("Error retrieving story: %s", e, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"A database error occurred: {e}"
+            )
+
+    # the same reads as JSON for ModelResponse, a cache hit is sent without being parsed
+
+    async def get_stories_json(
+        self,
+        db: AsyncSession,
+        page: int,
+        page_size: int,
+        sort_by: StorySortField,
+        order: SortOrder,
+        redis: Redis
+    ) -> bytes:
+        return await story_cache.get_or_load_json(
+            redis,
+            _page_key(page, page_size, sort_by, order),
+            from_primary(db, lambda db: self.get_stories(db, page, page_size, sort_by, order))
+        )
+
+    async def get_stories_by_cursor_json(
+        self,
+        db: AsyncSession,
+        cursor: Optional[str],
+        page_size: int,
+        sort_by: StorySortField,
+        order: SortOrder,
+        redis: Redis
+    ) -> bytes:
+        return await story_cache.get_or_load_json(
+            redis,
+            _cursor_key(cursor, page_size, sort_by, order),
+            from_primary(db, lambda db: self.get_stories_by_cursor(db, cursor, page_size, sort_by, order))
+        )
+
+    async def get_story_json(
+        self,
+        id: int,
+        db: AsyncSession,
+        redis: Redis,
+        validators: Optional[Validators] = None
+    ) -> bytes:
+        return await story_cache.get_or_load_json(
+            redis,
+            _story_key(id, validators),
+            from_primary(db, lambda db: self.get_story_by_id(id, db))
+        )
+
+    async def get_story_validators(
+        self,
+        id: int,
+        db: AsyncSession,
+        redis: Optional[Redis] = None
+    ) -> Validators:
+        return await story_validators.get(redis, id, from_primary(db, lambda db: self._load_story_validators(id, db)))
+
+    async def _load_story_validators(self, id: int, db: AsyncSession) -> Validators:
+        db_logger.debug("Looking up validators of story %s", id)
+        try:
+            row = (await db.exec(
+                select(Story.created_at, Story.updated_at, StoryStats.updated_at.label('stats_updated_at'))
+                .outerjoin(StoryStats, StoryStats.story_id == Story.id)
+                .where(Story.id == id)
+            )).first()
+
+            if not row:
+                db_logger.warning("No story found with ID: %s", id)
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Story with id {id} not found"
+                )
+
+            return Validators.of(id, row.updated_at or row.created_at, row.stats_updated_at)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            db_logger.error("Error retrieving story validators: %s", e, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"A database error occurred: {e}"
             )
 
-    def get_story_by_title(self, title: str, db: Session) -> Story:
-        db_logger.info(f"Attempting to get story by title: {title}")
+    async def get_story_by_title(self, title: str, db: AsyncSession) -> Story:
+        db_logger.info("Attempting to get story by title: %s", title)
         try:
             statement = select(Story).where(Story.name == title)
-            db_logger.debug(f"Executing query: {statement}")
+            db_logger.debug("Executing query: %s", statement)
 
-            story = db.exec(statement).first()
+            story = (await db.exec(statement)).first()
 
             if not story:
-                db_logger.warning(f"No story found with title: {title}")
+                db_logger.warning("No story found with title: %s", title)
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Story with title {title} not found"
                 )
             
-            db_logger.debug(f"Found story: {story.__dict__}")
+            db_logger.debug("Found story: %s", story.__dict__)
             return story
         
         except HTTPException:
             raise
         except Exception as e:
-            db_logger.error(f"Error retrieving story: {str(e)}", exc_info=True)
+            db_logger.error("Error retrieving story: %s", e, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"A database error occurred: {e}"
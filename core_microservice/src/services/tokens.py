@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import time
+from typing import List, Tuple
+from redis.asyncio import Redis
+from src.settings import app_config
+from src.logging import auth_logger
+
+# rotate a refresh session in one atomic step: the old session must still be
+# live, it is swapped for the new one and expired sessions are swept out
+ROTATE_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) <= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[4])
+redis.call('EXPIREAT', KEYS[1], ARGV[3])
+return 1
+"""
+
+LEGACY_TOKEN_PATTERN = "refresh_token:*"
+LEGACY_INDEX_PREFIX = "refresh_tokens:"
+
+
+def session_id(token_id: str) -> str:
+    # short, fixed size handle for a refresh token's jti
+    return hashlib.blake2b(token_id.encode(), digest_size=8).hexdigest()
+
+
+class RefreshTokenStore:
+    """
+    Refresh sessions kept in one sorted set per user
+
+    Each member is the hashed jti of a refresh token and its score is the
+    token's expiry, so checking, listing and revoking sessions are single
+    commands on one small key, and revoking every session of a user is a
+    single UNLINK rather than a SCAN over the keyspace. Expired members are
+    swept whenever the set is written to, and the key itself expires with
+    the newest session.
+    """
+
+    @staticmethod
+    def key(username: str) -> str:
+        return f"refresh_sessions:{username}"
+
+    async def add(self, redis: Redis, username: str, sid: str, expires_at: int) -> None:
+        key = self.key(username)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {sid: expires_at})
+            pipe.zremrangebyscore(key, '-inf', int(time.time()))
+            pipe.expireat(key, expires_at)
+            await pipe.execute()
+
+    async def is_active(self, redis: Redis, username: str, sid: str) -> bool:
+        expires_at = await redis.zscore(self.key(username), sid)
+        return expires_at is not None and expires_at > time.time()
+
+    async def list(self, redis: Redis, username: str) -> List[Tuple[str, int]]:
+        sessions = await redis.zrangebyscore(
+            self.key(username),
+            int(time.time()),
+            '+inf',
+            withscores=True
+        )
+        return [(sid.decode(), int(expires_at)) for sid, expires_at in sessions]
+
+    async def revoke(self, redis: Redis, username: str, sid: str) -> bool:
+        return bool(await redis.zrem(self.key(username), sid))
+
+    async def revoke_all(self, redis: Redis, username: str) -> None:
+        await redis.unlink(self.key(username))
+
+    async def rotate(
+        self,
+        redis: Redis,
+        username: str,
+        old_sid: str,
+        new_sid: str,
+        expires_at: int
+    ) -> bool:
+        rotated = await redis.eval(
+            ROTATE_SCRIPT,
+            1,
+            self.key(username),
+            old_sid,
+            new_sid,
+            expires_at,
+            int(time.time())
+        )
+        return bool(rotated)
+
+    async def migrate_legacy_tokens(self, redis: Redis, batch_size: int = 500) -> int:
+        """
+        Move `refresh_token:{username}:{jwt}` keys into the per-user sets
+
+        Legacy tokens have no jti, so they are tracked under the hash of
+        the whole token, which is what verification falls back to.
+        """
+        migrated = 0
+        usernames = set()
+        cursor = 0
+        while True:
+            cursor, keys = await redis.scan(cursor, match=LEGACY_TOKEN_PATTERN, count=batch_size)
+            if keys:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.ttl(key)
+                    ttls = await pipe.execute()
+
+                now = int(time.time())
+                async with redis.pipeline(transaction=False) as pipe:
+                    for key, ttl in zip(keys, ttls):
+                        # the key may have expired since the scan
+                        if ttl == -2:
+                            continue
+                        if ttl == -1:
+                            ttl = int(app_config.REFRESH_TOKEN_EXPIRE_TIME) * 24 * 60 * 60
+                        username, token = key.decode()[len("refresh_token:"):].rsplit(':', 1)
+                        expires_at = now + ttl
+                        pipe.zadd(self.key(username), {session_id(token): expires_at})
+                        pipe.unlink(key)
+                        usernames.add(username)
+                        migrated += 1
+                    await pipe.execute()
+
+            if cursor == 0:
+                break
+
+        # the set must live as long as its newest session, which may be one
+        # that was already stored before the migration ran
+        usernames = list(usernames)
+        async with redis.pipeline(transaction=False) as pipe:
+            for username in usernames:
+                pipe.zrange(self.key(username), -1, -1, withscores=True)
+            newest_sessions = await pipe.execute()
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for username, newest in zip(usernames, newest_sessions):
+                if newest:
+                    pipe.expireat(self.key(username), int(newest[0][1]))
+                pipe.unlink(f"{LEGACY_INDEX_PREFIX}{username}")
+            await pipe.execute()
+
+        return migrated
+
+
+refresh_token_store = RefreshTokenStore()
+
+
+async def migrate() -> None:
+    from src.cache import redis_pool
+
+    redis = await redis_pool.connect()
+    try:
+        migrated = await refresh_token_store.migrate_legacy_tokens(redis)
+        auth_logger.info("Migrated %s legacy refresh tokens", migrated)
+    finally:
+        await redis_pool.close()
+
+
+# python -m src.services.tokens
+if __name__ == '__main__':
+    asyncio.run(migrate())
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from src.schema import AuthenticatedUser
+from src.settings import app_config
+from src.logging import auth_logger
+
+# channel used to tell every worker to drop a user from its cache
+INVALIDATION_CHANNEL = "auth:user-cache:invalidate"
+
+
+class UserCache:
+    """
+    Bounded LRU cache with a TTL for the users behind access tokens
+
+    Keyed by the token subject (the username), it holds the slim
+    AuthenticatedUser record so get_current_user can skip the database
+    while an entry is fresh. Evictions can be broadcast over redis pub/sub
+    so every worker drops the entry, not just the one that saw the change.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, AuthenticatedUser]]" = OrderedDict()
+
+    def get(self, username: str) -> Optional[AuthenticatedUser]:
+        entry = self._entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, username: str, user: AuthenticatedUser) -> None:
+        self._entries[username] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def evict(self, username: str) -> None:
+        self._entries.pop(username, None)
+
+    async def invalidate(self, username: str, redis: Optional[Redis] = None) -> None:
+        self.evict(username)
+        if redis is None or not app_config.USER_CACHE_PUBSUB:
+            return
+        try:
+            await redis.publish(INVALIDATION_CHANNEL, username)
+        except RedisError as e:
+            auth_logger.warning("Failed to broadcast user cache invalidation for %s: %s", username, e)
+
+    async def listen(self, redis: Redis) -> None:
+        # long running task started by the app lifespan
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(INVALIDATION_CHANNEL)
+        try:
+            while True:
+                try:
+                    message = await pubsub.get_message(timeout=1.0)
+                except RedisError as e:
+                    auth_logger.warning("User cache invalidation listener error: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                if message is not None:
+                    self.evict(message['data'].decode())
+        finally:
+            await pubsub.aclose()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": 0,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+user_cache = UserCache(
+    max_size=app_config.USER_CACHE_SIZE,
+    ttl=app_config.USER_CACHE_TTL
+)
@@ -1,17 +1,74 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List, Literal, Optional
 
 class Settings(BaseSettings):
 
     DATABASE_URL: str 
     DATABASE_MIGRATION_URL: str
+    DATABASE_POOL_SIZE: int = 20
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_REPLICA_URLS: List[str] = []
+    DATABASE_REPLICA_CHECK_INTERVAL: float = 5.0
+    DATABASE_REPLICA_CHECK_TIMEOUT: float = 2.0
+    DATABASE_READ_YOUR_WRITES_SECONDS: int = 5
+    DB_SLOW_QUERY_MS: Optional[float] = 200.0
+    DB_SERVER_TIMING: bool = True
+    DB_QUERY_BUDGET_STRICT: bool = False
     SECRET_KEY:str
     REDIS_HOST: str
     REDIS_PORT: int
+    REDIS_POOL_SIZE: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
     APP_PORT: int
     ALLOWED_DOMAIN:str
     TOKEN_EXPIRE_TIME: str
     REFRESH_TOKEN_EXPIRE_TIME: str
     AUTH_ALGO: str
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_PUBSUB: bool = True
+    CHAPTER_STREAM_CHUNK_SIZE: int = 65536
+    CHAPTER_COMPRESSION: Literal['none', 'zlib', 'zstd'] = 'zlib'
+    CHAPTER_COMPRESSION_LEVEL: int = 6
+    CHAPTER_COMPRESSION_DICT: Optional[str] = None
+    CHAPTER_COMPRESSION_OLD_DICTS: List[str] = []
+    CHAPTER_REVISION_SNAPSHOT_INTERVAL: int = 10
+    CHAPTER_REVISION_RETENTION_DAYS: int = 30
+    CHAPTER_REVISION_COMPACTION_INTERVAL: int = 3600
+    STORY_CACHE_TTL: int = 60
+    STORY_IMPORT_MAX_BYTES: int = 52428800
+    STORY_IMPORT_UPLOAD_TTL: int = 3600
+    STORY_IMPORT_DIR: Optional[str] = None
+    STORY_STATS_FLUSH_INTERVAL: float = 1.0
+    STORY_STATS_BATCH_SIZE: int = 1000
+    STORY_STATS_RECONCILE_INTERVAL: int = 3600
+    AUTOCOMPLETE_MEMORY_INDEX: bool = False
+    CACHE_LOCK_TIMEOUT_MS: int = 2000
+    VALIDATOR_CACHE_TTL: int = 300
+    LOG_FORMAT: Literal['text', 'json'] = 'text'
+    METRICS_ENABLED: bool = True
+    METRICS_FLUSH_INTERVAL: float = 1.0
+    JOB_QUEUES: Dict[str, int] = {'default': 2, 'search': 2, 'imports': 1}
+    JOB_WORKER_IN_APP: bool = True
+    JOB_BLOCK_MS: int = 1000
+    JOB_RETRY_AFTER_MS: int = 30000
+    JOB_STREAM_MAXLEN: int = 100000
+    JOB_STATUS_TTL: int = 86400
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: Dict[str, Dict[Literal['ip', 'user'], str]] = {
+        'POST /api/users/login': {'ip': '10/minute'},
+        'POST /api/users/register': {'ip': '5/hour'},
+        'POST /api/stories/': {'ip': '60/hour', 'user': '20/hour'},
+        'POST /api/stories/import': {'user': '10/hour'},
+        'POST /api/chapters/': {'ip': '300/hour', 'user': '120/hour'},
+        'PUT /api/chapters/': {'ip': '1200/hour', 'user': '600/hour'}
+    }
+    RATE_LIMIT_FALLBACK_SIZE: int = 10000
 
     class Config:
         env_file = '.env'
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import tempfile
+
+# settings are read on import, so the environment is set up before anything
+# from src is imported. The database is a sqlite file, through aiosqlite
+TEST_DIR = tempfile.mkdtemp(prefix='core-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(TEST_DIR, 'primary.db')}")
+os.environ.setdefault('DATABASE_MIGRATION_URL', os.environ['DATABASE_URL'])
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('REDIS_HOST', 'localhost')
+os.environ.setdefault('REDIS_PORT', '6379')
+os.environ.setdefault('APP_PORT', '8000')
+os.environ.setdefault('ALLOWED_DOMAIN', 'http://localhost')
+os.environ.setdefault('TOKEN_EXPIRE_TIME', '30')
+os.environ.setdefault('REFRESH_TOKEN_EXPIRE_TIME', '7')
+os.environ.setdefault('AUTH_ALGO', 'HS256')
+# going over a route's query_budget fails the request instead of logging
+os.environ.setdefault('DB_QUERY_BUDGET_STRICT', 'true')
+
+import fakeredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlmodel import SQLModel
+from src.cache import get_redis
+from src.database import engine
+from src.middleware.queries import QueryStatsMiddleware
+from src.routes import chapters, stories
+from src.schema import AuthenticatedUser
+from src.services.user_cache import user_cache
+from src.settings import app_config
+
+
+def token_for(user: AuthenticatedUser) -> dict:
+    # the user behind a token is normally served from user_cache, which keeps the query budgets
+    user_cache.set(user.username, user)
+    token = jwt.encode({'sub': user.username, 'type': 'access'}, app_config.SECRET_KEY, app_config.AUTH_ALGO)
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis()
+
+
+@pytest.fixture
+def database():
+    # fresh tables for every test, the engine's connections stay with the loop that made them
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(create_tables())
+    yield engine
+
+
+@pytest.fixture
+def client(database, redis):
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware)
+    app.include_router(stories.router)
+    app.include_router(chapters.router)
+    app.dependency_overrides[get_redis] = lambda: redis
+    with TestClient(app) as client:
+        yield client
+    # the client's event loop is gone, so are its connections
+    engine.sync_engine.dispose()
@@ -0,0 +1,103 @@
+import pytest
+from src.database import async_session
+from src.models import Chapter, Story, User
+from src.schema import AuthenticatedUser
+from src.services.revisions import revision_service
+from tests.conftest import token_for
+
+
+@pytest.fixture
+def story(client):
+    async def seed():
+        async with async_session() as db:
+            author = User(username='author', email='author@example.com', password_hash='x')
+            reader = User(username='reader', email='reader@example.com', password_hash='x')
+            db.add_all([author, reader])
+            await db.flush()
+            story = Story(user_id=author.id, name="A story", blurb="A blurb")
+            db.add(story)
+            await db.flush()
+            published = Chapter(story_id=story.id, title="Published", content="Out in the open", is_published=True)
+            draft = Chapter(story_id=story.id, title="Draft", content="Not for anyone yet", is_published=False)
+            db.add_all([published, draft])
+            await db.commit()
+            return {
+                'id': story.id,
+                'published': published.id,
+                'draft': draft.id,
+                'author': token_for(AuthenticatedUser(id=author.id, username='author', email=author.email)),
+                'reader': token_for(AuthenticatedUser(id=reader.id, username='reader', email=reader.email)),
+            }
+
+    return client.portal.call(seed)
+
+
+@pytest.mark.parametrize('caller', ['anonymous', 'reader'])
+def test_drafts_are_hidden_from_everyone_but_the_author(client, story, caller):
+    headers = story.get(caller, {})
+
+    response = client.get(f"/api/chapters/story/{story['id']}", headers=headers)
+    assert response.status_code == 200
+    assert [chapter['title'] for chapter in response.json()['chapters']] == ["Published"]
+    assert response.json()['total_chapters'] == 1
+
+    assert client.get(f"/api/chapters/{story['published']}", headers=headers).status_code == 200
+    assert client.get(f"/api/chapters/{story['published']}/content", headers=headers).text == "Out in the open"
+
+    assert client.get(f"/api/chapters/{story['draft']}", headers=headers).status_code == 404
+    assert client.get(f"/api/chapters/{story['draft']}/content", headers=headers).status_code == 404
+
+
+def test_the_author_sees_their_drafts(client, story):
+    headers = story['author']
+
+    response = client.get(f"/api/chapters/story/{story['id']}", headers=headers)
+    assert response.status_code == 200
+    assert [chapter['title'] for chapter in response.json()['chapters']] == ["Published", "Draft"]
+
+    response = client.get(f"/api/chapters/{story['draft']}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()['content'] == "Not for anyone yet"
+    assert client.get(f"/api/chapters/{story['draft']}/content", headers=headers).text == "Not for anyone yet"
+
+
+def test_cached_validators_still_hide_a_draft(client, story):
+    etag = client.get(f"/api/chapters/{story['draft']}", headers=story['author']).headers['etag']
+
+    # the author's read left the validators in redis, a conditional request must not get past them
+    response = client.get(f"/api/chapters/{story['draft']}", headers={'If-None-Match': etag})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('chapter', ['published', 'draft'])
+def test_only_the_author_sees_a_chapters_history(client, story, chapter):
+    async def edit():
+        async with async_session() as db:
+            await revision_service.record(story[chapter], "Written before publishing", "Edited since", db)
+            await db.commit()
+
+    client.portal.call(edit)
+    revisions = f"/api/chapters/{story[chapter]}/revisions"
+
+    for headers in ({}, story['reader']):
+        assert client.get(revisions, headers=headers).status_code == 404
+        assert client.get(f"{revisions}/1", headers=headers).status_code == 404
+
+    response = client.get(revisions, headers=story['author'])
+    assert response.status_code == 200
+    assert [revision['revision'] for revision in response.json()] == [2, 1]
+    response = client.get(f"{revisions}/1", headers=story['author'])
+    assert response.json()['content'] == "Written before publishing"
+
+
+def test_the_table_of_contents_lists_drafts_to_the_author_only(client, story):
+    toc = lambda headers, **params: [
+        chapter['title']
+        for chapter in client.get(f"/api/chapters/story/{story['id']}/toc", headers=headers, params=params).json()['chapters']
+    ]
+
+    for headers in ({}, story['reader']):
+        assert toc(headers) == ["Published"]
+        assert toc(headers, published_only=False) == ["Published"]
+    assert toc(story['author']) == ["Published"]
+    assert toc(story['author'], published_only=False) == ["Published", "Draft"]
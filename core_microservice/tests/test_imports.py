@@ -0,0 +1,50 @@
+import io
+import threading
+import zipfile
+import pytest
+from sqlmodel import select
+import src.services.imports as imports
+from src.database import async_session, engine
+from src.models import Chapter, User
+from src.services.imports import StoryArchive, story_import_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_chapters_are_parsed_off_the_event_loop_a_batch_at_a_time(database, redis, monkeypatch):
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, 'w') as archive:
+        for n in range(1, 6):
+            archive.writestr(f"chapter-{n}.md", f"# Chapter {n}\n\n" + "word " * 300 * n)
+    upload.seek(0)
+
+    threads = set()
+    text_stats = imports.text_stats
+
+    def counted(content):
+        threads.add(threading.get_ident())
+        return text_stats(content)
+
+    monkeypatch.setattr(imports, 'text_stats', counted)
+    monkeypatch.setattr(imports, 'IMPORT_BATCH_SIZE', 2)
+    progress = []
+
+    async def report(imported, total):
+        progress.append((imported, total))
+
+    async with async_session() as db:
+        db.add(User(id=1, username='author', email='author@example.com', password_hash='x'))
+        await db.commit()
+        story_id = await story_import_service.import_story(StoryArchive(upload), 1, "Imported", "A blurb", db, redis, report)
+
+    async with async_session() as db:
+        chapters = (await db.exec(select(Chapter).where(Chapter.story_id == story_id).order_by(Chapter.id))).all()
+    await engine.dispose()
+
+    assert threading.get_ident() not in threads
+    assert progress == [(2, None), (4, None), (5, None), (5, 5)]
+    assert [chapter.title for chapter in chapters] == [f"Chapter {n}" for n in range(1, 6)]
+    # stored compressed once, so it reads back as the text
+    assert [chapter.content for chapter in chapters] == [' '.join(["word"] * 300 * n) for n in range(1, 6)]
+    assert [chapter.word_count for chapter in chapters] == [300 * n for n in range(1, 6)]
+    assert not any(chapter.is_published for chapter in chapters)
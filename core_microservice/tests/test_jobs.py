@@ -0,0 +1,181 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from src.background.jobs import GROUP, Worker, dead_letter_key, get_status, job, status_key, stream_key
+from src.cache import get_redis
+from src.routes import jobs as jobs_routes
+from src.schema import AuthenticatedUser
+from src.services.auth import get_current_active_user
+from src.settings import app_config
+
+pytestmark = pytest.mark.anyio
+
+QUEUE = 'tests'
+
+
+class Attempt(BaseModel):
+    # how many times the handler fails before it succeeds
+    failures: int
+
+
+# attempts seen by the handler, by the payload's failure count
+seen = []
+
+
+@job(queue=QUEUE, name='tests.flaky', max_retries=1)
+async def flaky(payload: Attempt) -> int:
+    seen.append(payload.failures)
+    if seen.count(payload.failures) <= payload.failures:
+        raise RuntimeError("flaked")
+    return len(seen)
+
+
+@pytest.fixture(autouse=True)
+def clear_seen():
+    seen.clear()
+
+
+async def enqueue(redis, failures: int, owner_id=None) -> str:
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+    await worker._ensure_group(QUEUE)
+    return await flaky.enqueue(redis, Attempt(failures=failures), owner_id=owner_id)
+
+
+async def read(worker: Worker):
+    # hand one message to the worker, the way _consume does
+    response = await worker.redis.xreadgroup(GROUP, worker.consumer, {stream_key(QUEUE): '>'}, count=1)
+    [(_, [(message_id, fields)])] = response
+    return message_id, fields
+
+
+async def claim(worker: Worker):
+    # take over every pending message, as _reclaim does once they have sat long enough
+    pending = await worker.redis.xpending_range(stream_key(QUEUE), GROUP, '-', '+', 100)
+    return await worker.redis.xclaim(stream_key(QUEUE), GROUP, worker.consumer, 0, [entry['message_id'] for entry in pending])
+
+
+async def test_a_job_is_acknowledged_once_it_is_done(redis):
+    job_id = await enqueue(redis, failures=0)
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+
+    await worker._process(QUEUE, *await read(worker))
+
+    status = await get_status(redis, job_id)
+    assert status['state'] == 'done'
+    assert status['attempts'] == '1'
+    assert status['result'] == '1'
+    assert (await redis.xpending(stream_key(QUEUE), GROUP))['pending'] == 0
+    assert worker.processed == 1
+
+
+async def test_a_failed_job_stays_pending_and_succeeds_on_retry(redis):
+    job_id = await enqueue(redis, failures=1)
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+
+    await worker._process(QUEUE, *await read(worker))
+    status = await get_status(redis, job_id)
+    assert status['state'] == 'failed'
+    assert status['error'] == 'flaked'
+    assert (await redis.xpending(stream_key(QUEUE), GROUP))['pending'] == 1
+
+    [(message_id, fields)] = await claim(worker)
+    await worker._process(QUEUE, message_id, fields)
+    status = await get_status(redis, job_id)
+    assert status['state'] == 'done'
+    assert status['attempts'] == '2'
+    assert (await redis.xpending(stream_key(QUEUE), GROUP))['pending'] == 0
+
+
+async def test_a_job_out_of_retries_is_dead_lettered(redis):
+    job_id = await enqueue(redis, failures=5)
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+
+    await worker._process(QUEUE, *await read(worker))
+    [(message_id, fields)] = await claim(worker)
+    await worker._process(QUEUE, message_id, fields)
+
+    status = await get_status(redis, job_id)
+    assert status['state'] == 'dead'
+    assert status['error'] == 'Gave up after 2 attempts: flaked'
+    assert (await redis.xpending(stream_key(QUEUE), GROUP))['pending'] == 0
+    [(_, dead)] = await redis.xrange(dead_letter_key(QUEUE))
+    assert dead[b'id'].decode() == job_id
+    assert dead[b'error'] == b'Gave up after 2 attempts: flaked'
+
+
+async def test_a_job_whose_worker_died_on_its_last_attempt_is_dead_lettered(redis):
+    job_id = await enqueue(redis, failures=0)
+    first = Worker(redis, {QUEUE: 1}, consumer='first')
+    # both attempts were read and never finished
+    await read(first)
+    await redis.hset(status_key(job_id), 'attempts', 2)
+
+    second = Worker(redis, {QUEUE: 1}, consumer='second')
+    [(message_id, fields)] = await claim(second)
+    await second._process(QUEUE, message_id, fields)
+
+    assert seen == []
+    assert (await get_status(redis, job_id))['state'] == 'dead'
+    assert await redis.xlen(dead_letter_key(QUEUE)) == 1
+
+
+async def test_an_unknown_job_is_dead_lettered_without_retrying(redis):
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+    await worker._ensure_group(QUEUE)
+    await redis.xadd(stream_key(QUEUE), {'id': 'gone', 'job': 'tests.removed', 'payload': '{}'})
+
+    await worker._process(QUEUE, *await read(worker))
+
+    assert (await get_status(redis, 'gone'))['state'] == 'dead'
+    assert (await redis.xpending(stream_key(QUEUE), GROUP))['pending'] == 0
+
+
+async def test_a_job_left_by_a_dead_worker_is_claimed_by_another(redis, monkeypatch):
+    monkeypatch.setattr(app_config, 'JOB_RETRY_AFTER_MS', 20)
+    job_id = await enqueue(redis, failures=0)
+    await read(Worker(redis, {QUEUE: 1}, consumer='first'))
+
+    second = Worker(redis, {QUEUE: 1}, consumer='second')
+    reclaim = asyncio.create_task(second._reclaim(QUEUE))
+    try:
+        for _ in range(100):
+            if second.processed:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        reclaim.cancel()
+
+    assert second.processed == 1
+    assert (await get_status(redis, job_id))['state'] == 'done'
+
+
+async def test_a_status_that_expired_mid_job_gets_its_ttl_back(redis):
+    job_id = await enqueue(redis, failures=0)
+    worker = Worker(redis, {QUEUE: 1}, consumer='first')
+    message_id, fields = await read(worker)
+    await redis.delete(status_key(job_id))
+
+    await worker._process(QUEUE, message_id, fields)
+
+    assert 0 < await redis.ttl(status_key(job_id)) <= app_config.JOB_STATUS_TTL
+
+
+def test_only_the_owner_sees_a_job(redis):
+    app = FastAPI()
+    app.include_router(jobs_routes.router)
+    app.dependency_overrides[get_redis] = lambda: redis
+    user = AuthenticatedUser(id=1, username='owner', email='owner@example.com')
+    app.dependency_overrides[get_current_active_user] = lambda: user
+
+    with TestClient(app) as client:
+        owned = client.portal.call(enqueue, redis, 0, 1)
+        others = client.portal.call(enqueue, redis, 0, 2)
+        internal = client.portal.call(enqueue, redis, 0)
+
+        response = client.get(f'/api/jobs/{owned}')
+        assert response.status_code == 200
+        assert response.json()['state'] == 'queued'
+        for job_id in (others, internal, 'missing'):
+            assert client.get(f'/api/jobs/{job_id}').status_code == 404
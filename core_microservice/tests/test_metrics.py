@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from prometheus_client import CollectorRegistry, Histogram, generate_latest
+import src.middleware.metrics as metrics
+from src.middleware.metrics import LABELS, LATENCY_BUCKETS, REQUEST_LATENCY, SIZE_BUCKETS, RequestMetrics
+
+# values on bucket bounds included, they count in that bucket
+SAMPLES = [
+    ('GET', '/api/stories/{id}', 200, 0.005, 100),
+    ('GET', '/api/stories/{id}', 200, 0.0421, 5_000),
+    ('GET', '/api/stories/{id}', 304, 12.0, 20_000_000),
+    ('POST', '/api/chapters/', 201, 0.3, 1_000),
+]
+
+
+def test_single_process_totals_read_as_histograms_would():
+    request_metrics = RequestMetrics(multiprocess=False)
+    registry = CollectorRegistry()
+    registry.register(request_metrics)
+
+    expected = CollectorRegistry()
+    latency = Histogram(*metrics.LATENCY_METRIC, LABELS, buckets=LATENCY_BUCKETS, registry=expected)
+    response_size = Histogram(*metrics.SIZE_METRIC, LABELS, buckets=SIZE_BUCKETS, registry=expected)
+    for method, route, status, elapsed, size in SAMPLES:
+        request_metrics.observe(method, route, status, elapsed, size)
+        latency.labels(method, route, str(status)).observe(elapsed)
+        response_size.labels(method, route, str(status)).observe(size)
+
+    # the histograms also export when each series was created, which the totals leave out
+    created = lambda text: [line for line in text.decode().splitlines() if '_created' not in line]
+    assert created(generate_latest(registry)) == created(generate_latest(expected))
+
+
+@pytest.mark.anyio
+async def test_a_multiprocess_flush_lets_the_loop_run_between_chunks(monkeypatch):
+    monkeypatch.setattr(metrics, 'FLUSH_CHUNK', 2)
+    request_metrics = RequestMetrics(multiprocess=True)
+    for n in range(5):
+        request_metrics.observe('GET', '/flushed-in-chunks', 200, 0.01 * n, 100)
+
+    turns = 0
+    flush = asyncio.create_task(request_metrics.flush())
+    while not flush.done():
+        turns += 1
+        await asyncio.sleep(0)
+
+    assert turns == 3
+    count = next(
+        sample.value for metric in REQUEST_LATENCY.collect() for sample in metric.samples
+        if sample.name.endswith('_count') and sample.labels['route'] == '/flushed-in-chunks'
+    )
+    assert count == 5
@@ -0,0 +1,34 @@
+import pytest
+from fastapi import HTTPException
+from src.routes.chapters import _parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    # malformed or multiple ranges get the full body
+    ('bytes=5', None),
+    ('bytes=a-b', None),
+    ('items=0-99', None),
+    ('bytes=0-1,5-9', None),
+])
+def test_ranges(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header, length', [
+    ('bytes=1000-', 1000),
+    ('bytes=50-10', 1000),
+    ('bytes=-0', 1000),
+    ('bytes=0-', 0),
+    ('bytes=-10', 0),
+])
+def test_unsatisfiable_ranges(header, length):
+    with pytest.raises(HTTPException) as error:
+        _parse_range(header, length)
+    assert error.value.status_code == 416
+    assert error.value.headers['Content-Range'] == f"bytes */{length}"
@@ -0,0 +1,162 @@
+import io
+import os
+import zipfile
+import pytest
+from redis.exceptions import RedisError
+from sqlmodel import SQLModel
+from starlette.requests import Request
+import src.database as database
+from src.database import ReplicaRouter, _session_factory, _sticky_key, async_session
+from src.models import Chapter, Story, User
+from src.settings import app_config
+from src.schema import AuthenticatedUser
+from tests.conftest import TEST_DIR, token_for
+
+pytestmark = pytest.mark.anyio
+
+
+def request(method: str = 'GET', token: str = 'reader') -> Request:
+    return Request({
+        'type': 'http',
+        'method': method,
+        'path': '/api/stories/',
+        'headers': [(b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 50000),
+    })
+
+
+def replica_router(monkeypatch) -> ReplicaRouter:
+    # a second sqlite file stands in for the replica, and a path that cannot be opened for a dead one
+    router = ReplicaRouter([
+        f"sqlite:///{os.path.join(TEST_DIR, 'replica.db')}",
+        f"sqlite:///{os.path.join(TEST_DIR, 'missing', 'replica.db')}",
+    ])
+    monkeypatch.setattr(database, 'replica_router', router)
+    return router
+
+
+async def dispose(router: ReplicaRouter) -> None:
+    # on the loop the connections were made in, aiosqlite cannot close them once it is gone
+    for engine in router.engines:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def replicas(monkeypatch):
+    router = replica_router(monkeypatch)
+    yield router
+    await dispose(router)
+
+
+@pytest.fixture
+def routed(client, monkeypatch):
+    # the replicas behind the routes, with the same rows written differently to each database
+    router = replica_router(monkeypatch)
+
+    async def setup():
+        async with router.engines[0].begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+        await _seed(async_session, 'On the primary')
+        await _seed(router.sessions[0], 'On the replica')
+        await router._check(0)
+
+    client.portal.call(setup)
+    yield router
+    client.portal.call(dispose, router)
+
+
+async def test_without_replicas_everything_uses_the_primary(monkeypatch, redis):
+    monkeypatch.setattr(database, 'replica_router', ReplicaRouter([]))
+
+    assert await _session_factory(request('GET'), redis) is async_session
+    assert await _session_factory(request('POST'), redis) is async_session
+    # with no replica there is no read-your-writes window to keep
+    assert await redis.keys('db:primary:*') == []
+
+
+async def test_nothing_is_read_from_a_replica_before_its_health_check(replicas, redis):
+    assert await _session_factory(request('GET'), redis) is async_session
+
+
+async def test_reads_go_to_healthy_replicas_only(replicas, redis):
+    await replicas._check(0)
+    await replicas._check(1)
+    assert replicas.healthy == [True, False]
+
+    for _ in range(4):
+        assert await _session_factory(request('GET'), redis) is replicas.sessions[0]
+
+
+async def test_no_healthy_replica_falls_back_to_the_primary(replicas, redis):
+    await replicas._check(1)
+    assert await _session_factory(request('GET'), redis) is async_session
+
+
+async def test_writes_go_to_the_primary_and_keep_the_callers_reads_there(replicas, redis):
+    await replicas._check(0)
+
+    assert await _session_factory(request('POST', 'writer'), redis) is async_session
+    sticky = _sticky_key(request('GET', 'writer'))
+    assert 0 < await redis.ttl(sticky) <= app_config.DATABASE_READ_YOUR_WRITES_SECONDS
+
+    # the writer reads its own writes, everyone else keeps reading from the replica
+    assert await _session_factory(request('GET', 'writer'), redis) is async_session
+    assert await _session_factory(request('GET', 'reader'), redis) is replicas.sessions[0]
+
+    # once the window is over the writer is back on the replica
+    await redis.delete(sticky)
+    assert await _session_factory(request('GET', 'writer'), redis) is replicas.sessions[0]
+
+
+async def test_reads_use_the_primary_when_redis_is_down(replicas, redis, monkeypatch):
+    await replicas._check(0)
+
+    async def unavailable(*args, **kwargs):
+        raise RedisError("connection refused")
+    monkeypatch.setattr(redis, 'exists', unavailable)
+
+    assert await _session_factory(request('GET'), redis) is async_session
+
+
+async def _seed(session_factory, title: str) -> None:
+    async with session_factory() as db:
+        db.add(User(id=1, username='author', email='author@example.com', password_hash='x'))
+        db.add(Story(id=1, user_id=1, name=title, blurb='A blurb'))
+        db.add(Chapter(id=1, story_id=1, title=title, content='Some text', is_published=True))
+        await db.commit()
+
+
+def test_routes_read_from_the_replica_and_write_to_the_primary(client, routed):
+    toc = lambda **kwargs: client.get('/api/chapters/story/1/toc', **kwargs).json()['chapters'][0]['title']
+    writer = token_for(AuthenticatedUser(id=2, username='writer', email='writer@example.com'))
+    reader = token_for(AuthenticatedUser(id=3, username='reader', email='reader@example.com'))
+
+    assert toc() == 'On the replica'
+    # a write from the caller, refused or not, pins its next reads to the primary
+    client.delete('/api/chapters/1', headers=writer)
+    assert toc(headers=writer) == 'On the primary'
+    assert toc(headers=reader) == 'On the replica'
+
+
+def test_shared_caches_are_only_filled_from_the_primary(client, routed):
+    # a lagging replica must not put its rows into the caches every reader shares
+    response = client.get('/api/stories/1')
+    assert response.status_code == 200
+    assert response.json()['name'] == 'On the primary'
+    assert client.get('/api/stories/1', headers={'If-None-Match': response.headers['etag']}).status_code == 304
+
+    response = client.get('/api/chapters/1')
+    assert response.json()['title'] == 'On the replica'
+    assert client.get('/api/chapters/1', headers={'If-None-Match': response.headers['etag']}).status_code == 304
+
+
+def test_an_export_reads_where_the_request_would(client, routed):
+    def exported(headers) -> str:
+        response = client.get('/api/stories/1/export', params={'format': 'zip'}, headers=headers)
+        return zipfile.ZipFile(io.BytesIO(response.content)).read('chapter-1.md').decode()
+
+    writer = token_for(AuthenticatedUser(id=2, username='writer', email='writer@example.com'))
+    assert exported({}).startswith('# On the replica')
+    client.delete('/api/chapters/1', headers=writer)
+    assert exported(writer).startswith('# On the primary')
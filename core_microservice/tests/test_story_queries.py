@@ -0,0 +1,71 @@
+import re
+import pytest
+from src.database import async_session
+from src.models import Story, StoryStats, User
+
+STORY_COUNT = 25
+
+
+def queries(response) -> int:
+    # statements the request ran, from the Server-Timing header QueryStatsMiddleware adds
+    return int(re.search(r'desc="(\d+) queries"', response.headers['server-timing']).group(1))
+
+
+@pytest.fixture
+def story_ids(client):
+    async def seed():
+        async with async_session() as db:
+            authors = [User(username=f"author{i}", email=f"author{i}@example.com", password_hash='x') for i in range(5)]
+            db.add_all(authors)
+            await db.flush()
+            stories = [
+                Story(user_id=authors[i % len(authors)].id, name=f"Story {i}", blurb="A blurb")
+                for i in range(STORY_COUNT)
+            ]
+            db.add_all(stories)
+            await db.flush()
+            db.add_all(StoryStats(story_id=story.id, chapter_count=3, word_count=1200) for story in stories[::2])
+            await db.commit()
+            return [story.id for story in stories]
+
+    return client.portal.call(seed)
+
+
+def test_page_listing_stays_within_two_statements(client, story_ids):
+    response = client.get('/api/stories/', params={'page': 1, 'page_size': STORY_COUNT})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body['stories']) == STORY_COUNT
+    assert {story['author']['username'] for story in body['stories']} == {f"author{i}" for i in range(5)}
+    assert queries(response) <= 2
+
+
+def test_cursor_listing_stays_within_two_statements(client, story_ids):
+    response = client.get('/api/stories/', params={'page_size': 10, 'sort_by': 'created_at'})
+    assert response.status_code == 200
+    assert queries(response) <= 2
+
+    response = client.get('/api/stories/', params={'page_size': 10, 'sort_by': 'created_at', 'cursor': response.json()['next_cursor']})
+    assert response.status_code == 200
+    assert len(response.json()['stories']) == 10
+    assert queries(response) <= 2
+
+
+def test_detail_stays_within_two_statements(client, story_ids):
+    response = client.get(f'/api/stories/{story_ids[0]}')
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body['author']['username'] == 'author0'
+    assert body['stats']['chapter_count'] == 3
+    assert queries(response) <= 2
+
+
+def test_cached_reads_run_no_statements(client, story_ids):
+    for _ in range(2):
+        listing = client.get('/api/stories/', params={'page': 1})
+        detail = client.get(f'/api/stories/{story_ids[1]}')
+
+    assert queries(listing) == 0
+    assert queries(detail) == 0